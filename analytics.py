@@ -0,0 +1,302 @@
+import asyncio
+import importlib.util
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import WEEKLY_KEY_PREFIX, XP_SOURCES
+
+# ========================
+# ANALYTICS
+# ========================
+
+# Quest, retention, streak and progression statistics for one guild, computed
+# with NumPy (`pip install numpy`) over columnar copies of xp_log and the
+# claim tables. Only the guild's rows are streamed from a storage snapshot in
+# chunks and every bit of array work runs on its own thread, so the loop keeps
+# serving and a chunk is converted while the next one is fetched.
+CHUNK_SIZE = 50_000
+DAY = 86_400
+ACTIVE_SOURCES = ("quest", "weekly", "story")
+STREAK_SOURCES = ("quest", "weekly")
+STREAK_POINTS = (1, 2, 3, 5, 7, 14, 30)
+COHORT_WEEKS = 8
+
+def analytics_available():
+    return importlib.util.find_spec("numpy") is not None
+
+# xp_log in log order: user ids, each user's index into `members`, XP deltas,
+# local day numbers and XP_SOURCES indexes. claims: user ids, quest key
+# indexes and completion counts, from quest_completions and quest_claims.
+Tables = namedtuple(
+    "Tables", "members users member xp days sources quest_keys claim_users claim_keys claim_counts"
+)
+
+def completion_key(key):
+    if key.startswith(WEEKLY_KEY_PREFIX) and len(key) > 11 and key[-11] == "_":
+        return key[:-11]  # weekly_<rank>_<week start>
+    return key
+
+def utc_seconds(timestamp):
+    # ledger timestamps are UTC, and numpy won't parse the "+00:00"
+    return timestamp[:19] if timestamp else "1970-01-01T00:00:00"
+
+def convert_log_chunk(rows, utc_offset):
+    import numpy as np
+
+    source_index = {source: i for i, source in enumerate(XP_SOURCES)}
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    users = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+    xp = np.fromiter((row[3] or 0 for row in rows), dtype=np.int64, count=len(rows))
+    stamps = np.array([utc_seconds(row[4]) for row in rows], dtype="datetime64[s]")
+    days = (stamps.astype(np.int64) + utc_offset) // DAY
+    sources = np.fromiter(
+        (source_index.get(row[5] or "opening", 0) for row in rows), dtype=np.int8, count=len(rows)
+    )
+    return ids, users, xp, days, sources
+
+def convert_claim_chunk(rows, key_index, user_col, key_col, count_col):
+    import numpy as np
+
+    users = np.fromiter((row[user_col] for row in rows), dtype=np.int64, count=len(rows))
+    keys = np.fromiter(
+        (key_index.setdefault(completion_key(row[key_col]), len(key_index)) for row in rows),
+        dtype=np.int32, count=len(rows)
+    )
+    counts = np.fromiter(
+        ((row[count_col] if count_col is not None else 1) for row in rows), dtype=np.int64, count=len(rows)
+    )
+    return users, keys, counts
+
+async def convert_chunks(chunks, executor, convert, *args):
+    """Run convert(rows, *args) on each chunk, one in flight while the next is fetched"""
+    loop = asyncio.get_running_loop()
+    parts, pending = [], None
+    async for rows in chunks:
+        if pending is not None:
+            parts.append(await pending)
+        pending = loop.run_in_executor(executor, convert, rows, *args)
+    if pending is not None:
+        parts.append(await pending)
+    return parts
+
+async def load_tables(storage, guild_id, utc_offset=0, chunk_size=CHUNK_SIZE):
+    """Stream the guild's rows out of a storage snapshot into a Tables of arrays"""
+    import numpy as np
+
+    loop = asyncio.get_running_loop()
+    key_index = {}
+    # one worker, so chunks convert in order and key_index has a single writer
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics")
+
+    try:
+        async with storage.snapshot(guild_id) as snapshot:
+            log_parts = await convert_chunks(
+                snapshot.chunks("xp_log", chunk_size), executor, convert_log_chunk, utc_offset
+            )
+            claim_parts = await convert_chunks(
+                snapshot.chunks("quest_completions", chunk_size), executor,
+                convert_claim_chunk, key_index, 1, 2, 4
+            )
+            claim_parts += await convert_chunks(
+                snapshot.chunks("quest_claims", chunk_size), executor,
+                convert_claim_chunk, key_index, 1, 2, None
+            )
+    finally:
+        executor.shutdown(wait=False)
+
+    def assemble():
+        def column(parts, i, dtype):
+            return np.concatenate([part[i] for part in parts]) if parts else np.empty(0, dtype=dtype)
+
+        order = np.argsort(column(log_parts, 0, np.int64), kind="stable")
+        users = column(log_parts, 1, np.int64)[order]
+        members, member = np.unique(users, return_inverse=True)
+        return Tables(
+            members=members,
+            users=users,
+            member=member,
+            xp=column(log_parts, 2, np.int64)[order],
+            days=column(log_parts, 3, np.int64)[order],
+            sources=column(log_parts, 4, np.int8)[order],
+            quest_keys=list(key_index),
+            claim_users=column(claim_parts, 0, np.int64),
+            claim_keys=column(claim_parts, 1, np.int32),
+            claim_counts=column(claim_parts, 2, np.int64),
+        )
+
+    return await loop.run_in_executor(None, assemble)
+
+def source_mask(tables, sources):
+    import numpy as np
+    return np.isin(tables.sources, [XP_SOURCES.index(source) for source in sources])
+
+def pair_keys(first, second, second_span):
+    """Fold two small non-negative int arrays into one, so pairs sort and unique as scalars"""
+    return first.astype("int64") * second_span + second
+
+def completion_by_quest(tables):
+    """Return [(quest_key, completions, members who completed it, share of active members)]"""
+    import numpy as np
+
+    if not len(tables.claim_keys):
+        return []
+
+    key_count = len(tables.quest_keys)
+    completions = np.bincount(tables.claim_keys, weights=tables.claim_counts, minlength=key_count)
+    claimers, claimer = np.unique(tables.claim_users, return_inverse=True)
+    pairs = np.unique(pair_keys(tables.claim_keys, claimer, len(claimers)))
+    completers = np.bincount(pairs // len(claimers), minlength=key_count)
+    active = len(claimers)
+
+    rows = [
+        (key, int(completions[i]), int(completers[i]), completers[i] / active)
+        for i, key in enumerate(tables.quest_keys)
+    ]
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+def cohort_retention(tables, weeks=COHORT_WEEKS):
+    """
+    Members grouped by the week of their first activity. Returns
+    [(cohort week start day, size, [share active in week 0, 1, ...])]
+    for the last `weeks` cohorts.
+    """
+    import numpy as np
+
+    active = source_mask(tables, ACTIVE_SOURCES)
+    if not active.any():
+        return []
+
+    week = (tables.days[active] + 3) // 7  # Monday-based, day 0 was a Thursday
+    first_week_seen = week.min()
+    span = int(week.max() - first_week_seen) + 1
+
+    # one entry per (member, week) they were active in, sorted by member then week
+    seen = np.unique(pair_keys(tables.member[active], week - first_week_seen, span))
+    member, week = seen // span, seen % span + first_week_seen
+    starts = np.flatnonzero(np.diff(member, prepend=-1))
+    first_week = np.full(len(tables.members), week.max() + 1, dtype=np.int64)
+    first_week[member[starts]] = week[starts]
+    offset = week - first_week[member]
+    last_week = week.max()
+
+    result = []
+    for cohort in np.unique(week[starts])[-weeks:]:
+        in_cohort = first_week == cohort
+        size = int(in_cohort.sum())
+        hits = in_cohort[member] & (offset < weeks)
+        counts = np.bincount(offset[hits], minlength=weeks)
+        elapsed = min(weeks, int(last_week - cohort) + 1)
+        result.append((int(cohort) * 7 - 3, size, [counts[i] / size for i in range(elapsed)]))
+    return result
+
+def streak_survival(tables, points=STREAK_POINTS):
+    """
+    Kaplan-Meier survival of quest streaks: the share of streaks that reach
+    each day count. Streaks still running at the end of the log are censored,
+    and day counts no streak has lasted to yet are left out. Returns [(days, share)].
+    """
+    import numpy as np
+
+    mask = source_mask(tables, STREAK_SOURCES)
+    if not mask.any():
+        return []
+
+    days = tables.days[mask]
+    first_day = days.min()
+    span = int(days.max() - first_day) + 1
+    seen = np.unique(pair_keys(tables.member[mask], days - first_day, span))
+    member, days = seen // span, seen % span + first_day
+    breaks = np.flatnonzero((np.diff(member) != 0) | (np.diff(days) != 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(days)]])
+    lengths = ends - starts
+    # a streak whose last day is the log's last day (or the one before) may continue
+    censored = days[ends - 1] >= days.max() - 1
+
+    survival, result = 1.0, []
+    max_point = max(points)
+    at_risk = np.bincount(lengths, minlength=max_point + 2)[::-1].cumsum()[::-1]
+    ended = np.bincount(lengths[~censored], minlength=max_point + 2)
+    for k in range(1, max_point + 1):
+        if not at_risk[k]:
+            break
+        if k in points:
+            result.append((k, survival))
+        survival *= 1 - ended[k] / at_risk[k]
+    return result
+
+def rank_progression(tables, rank_floors):
+    """
+    Days from a member's first XP to each rank's floor. Members with an
+    opening balance (XP from before the ledger) are left out. Returns
+    [(rank number, members who reached it, median days, 75th percentile days)].
+    """
+    import numpy as np
+
+    if not len(tables.users):
+        return []
+
+    opened = np.zeros(len(tables.members), dtype=bool)
+    opened[tables.member[tables.sources == XP_SOURCES.index("opening")]] = True
+    keep = ~opened[tables.member]
+    # chronological within each member, log order within a day
+    order = np.lexsort((tables.days[keep], tables.member[keep]))
+    member = tables.member[keep][order]
+    xp = tables.xp[keep][order]
+    days = tables.days[keep][order]
+    if not len(member):
+        return []
+
+    first_index = np.flatnonzero(np.diff(member, prepend=-1))
+    events = np.diff(first_index, append=len(member))
+    total = np.cumsum(xp)
+    # each member's running balance is the running total minus everything before their first event
+    balance = total - np.repeat(total[first_index] - xp[first_index], events)
+    start_days = np.repeat(days[first_index], events)
+
+    result = []
+    for rank, floor in enumerate(rank_floors[1:], start=2):
+        reached = np.flatnonzero(balance >= floor)
+        reached_members, first_reached = np.unique(member[reached], return_index=True)
+        if not len(reached_members):
+            result.append((rank, 0, None, None))
+            continue
+        first = reached[first_reached]
+        taken = days[first] - start_days[first]
+        result.append((rank, len(reached_members), float(np.median(taken)), float(np.percentile(taken, 75))))
+    return result
+
+def format_report(tables, rank_names, rank_floors):
+    from datetime import date, timedelta
+
+    lines = [f"{len(tables.users)} ledger events, {len(tables.claim_keys)} claim rows", ""]
+
+    lines.append("Quest completions (completions, members, share of active members):")
+    lines += [
+        f"  {key:<22} {completions:8d} {completers:7d}  {share:6.1%}"
+        for key, completions, completers, share in completion_by_quest(tables)
+    ] or ["  no claims yet"]
+
+    lines += ["", f"Weekly retention by first-activity cohort (week 0..{COHORT_WEEKS - 1}):"]
+    lines += [
+        f"  {date(1970, 1, 1) + timedelta(days=start_day)} ({size:5d})  " + " ".join(f"{share:4.0%}" for share in shares)
+        for start_day, size, shares in cohort_retention(tables)
+    ] or ["  no activity yet"]
+
+    lines += ["", "Streak survival (share of streaks reaching N days):"]
+    survival = streak_survival(tables)
+    lines.append("  " + "  ".join(f"{days}d {share:.0%}" for days, share in survival) if survival else "  no streaks yet")
+
+    lines += ["", "Days from first XP to rank (members, median, p75):"]
+    lines += [
+        f"  {rank_names[rank]:<10} {reached:7d}  " + (f"{median:6.1f} {p75:6.1f}" if reached else "     -      -")
+        for rank, reached, median, p75 in rank_progression(tables, rank_floors)
+    ] or ["  no members without an opening balance"]
+
+    return "\n".join(lines) + "\n"
+
+async def guild_report(storage, guild_id, rank_names, rank_floors, utc_offset=0):
+    """Load the guild's tables and return the text report"""
+    tables = await load_tables(storage, guild_id, utc_offset)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, format_report, tables, rank_names, rank_floors)
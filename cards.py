@@ -0,0 +1,92 @@
+import asyncio
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# ========================
+# PROFILE CARDS
+# ========================
+
+# Optional PNG profile cards, drawn with Pillow (`pip install Pillow`).
+CARD_SIZE = (640, 200)
+CARD_CACHE_SIZE = 512
+CARD_BACKGROUND = (32, 34, 37)
+CARD_TEXT = (255, 255, 255)
+CARD_MUTED = (185, 187, 190)
+CARD_TRACK = (64, 68, 75)
+
+def cards_available():
+    return importlib.util.find_spec("PIL") is not None
+
+def load_font(size):
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()  # Pillow < 10.1 has one fixed size
+
+def render_card(name, rank_name, tier, xp, streak, goal_label, xp_to_go, progress, color):
+    """Draw a profile card and return it as PNG bytes"""
+    from PIL import Image, ImageDraw
+
+    width, height = CARD_SIZE
+    accent = ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+    image = Image.new("RGB", CARD_SIZE, CARD_BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 8, height), fill=accent)
+
+    draw.text((32, 24), name, font=load_font(32), fill=CARD_TEXT)
+    draw.text((32, 68), f"{rank_name} - Tier {tier}", font=load_font(22), fill=accent)
+    draw.text((width - 32, 30), f"{streak} day streak", font=load_font(20), fill=CARD_MUTED, anchor="ra")
+
+    # progress towards the next tier or rank
+    bar = (32, 120, width - 32, 144)
+    draw.rounded_rectangle(bar, radius=12, fill=CARD_TRACK)
+    filled = bar[0] + round((bar[2] - bar[0]) * max(0.0, min(1.0, progress)))
+    if filled > bar[0] + 24:
+        draw.rounded_rectangle((bar[0], bar[1], filled, bar[3]), radius=12, fill=accent)
+
+    # the default font has no em dash
+    goal_label = goal_label.replace("—", "-")
+    goal = f"{xp_to_go} XP to {goal_label}" if xp_to_go > 0 else goal_label
+    small = load_font(18)
+    draw.text((32, 156), f"{xp} XP", font=small, fill=CARD_TEXT)
+    draw.text((width - 32, 156), goal, font=small, fill=CARD_MUTED, anchor="ra")
+
+    out = BytesIO()
+    image.save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+class CardRenderer:
+    """
+    Renders cards on a dedicated thread and keeps the last `size` PNGs,
+    keyed by everything drawn on them. Concurrent requests for the same
+    card share one render.
+    """
+
+    def __init__(self, size=CARD_CACHE_SIZE):
+        self.size = size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="card")
+
+    async def render(self, *fields):
+        png = self.cache.get(fields)
+        if png is not None:
+            self.cache.move_to_end(fields)
+            return png
+
+        future = self.pending.get(fields)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.pending[fields] = loop.run_in_executor(self.executor, render_card, *fields)
+            future.add_done_callback(lambda _: self.pending.pop(fields, None))
+
+        png = await future
+        self.cache[fields] = png
+        self.cache.move_to_end(fields)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return png
@@ -0,0 +1,125 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+
+# ========================
+# CLOCK
+# ========================
+
+# Everything date-dependent asks one Clock. It keeps the current local day
+# (and its week start) until the next local midnight, so every read within
+# a day agrees and a day costs one date computation. VirtualClock only moves
+# when told to, which lets tests, benchmarks and the simulator run days of
+# scheduler activity in seconds.
+
+class Clock:
+    """The wall clock in timezone `tz`"""
+
+    def __init__(self, tz):
+        self.tz = tz
+        self.day_ends = float("-inf")  # timestamp of the next local midnight
+        self.day = None
+        self.day_iso = None
+        self.week_start_iso = None
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.fromtimestamp(self.time(), self.tz)
+
+    def roll(self):
+        day = self.now().date()
+        self.day = day
+        self.day_iso = day.isoformat()
+        self.week_start_iso = (day - timedelta(days=day.weekday())).isoformat()
+        # local midnight, so a DST change makes a 23 or 25 hour day
+        self.day_ends = self.local(day + timedelta(days=1)).timestamp()
+
+    def local(self, day, hour=0):
+        return datetime(day.year, day.month, day.day, hour, tzinfo=self.tz)
+
+    def today(self):
+        """The local date as an ISO string"""
+        if self.time() >= self.day_ends:
+            self.roll()
+        return self.day_iso
+
+    def date(self):
+        self.today()
+        return self.day
+
+    def week_start(self):
+        """The ISO date of this week's Monday"""
+        self.today()
+        return self.week_start_iso
+
+    def seconds_until(self, hour=0):
+        """Seconds until the next local `hour`:00"""
+        now = self.now()
+        target = self.local(now.date(), hour)
+        if target <= now:
+            target = self.local(now.date() + timedelta(days=1), hour)
+        return target.timestamp() - now.timestamp()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+class VirtualClock(Clock):
+    """
+    A clock standing at `start` (an aware datetime) until advanced. sleep()
+    parks the caller until advance() moves time past its wake-up, and
+    advance() lets each woken task run until it sleeps on the clock again
+    or finishes, in wake-up order.
+    """
+
+    def __init__(self, tz, start):
+        super().__init__(tz)
+        self.timestamp = start.timestamp()
+        self.sleepers = []  # heap of (wake timestamp, sequence, future, task)
+        self.sequence = itertools.count()
+        self.waking = None  # (task, future resolved when it parks again)
+
+    def time(self):
+        return self.timestamp
+
+    def set(self, when):
+        """Jump to `when` without waking anyone, time only moves forward"""
+        timestamp = when.timestamp() if isinstance(when, datetime) else when
+        if timestamp < self.timestamp:
+            raise ValueError("a VirtualClock can't go back in time")
+        self.timestamp = timestamp
+
+    async def sleep(self, seconds):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        task = asyncio.current_task()
+        heapq.heappush(self.sleepers, (self.timestamp + max(0.0, seconds), next(self.sequence), future, task))
+
+        if self.waking and self.waking[0] is task and not self.waking[1].done():
+            self.waking[1].set_result(None)
+        await future
+
+    async def advance(self, seconds):
+        await self.advance_to(self.timestamp + seconds)
+
+    async def advance_to(self, when):
+        """Move to `when` (an aware datetime or a timestamp), running every sleeper due by then"""
+        target = when.timestamp() if isinstance(when, datetime) else when
+        loop = asyncio.get_running_loop()
+
+        while self.sleepers and self.sleepers[0][0] <= target:
+            wake_at, _, future, task = heapq.heappop(self.sleepers)
+            if future.done():
+                continue  # the sleeper was cancelled
+            self.set(max(wake_at, self.timestamp))
+
+            parked = loop.create_future()
+            self.waking = (task, parked)
+            future.set_result(None)
+            await asyncio.wait([parked, task], return_when=asyncio.FIRST_COMPLETED)
+            self.waking = None
+
+        self.set(target)
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from collections import deque
+
+from metrics import OUTBOUND_COALESCED, OUTBOUND_MESSAGES, OUTBOUND_QUEUE_DEPTH, OUTBOUND_WAIT_SECONDS
+
+# ========================
+# OUTBOUND DISPATCHER
+# ========================
+
+# Discord lets a channel take about 5 messages per 5 seconds and a bot about
+# 50 requests per second overall. Sends wait for these proactively instead
+# of running into 429s.
+CHANNEL_RATE = (5, 5.0)
+GLOBAL_RATE = (50, 1.0)
+COALESCE_WINDOW = 1.0
+MESSAGE_LIMIT = 2000
+EMBED_LIMIT = 10
+MAX_IDLE_BUCKETS = 4096
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    @property
+    def idle(self):
+        self.refill()
+        return self.tokens >= self.rate
+
+    async def acquire(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+class Outbound:
+    __slots__ = ("content", "embeds", "view", "allowed_mentions", "edit_id", "coalesce", "queued_at", "futures")
+
+    def __init__(self, content, embeds, view, allowed_mentions, edit_id, coalesce):
+        self.content = content
+        self.embeds = embeds
+        self.view = view
+        self.allowed_mentions = allowed_mentions
+        self.edit_id = edit_id
+        self.coalesce = coalesce
+        self.queued_at = time.monotonic()
+        self.futures = [asyncio.get_running_loop().create_future()]
+
+    def merge(self, other):
+        """Fold `other` into this message if the result is still one valid message"""
+        if not (other.coalesce and other.allowed_mentions is self.allowed_mentions):
+            return False
+
+        content = "\n".join(part for part in (self.content, other.content) if part)
+        if len(content) > MESSAGE_LIMIT or len(self.embeds) + len(other.embeds) > EMBED_LIMIT:
+            return False
+
+        self.content = content or None
+        self.embeds = self.embeds + other.embeds
+        self.futures.extend(other.futures)
+        OUTBOUND_COALESCED.inc()
+        return True
+
+class Dispatcher:
+    """
+    Every outbound message goes through a per-channel queue drained by one
+    task per busy channel. Messages posted with coalesce=True within
+    `window` seconds of each other are sent as one message. A failed send is
+    logged and resolves to None, callers never see the exception.
+    """
+
+    def __init__(self, window=COALESCE_WINDOW, channel_rate=CHANNEL_RATE, global_rate=GLOBAL_RATE):
+        self.window = window
+        self.channel_rate = channel_rate
+        self.global_bucket = TokenBucket(*global_rate)
+        self.buckets = {}  # channel id -> TokenBucket
+        self.queues = {}  # channel id -> deque of Outbound, while a drain task runs
+
+    def post(self, channel, content=None, *, embed=None, view=None, allowed_mentions=None, coalesce=False):
+        """Queue a message, returns a future resolving to the sent Message or None"""
+        message = Outbound(content, [embed] if embed else [], view, allowed_mentions, None, coalesce)
+        self.enqueue(channel, message)
+        return message.futures[0]
+
+    async def send(self, channel, content=None, **kwargs):
+        return await self.post(channel, content, **kwargs)
+
+    def edit(self, channel, message_id, content):
+        """Queue an edit of one of our messages, resolves to the Message or None"""
+        message = Outbound(content, [], None, None, message_id, False)
+        self.enqueue(channel, message)
+        return message.futures[0]
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def enqueue(self, channel, message):
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = self.queues[channel.id] = deque()
+            asyncio.get_running_loop().create_task(self.drain(channel, queue))
+        queue.append(message)
+        OUTBOUND_QUEUE_DEPTH.set(self.depth())
+
+    def bucket(self, channel_id):
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            if len(self.buckets) >= MAX_IDLE_BUCKETS:
+                # a full bucket behaves exactly like a new one
+                self.buckets = {key: b for key, b in self.buckets.items() if not b.idle}
+            bucket = self.buckets[channel_id] = TokenBucket(*self.channel_rate)
+        return bucket
+
+    async def drain(self, channel, queue):
+        message = None
+        try:
+            while queue:
+                first = queue[0]
+                if first.coalesce and self.window:
+                    await asyncio.sleep(max(0.0, first.queued_at + self.window - time.monotonic()))
+
+                message = queue.popleft()
+                try:
+                    if message.coalesce:
+                        while queue and message.merge(queue[0]):
+                            queue.popleft()
+                    OUTBOUND_QUEUE_DEPTH.set(self.depth())
+
+                    await self.bucket(channel.id).acquire()
+                    await self.global_bucket.acquire()
+                    OUTBOUND_WAIT_SECONDS.observe(time.monotonic() - message.queued_at)
+                    result = await self.deliver(channel, message)
+                except Exception as e:
+                    print(f"Error dispatching to {getattr(channel, 'name', channel.id)}: {e}")
+                    result = None
+
+                self.resolve(message, result)
+                message = None
+        finally:
+            # a normal exit found the queue empty without awaiting since, so
+            # only a cancelled drain (shutdown) leaves messages behind, and
+            # their callers get None like for any failed send
+            self.queues.pop(channel.id, None)
+            for pending in [message, *queue]:
+                if pending is not None:
+                    self.resolve(pending, None)
+            OUTBOUND_QUEUE_DEPTH.set(self.depth())
+
+    def resolve(self, message, result):
+        for future in message.futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def deliver(self, channel, message):
+        kwargs = {}
+        if message.allowed_mentions is not None:
+            kwargs["allowed_mentions"] = message.allowed_mentions
+        if message.view is not None:
+            kwargs["view"] = message.view
+
+        try:
+            if message.edit_id:
+                result = await channel.get_partial_message(message.edit_id).edit(content=message.content)
+            else:
+                result = await channel.send(message.content, embeds=message.embeds, **kwargs)
+        except Exception as e:
+            OUTBOUND_MESSAGES.inc(outcome="error")
+            print(f"Error sending to {getattr(channel, 'name', channel.id)}: {e}")
+            return None
+
+        OUTBOUND_MESSAGES.inc(outcome="sent")
+        return result
@@ -0,0 +1,179 @@
+import bisect
+import json
+import os
+import sys
+from collections import namedtuple
+from types import MappingProxyType
+
+# ========================
+# GAME CONFIG
+# ========================
+
+# Game content lives in a TOML (or JSON) file, see game.toml. It is
+# validated and compiled into a read-only GameConfig, so a reload is a single
+# reference swap and nothing can change the content underneath a command.
+QUEST_ROTATIONS = ("random", "seven_day")
+
+class ConfigError(ValueError):
+    pass
+
+Quest = namedtuple("Quest", "key rank xp rotation pool")
+
+class GameConfig(namedtuple("GameConfig", [
+    "source",
+    "channels",      # rank key -> quest channel name
+    "quests",        # daily quest key -> Quest
+    "weekly",        # rank key -> (xp, pool)
+    "rank_access",   # rank number -> quest keys, in posting order
+    "rank_tiers",    # rank name -> tier start XP
+    "rank_floors",   # start XP of rank 1, 2, ...
+    "quest_bits",    # daily quest key -> bit
+    "access_masks",  # rank number -> bitmask of accessible quests
+])):
+    __slots__ = ()
+
+    def rank_for_xp(self, xp):
+        return max(1, bisect.bisect_right(self.rank_floors, xp))
+
+    def can_access(self, rank_number, quest_key):
+        return bool(self.access_masks.get(rank_number, 0) & self.quest_bits.get(quest_key, 0))
+
+def read_config_file(path):
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    if sys.version_info < (3, 11):
+        raise ConfigError("TOML config needs Python 3.11+, use a .json config instead")
+    import tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def is_xp(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+def is_pool(value):
+    return isinstance(value, list) and value and all(isinstance(q, str) and q for q in value)
+
+def get_table(parent, key, errors, path):
+    """parent[key] if it's a table, else {} with an error noted"""
+    value = parent.get(key, {})
+    if not isinstance(value, dict):
+        errors.append(f"{path} must be a table")
+        return {}
+    return value
+
+def compile_config(raw, ranks, source="<memory>"):
+    """
+    Validate raw config data against `ranks` ({number: name}) and compile
+    it. Raises ConfigError listing every problem found.
+    """
+    errors = []
+    if not isinstance(raw, dict):
+        raise ConfigError(f"{source}: must be a table")
+    rank_keys = [name.lower() for _, name in sorted(ranks.items())]
+
+    channels = get_table(raw, "channels", errors, "channels")
+    for key in rank_keys:
+        if not isinstance(channels.get(key), str):
+            errors.append(f"channels.{key} must be a channel name")
+
+    quests = {}
+    for key, quest in get_table(raw, "quests", errors, "quests").items():
+        if not isinstance(quest, dict):
+            errors.append(f"quests.{key} must be a table")
+            continue
+        rank = key.split("_")[0]
+        if rank not in rank_keys:
+            errors.append(f"quests.{key}: key must start with a rank name")
+        if not is_xp(quest.get("xp")):
+            errors.append(f"quests.{key}.xp must be a positive integer")
+        if quest.get("rotation") not in QUEST_ROTATIONS:
+            errors.append(f"quests.{key}.rotation must be one of {', '.join(QUEST_ROTATIONS)}")
+        pool = quest.get("pool")
+        if not is_pool(pool):
+            errors.append(f"quests.{key}.pool must be a non-empty list of quests")
+            pool = ()
+        key = sys.intern(key)
+        quests[key] = Quest(key, rank, quest.get("xp"), quest.get("rotation"), tuple(pool))
+
+    weekly = {}
+    raw_weekly = get_table(raw, "weekly", errors, "weekly")
+    for key in rank_keys:
+        entry = raw_weekly.get(key)
+        if entry is None:
+            errors.append(f"weekly.{key} is missing")
+            continue
+        if not isinstance(entry, dict):
+            errors.append(f"weekly.{key} must be a table")
+            continue
+        if not is_xp(entry.get("xp")):
+            errors.append(f"weekly.{key}.xp must be a positive integer")
+        pool = entry.get("pool")
+        if not is_pool(pool):
+            errors.append(f"weekly.{key}.pool must be a non-empty list of quests")
+            pool = ()
+        weekly[key] = (entry.get("xp"), tuple(pool))
+
+    raw_ranks = get_table(raw, "ranks", errors, "ranks")
+    if list(raw_ranks) != rank_keys:
+        errors.append(f"ranks must be exactly {', '.join(rank_keys)}, in that order")
+
+    floors, rank_tiers, rank_access = [], {}, {}
+    for number, name in sorted(ranks.items()):
+        rank = get_table(raw_ranks, name.lower(), errors, f"ranks.{name.lower()}")
+        floor = rank.get("min_xp")
+        if not isinstance(floor, int) or (floors and floor <= floors[-1]) or (not floors and floor != 0):
+            errors.append(f"ranks.{name.lower()}.min_xp must be 0 for the first rank, then increase")
+            floor = floors[-1] + 1 if floors else 0
+        floors.append(floor)
+
+        tiers = rank.get("tiers", [])
+        if (not isinstance(tiers, list) or not all(isinstance(t, int) for t in tiers)
+                or tiers != sorted(set(tiers)) or (tiers and tiers[0] <= floor)):
+            errors.append(f"ranks.{name.lower()}.tiers must be increasing XP values above min_xp")
+            tiers = []
+        rank_tiers[name] = tuple(tiers)
+
+        access = rank.get("daily_quests", [])
+        if not isinstance(access, list):
+            errors.append(f"ranks.{name.lower()}.daily_quests must be a list of quest keys")
+            access = []
+        known = [key for key in access if isinstance(key, str) and key in quests]
+        for key in access:
+            if key not in known:
+                errors.append(f"ranks.{name.lower()}.daily_quests: unknown quest {key}")
+        rank_access[number] = tuple(sys.intern(key) for key in known)
+
+    for (number, name), next_floor in zip(sorted(ranks.items()), floors[1:]):
+        if rank_tiers[name] and rank_tiers[name][-1] >= next_floor:
+            errors.append(f"ranks.{name.lower()}.tiers must end below the next rank's min_xp")
+
+    if errors:
+        raise ConfigError(f"{source}: " + "; ".join(errors))
+
+    quest_bits = {key: 1 << i for i, key in enumerate(quests)}
+    access_masks = {
+        number: sum(quest_bits[key] for key in set(keys))
+        for number, keys in rank_access.items()
+    }
+
+    return GameConfig(
+        source=source,
+        channels=MappingProxyType({key: channels[key] for key in rank_keys}),
+        quests=MappingProxyType(quests),
+        weekly=MappingProxyType(weekly),
+        rank_access=MappingProxyType(rank_access),
+        rank_tiers=MappingProxyType(rank_tiers),
+        rank_floors=tuple(floors),
+        quest_bits=MappingProxyType(quest_bits),
+        access_masks=MappingProxyType(access_masks),
+    )
+
+def load_game_config(path, ranks):
+    """Read, validate and compile the config file at `path`"""
+    try:
+        raw = read_config_file(path)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"{path}: {e}")
+    return compile_config(raw, ranks, os.path.basename(path))
@@ -1,97 +1,153 @@
-import sqlite3
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 from discord.ui import View, Button
 import os
 import asyncio
+import bisect
+import csv
+import functools
+import itertools
+from collections import OrderedDict, deque, namedtuple
 from datetime import datetime, timedelta
+from io import BytesIO, StringIO
 import random
+import socket
+import threading
+import time
 from zoneinfo import ZoneInfo
-from datetime import timezone
+
+import metrics
+from analytics import analytics_available, guild_report
+from cards import CardRenderer, cards_available
+from clock import Clock
+from dispatch import Dispatcher
+from game_config import ConfigError, load_game_config
+from metrics import COMMAND_ERRORS, COMMAND_SECONDS, TASK_SECONDS, timed
+from profiler import SamplingProfiler
+from rotation import POLICIES
+from storage import WEEKLY_KEY_PREFIX, Storage, open_storage
+from transfer import EXPORT_LAYOUTS, export_state
 
 # ========================
 # DATABASE SETUP
 # ========================
 
-conn = sqlite3.connect("/data/bot.db", check_same_thread=False)
-cursor = conn.cursor()
+# DATABASE_URL picks the backend: a SQLite file path (the default) or a
+# postgresql:// URL. Connected in setup_hook before the gateway starts.
+storage = open_storage(os.getenv("DATABASE_URL", "/data/bot.db"))
+metrics.instrument_storage(storage, Storage)
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    xp INTEGER DEFAULT 0,
-    rank INTEGER DEFAULT 1,
-    streak INTEGER DEFAULT 0,
-    last_quest_date TEXT
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS xp_log (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    xp INTEGER,
-    timestamp TEXT
-)
-""")
-
-# daily quest rotation (stores today's chosen quests)
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS daily_quest_rotation (
-    rank TEXT,
-    quest_key TEXT,
-    quest_name TEXT,
-    xp INTEGER,
-    date TEXT
-)
-""")
-
-# Track used quests for 7-day rotation (for _2 type quests)
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS quest_seven_day_pool (
-    quest_key TEXT,
-    used_quests TEXT,
-    cycle_start TEXT
-)
-""")
-
-# weekly quest rotation
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS weekly_quest_rotation (
-    rank TEXT,
-    quest_name TEXT,
-    xp INTEGER,
-    week_start TEXT
-)
-""")
-
-# quest claim tracking
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS quest_claims (
-    user_id INTEGER,
-    quest_key TEXT,
-    date TEXT
-)
-""")
+# ========================
+# BOT SETUP
+# ========================
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS daily_quest_post_log (
-    date TEXT PRIMARY KEY
-)
-""")
+# Every command is also a slash command. PREFIX_COMMANDS=0 drops the
+# privileged message_content intent: "!" commands then stop working and the
+# text commands only answer when the bot is mentioned.
+PREFIX_COMMANDS = os.getenv("PREFIX_COMMANDS", "1") == "1"
+COMMAND_PREFIX = "!" if PREFIX_COMMANDS else commands.when_mentioned
+
+intents = discord.Intents.default()
+intents.message_content = PREFIX_COMMANDS
+intents.members = True  # member join events
+
+# Which members stay in memory: "none" (default, members come with the
+# events and interactions that need them), "joined" (members who joined
+# since startup) or "all" (every member, chunked at startup).
+MEMBER_CACHE = os.getenv("MEMBER_CACHE", "none")
+MEMBER_CACHE_FLAGS = {
+    "none": discord.MemberCacheFlags.none(),
+    "joined": discord.MemberCacheFlags(joined=True),
+    "all": discord.MemberCacheFlags.from_intents(intents),
+}[MEMBER_CACHE]
+CHUNK_GUILDS = MEMBER_CACHE == "all"
+
+# Sharded mode: SHARD_COUNT total shards, this process owns SHARD_IDS
+# (comma separated, defaults to all of them)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()]
+SHARDED = bool(SHARD_COUNT)
+
+if SHARDED:
+    bot = commands.AutoShardedBot(
+        command_prefix=COMMAND_PREFIX,
+        intents=intents,
+        member_cache_flags=MEMBER_CACHE_FLAGS,
+        chunk_guilds_at_startup=CHUNK_GUILDS,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS or None
+    )
+else:
+    bot = commands.Bot(
+        command_prefix=COMMAND_PREFIX,
+        intents=intents,
+        member_cache_flags=MEMBER_CACHE_FLAGS,
+        chunk_guilds_at_startup=CHUNK_GUILDS
+    )
+bot._ready_ran = False
 
-conn.commit()
+# Outbound messages go through per-channel queues paced to Discord's rate
+# limits, see dispatch.py
+dispatcher = Dispatcher()
+NO_MENTIONS = discord.AllowedMentions.none()
+
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+async def setup_hook():
+    await storage.connect()
+    await claim_index.load()
+    await story_feed.load()
+
+    bot.add_dynamic_items(RankSelectButton)
+
+    # registering slash commands is rate limited, so only when asked to
+    if os.getenv("SYNC_COMMANDS") == "1":
+        synced = await bot.tree.sync()
+        print(f"✅ Synced {len(synced)} slash commands")
+
+    metrics.instrument_http(bot.http)
+    bot.loop.create_task(metrics.monitor_loop_lag())
+
+    # queue workers live as long as the process, so they start here and not
+    # in on_ready, which runs again after gateway reconnects
+    bot.loop.create_task(notification_delete_worker())
+    bot.loop.create_task(join_worker())
+    bot.loop.create_task(role_worker())
+    if METRICS_PORT:
+        await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+bot.setup_hook = setup_hook
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_timer(ctx):
+    command = ctx.command.qualified_name
+    started_at = getattr(ctx, "started_at", None)
+    if started_at is not None:
+        COMMAND_SECONDS.observe(time.perf_counter() - started_at, command=command)
+    if ctx.command_failed:
+        COMMAND_ERRORS.inc(command=command)
 
 # ========================
-# BOT SETUP
+# SHARD COORDINATION
 # ========================
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+ROTATION_LEASE = "daily_rotation"
+LEASE_SECONDS = 15 * 60
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-bot._ready_ran = False
+async def acquire_lease(name, ttl=LEASE_SECONDS):
+    """Take or renew lease `name` for this process. Returns True if we hold it"""
+    return await storage.acquire_lease(name, INSTANCE_ID, ttl)
+
+async def release_lease(name):
+    await storage.release_lease(name, INSTANCE_ID)
 
 # ========================
 # TIMEZONE
@@ -99,13 +155,15 @@ bot._ready_ran = False
 
 TZ = ZoneInfo("America/New_York")
 
+# Every date and sleep below goes through `clock`, see clock.py. Tools swap
+# in a VirtualClock to run days in seconds.
+clock = Clock(TZ)
+
 def today_est():
-    return datetime.now(TZ).date().isoformat()
+    return clock.today()
 
 def week_start_est():
-    now = datetime.now(TZ)
-    start = now - timedelta(days=now.weekday())
-    return start.date().isoformat()
+    return clock.week_start()
 
 # ========================
 # CHANNEL PERMISSIONS
@@ -141,24 +199,6 @@ RANK_COLORS = {
     "Master": 0xF1C40F
 }
 
-# XP thresholds for ranks
-RANK_XP_THRESHOLDS = {
-    1: (0, 150),
-    2: (150, 599),
-    3: (600, 1599),
-    4: (1600, 3199),
-    5: (3200, float("inf"))
-}
-
-# Tier thresholds within ranks
-RANK_TIERS = {
-    "Initiate": [],
-    "Explorer": [300, 450],
-    "Connector": [800, 1000, 1200, 1400],
-    "Leader": [1900, 2200, 2500, 2800],
-    "Master": [4200, 5200, 6200, 7200]
-}
-
 LEADERBOARD_COLORS = {
     "initiate": 0x2ECC71,
     "explorer": 0x3498DB,
@@ -178,200 +218,73 @@ RANK_EMOJIS = {
 }
 
 # ========================
-# QUEST POOLS
+# GAME CONFIG
 # ========================
 
-QUEST_POOLS = {
-    "initiate_1": [
-        "Smile at 5 people.",
-        "Say 'Hi' or 'Good morning' to 3 people.",
-        "Make eye contact with 5 strangers."
-    ],
-    "initiate_2": [
-        "Sit in a public place for 10 minutes with no phone.",
-        "Walk through a busy street for 10 minutes without headphones.",
-        "Compliment someone's clothing.",
-        "Read or write for 15 minutes in a public place.",
-        "Write 5 sentences about how you felt being around people today.",
-        "Use someone's name after they introduce themselves.",
-        "Thank a service worker."
-    ],
-    "explorer_1": [
-        "Ask a stranger for the time.",
-        "Comment about your surroundings to a stranger.",
-        "Ask a stranger/acquaintance how their day is going."
-    ],
-    "explorer_2": [
-        "Have a 30-second conversation with a barista/cashier",
-        "Ask someone for a food or coffee recommendation.",
-        "Talk to someone while waiting in a queue.",
-        "Ask someone what they're reading/watching.",
-        "Ask someone about a good place to go nearby.",
-        "Ask a stranger for directions (even if you know).",
-        "Ask someone their weekend plans."
-    ],
-    "connector_1": [
-        "Learn someone's name",
-        "Give 3 compliments to strangers.",
-        "Catch up with an acquaintance."
-    ],
-    "connector_2": [
-        "Insert yourself into an existing group conversation.",
-        "Share a small personal truth with someone new.",
-        "Replace texts with voice notes for a day.",
-        "Invite someone for a coffee.",
-        "Give a compliment about someone's personality.",
-        "Ask someone new about their passions.",
-        "Tell a new short personal story to someone."
-    ],
-    "leader_1": [
-        "Start 3 conversations.",
-        "Lead a group conversation.",
-        "Give 3 compliments about a person's energy or personality."
-    ],
-    "leader_2": [
-        "Bring two people together who don't know each other.",
-        "Get to know someone over coffee or a walk.",
-        "Learn the names of 3 new people in one day.",
-        "Stand alone in a busy place for 10 minutes with no phone.",
-        "Ask a group a meaningful question.",
-        "Reflect back someone's feelings in a conversation.",
-        "Sit next to a stranger and start a conversation."
-    ]
-}
-
-WEEKLY_QUESTS = {
-    "initiate": (15, [
-        "Ask someone about their day.",
-        "Ask someone what the time is."
-    ]),
-    "explorer": (30, [
-        "End a conversation early, but confidently and politely.",
-        "Introduce yourself to someone new.",
-        "In an awkward silence, stay present and let others fill the silence."
-    ]),
-    "connector": (45, [
-        "Exchange contact details with someone.",
-        "At a social event, talk to 3 new people.",
-        "Encourage a runner or cyclist.",
-        "Eat a meal alone in public without your phone."
-    ]),
-    "leader": (60, [
-        "Invite someone to an event or activity.",
-        "Have a 10 minute conversation with someone you recently met.",
-        "For 30 minutes, make eye contact with everyone who enters a social space.",
-        "Keep a conversation going for 15 minutes without checking your phone or escaping.",
-        "Organise a group activity like a dinner walk or social event."
-    ]),
-    "master": (75, [
-        "Support someone through a vulnerable conversation.",
-        "Spend a full day saying yes to social opportunities.",
-        "Be the person who welcomes newcomers into a space.",
-        "Help resolve a disagreement.",
-        "Help 5 people build new connections."
-    ])
-}
-
-XP_VALUES = {
-    "initiate_1": 5,
-    "initiate_2": 10,
-    "explorer_1": 15,
-    "explorer_2": 20,
-    "connector_1": 25,
-    "connector_2": 30,
-    "leader_1": 35,
-    "leader_2": 40
-}
-
-# Quest channel mappings
-QUEST_CHANNELS = {
-    "initiate": "initiate-quests",
-    "explorer": "explorer-quests",
-    "connector": "connector-quests",
-    "leader": "leader-quests",
-    "master": "master-quests"
-}
-
-# Define which quests each rank can access
-RANK_QUEST_ACCESS = {
-    1: ["initiate_1", "initiate_2"],  # Initiate
-    2: ["initiate_1", "explorer_1", "explorer_2"],  # Explorer
-    3: ["initiate_1", "explorer_1", "connector_1", "connector_2"],  # Connector
-    4: ["initiate_1", "explorer_1", "connector_1", "leader_1", "leader_2"],  # Leader
-    5: ["explorer_1", "connector_1", "connector_2", "leader_1", "leader_2"]  # Master
-}
+# Quests, XP values and rank thresholds are read from GAME_CONFIG (TOML or
+# JSON). The owner's !reload swaps in an edited file without a restart.
+GAME_CONFIG = os.getenv("GAME_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "game.toml"))
+game = load_game_config(GAME_CONFIG, RANKS)
 
 # ========================
 # HELPERS
 # ========================
 
-def get_user(user_id):
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-
-    if not user:
-        cursor.execute(
-            "INSERT INTO users (user_id, xp, rank, streak) VALUES (?, 0, 1, 0)",
-            (user_id,)
-        )
-        conn.commit()
-        return get_user(user_id)
-
-    return user
-
-def log_xp(user_id, amount):
-    cursor.execute(
-        "INSERT INTO xp_log (user_id, xp, timestamp) VALUES (?, ?, ?)",
-        (user_id, amount, datetime.now(timezone.utc).isoformat())
-    )
-    conn.commit()
-
-def add_xp(user_id, amount):
-    cursor.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (amount, user_id))
-    conn.commit()
-    log_xp(user_id, amount)
-
-def add_bonus_xp(user_id, amount):
-    cursor.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (amount, user_id))
-    conn.commit()
-
-def set_rank(user_id, rank):
-    cursor.execute("UPDATE users SET rank = ? WHERE user_id = ?", (rank, user_id))
-    conn.commit()
-
 def get_rank_from_xp(xp):
     """Return rank number based on XP"""
-    for rank, (min_xp, max_xp) in RANK_XP_THRESHOLDS.items():
-        if min_xp <= xp < max_xp:
-            return rank
-    return 5  # Maser if XP exceeds highest threshold
+    return game.rank_for_xp(xp)
 
 def get_current_tier(rank_number, xp):
     """
     Returns the current tier number (1-indexed) for a given rank and absolute XP.
-    Uses absolute XP thresholds in RANK_TIERS.
+    Uses the absolute XP tier thresholds of the game config.
     """
-    rank_name = RANKS[rank_number]
-    tiers = RANK_TIERS.get(rank_name, [])
-
-    # If there are no tiers, always Tier 1
-    if not tiers:
-        return 1
-
-    # Go through each tier threshold
-    for i, threshold in enumerate(tiers):
-        if xp < threshold:
-            return i + 1  # Current tier is before this threshold
-
-    # If XP exceeds all thresholds, return the last tier +1
-    return len(tiers) + 1
+    tiers = game.rank_tiers[RANKS[rank_number]]
+    return bisect.bisect_right(tiers, xp) + 1
+
+class GuildCache:
+    """Per-guild name -> channel/role lookups, rebuilt lazily after changes"""
+
+    def __init__(self):
+        self.channels = {}
+        self.roles = {}
+
+    def text_channel(self, guild, name):
+        channels = self.channels.get(guild.id)
+        if channels is None:
+            channels = {}
+            for channel in guild.text_channels:
+                channels.setdefault(channel.name.lower(), channel)
+            self.channels[guild.id] = channels
+        return channels.get(name.lower())
+
+    def role(self, guild, name):
+        roles = self.roles.get(guild.id)
+        if roles is None:
+            roles = {}
+            for role in guild.roles:
+                roles.setdefault(role.name, role)
+            self.roles[guild.id] = roles
+        return roles.get(name)
+
+    def invalidate_channels(self, guild_id):
+        self.channels.pop(guild_id, None)
+
+    def invalidate_roles(self, guild_id):
+        self.roles.pop(guild_id, None)
+
+    def drop(self, guild_id):
+        self.invalidate_channels(guild_id)
+        self.invalidate_roles(guild_id)
+
+guild_cache = GuildCache()
 
 async def assign_rank_role(member, rank_number):
     guild = member.guild
     rank_name = RANKS.get(rank_number)
 
-    rank_role = discord.utils.get(guild.roles, name=rank_name)
-    unranked_role = discord.utils.get(guild.roles, name="Unranked")
+    rank_role = guild_cache.role(guild, rank_name)
+    unranked_role = guild_cache.role(guild, "Unranked")
 
     if unranked_role and unranked_role in member.roles:
         try:
@@ -396,21 +309,26 @@ async def assign_rank_role(member, rank_number):
 # QUEST ROTATION ENGINE
 # ========================
 
-def get_seven_day_quest(quest_key):
-    """Get a quest from the 7-day rotation pool, ensuring no repeats until all are used"""
+# ROTATION_POLICY picks how quests are drawn from their pools, see rotation.py.
+# "balanced" weighs them by how often they get claimed, "uniform" doesn't.
+ROTATION_POLICY = os.getenv("ROTATION_POLICY", "balanced")
+if ROTATION_POLICY not in POLICIES:
+    print(f"⚠️ Unknown ROTATION_POLICY {ROTATION_POLICY}, using uniform (options: {', '.join(POLICIES)})")
+    ROTATION_POLICY = "uniform"
+
+async def get_seven_day_quest(quest_key, policy):
+    """
+    Get a quest from the 7-day rotation pool, ensuring no repeats until all
+    are used. Returns (quest, used_quests, cycle_start), the pool to save
+    with the rotation.
+    """
     today = today_est()
     
     # Check if we have an active cycle
-    cursor.execute("""
-        SELECT used_quests, cycle_start FROM quest_seven_day_pool
-        WHERE quest_key = ?
-    """, (quest_key,))
-    
-    result = cursor.fetchone()
+    result = await storage.get_seven_day_pool(quest_key)
     
     if result:
-        used_quests_str, cycle_start = result
-        used_quests = used_quests_str.split(',') if used_quests_str else []
+        used_quests, cycle_start = result
         
         # Check if cycle needs reset (7 days have passed or all quests used)
         cycle_start_date = datetime.fromisoformat(cycle_start).date()
@@ -426,7 +344,7 @@ def get_seven_day_quest(quest_key):
         cycle_start = today
     
     # Get available quests (not yet used in this cycle)
-    all_quests = QUEST_POOLS[quest_key]
+    all_quests = game.quests[quest_key].pool
     available_quests = [q for q in all_quests if q not in used_quests]
     
     # If no quests available, reset
@@ -435,143 +353,150 @@ def get_seven_day_quest(quest_key):
         used_quests = []
         cycle_start = today
     
-    # Select random quest from available
-    chosen_quest = random.choice(available_quests)
+    # Let the rotation policy pick from the available ones
+    chosen_quest = policy.choose(game.quests[quest_key], available_quests)
     
     # Update used quests
     used_quests.append(chosen_quest)
     
-    # Save to database
-    cursor.execute("""
-        DELETE FROM quest_seven_day_pool WHERE quest_key = ?
-    """, (quest_key,))
-    
-    cursor.execute("""
-        INSERT INTO quest_seven_day_pool (quest_key, used_quests, cycle_start)
-        VALUES (?, ?, ?)
-    """, (quest_key, ','.join(used_quests), cycle_start))
-    
-    conn.commit()
-    
-    return chosen_quest
+    return chosen_quest, used_quests, cycle_start
 
-def generate_daily_quests():
+async def generate_daily_quests():
     today = today_est()
     
     # Check if quests already exist for today
-    cursor.execute("SELECT COUNT(*) FROM daily_quest_rotation WHERE date = ?", (today,))
-    if cursor.fetchone()[0] > 0:
+    if await storage.daily_rotation_exists(today):
         return  # Already generated
-    
-    # Delete old quests
-    cursor.execute("DELETE FROM daily_quest_rotation WHERE date != ?", (today,))
-
-    for key, pool in QUEST_POOLS.items():
-        # Check if this is a _1 or _2 type quest
-        if key.endswith("_1"):
-            # Simple random selection from 3 quests
-            chosen = random.choice(pool)
-        else:  # _2 type quests
+
+    # completion stats are kept up to date by every claim, one read covers all pools
+    policy = POLICIES[ROTATION_POLICY](await storage.quest_stats())
+
+    rows, pools = [], []
+    for quest in game.quests.values():
+        if quest.rotation == "random":
+            chosen = policy.choose(quest, quest.pool)
+        else:  # "seven_day"
             # Use 7-day rotation logic
-            chosen = get_seven_day_quest(key)
-        
-        xp = XP_VALUES[key]
-        rank = key.split("_")[0]
+            chosen, used_quests, cycle_start = await get_seven_day_quest(quest.key, policy)
+            pools.append((quest.key, used_quests, cycle_start))
 
-        cursor.execute("""
-            INSERT INTO daily_quest_rotation (rank, quest_key, quest_name, xp, date)
-            VALUES (?, ?, ?, ?, ?)
-        """, (rank, key, chosen, xp, today))
+        rows.append((quest.rank, quest.key, chosen, quest.xp))
 
-    conn.commit()
+    # replaces the old rotation and moves the 7-day pools on in one
+    # transaction, so a crash can't move a pool on twice for one day
+    await storage.save_daily_rotation(today, rows, pools)
 
-def generate_weekly_quests():
+async def generate_weekly_quests():
     week = week_start_est()
     
     # Check if quests already exist for this week
-    cursor.execute("SELECT COUNT(*) FROM weekly_quest_rotation WHERE week_start = ?", (week,))
-    if cursor.fetchone()[0] > 0:
+    if await storage.weekly_rotation_exists(week):
         return  # Already generated
-    
-    # Delete old quests
-    cursor.execute("DELETE FROM weekly_quest_rotation WHERE week_start != ?", (week,))
 
-    for rank, (xp, pool) in WEEKLY_QUESTS.items():
+    rows = []
+    for rank, (xp, pool) in game.weekly.items():
         chosen = random.choice(pool)
-        cursor.execute("""
-            INSERT INTO weekly_quest_rotation (rank, quest_name, xp, week_start)
-            VALUES (?, ?, ?, ?)
-        """, (rank, chosen, xp, week))
-
-    conn.commit()
-
-def has_claimed(user_id, quest_key):
-    cursor.execute("""
-        SELECT 1 FROM quest_claims WHERE user_id = ? AND quest_key = ? AND date = ?
-    """, (user_id, quest_key, today_est()))
-    return cursor.fetchone() is not None
-
-def claim_quest(user_id, quest_key):
-    cursor.execute("""
-        INSERT INTO quest_claims (user_id, quest_key, date)
-        VALUES (?, ?, ?)
-    """, (user_id, quest_key, today_est()))
-    conn.commit()
+        rows.append((rank, chosen, xp))
+
+    await storage.save_weekly_rotation(week, rows)
 
 # ========================
 # POST QUESTS TO CHANNELS
 # ========================
 
-async def post_daily_quests():
-    """Post daily quests to their respective channels"""
-    today = today_est()
+# Each day's rollover is journaled in storage, one step at a time: the daily
+# rotation, the weekly rotation, then one "post:<guild>:<channel>" step per
+# quest post, finished once Discord has the message. Every run picks up
+# after the last finished step, so a restart mid-rollover neither redoes
+# database work nor reposts to a channel that already got today's quests.
+QUEST_POST_ATTEMPTS = 3  # a channel that keeps failing is skipped for the day
+QUEST_POST_SCAN = 50  # messages since midnight checked for a post made before a crash
+
+# post steps whose message is still queued in the dispatcher
+posting_steps = set()
+
+async def find_quest_post(channel, title, since):
+    """Our quest post titled `title` in `channel` since `since`, or None"""
+    async for message in channel.history(after=since, limit=QUEST_POST_SCAN):
+        if message.author == bot.user and any(embed.title == title for embed in message.embeds):
+            return message
+    return None
+
+async def finish_quest_post(today, step, sent):
+    try:
+        message = await sent
+        if message:
+            await storage.finish_rollover_step(today, step, message.id)
+    finally:
+        posting_steps.discard(step)
 
-    # 🔧 NEW: prevent duplicate posting
-    cursor.execute("SELECT 1 FROM daily_quest_post_log WHERE date = ?", (today,))
-    if cursor.fetchone():
-        return  # already posted today
+async def post_daily_quests(today, journal):
+    """Post daily quests to the rank channels that haven't got them yet"""
+    if await storage.legacy_post_logged(today):
+        return  # already posted today (before per-guild markers existed)
 
     # Ensure quests exist
-    cursor.execute("SELECT COUNT(*) FROM daily_quest_rotation WHERE date = ?", (today,))
-    if cursor.fetchone()[0] == 0:
-        return  # quests not generated yet
+    daily_rotation = await storage.get_daily_rotation(today)
+    if not daily_rotation:
+        return  # quests not generated yet (the rotation leader may not have run)
+
+    # guilds posted to today before the journal existed
+    posted = await storage.posted_guilds(today)
 
     week = week_start_est()
+    weekly_rotation = await storage.get_weekly_rotation(week)
+    midnight = clock.local(datetime.fromisoformat(today))
 
     for guild in bot.guilds:
+        if guild.id in posted:
+            continue
+
         for rank_num, rank_name in RANKS.items():
             rank_name_lower = rank_name.lower()
-            channel_name = QUEST_CHANNELS[rank_name_lower].lower()
+            channel_name = game.channels[rank_name_lower].lower()
 
-            channel = discord.utils.find(
-                lambda c: c.name.lower() == channel_name,
-                guild.text_channels
-            )
+            channel = guild_cache.text_channel(guild, channel_name)
 
             if not channel:
                 continue
 
-            accessible_quests = RANK_QUEST_ACCESS[rank_num]
+            step = f"post:{guild.id}:{channel.id}"
+            if step in journal or step in posting_steps:
+                continue
+
+            # the claim keeps a second shard process off the channel
+            attempts = await storage.begin_rollover_step(today, step, INSTANCE_ID, LEASE_SECONDS)
+            if attempts is None or attempts >= QUEST_POST_ATTEMPTS:
+                continue
 
-            role = discord.utils.get(guild.roles, name=RANK_ROLE_NAMES[rank_name])
+            title = f"📜 Daily Quests for {rank_name}"
+            if attempts:
+                # an earlier attempt may have been sent before it was journaled
+                try:
+                    message = await find_quest_post(channel, title, midnight)
+                except discord.HTTPException as e:
+                    print(f"Error checking #{channel.name} for today's quests: {e}")
+                    continue
+                if message:
+                    await storage.finish_rollover_step(today, step, message.id)
+                    continue
+
+            accessible_quests = game.rank_access[rank_num]
+
+            role = guild_cache.role(guild, RANK_ROLE_NAMES[rank_name])
             role_mention = role.mention if role else rank_name
 
             header_message = f"Here are your {role_mention} quests for today!"
 
             embed = discord.Embed(
-                title=f"📜 Daily Quests for {rank_name}",
+                title=title,
                 description="Complete these quests today! Use the commands below to claim XP.",
                 color=RANK_COLORS.get(rank_name, 0xFFFFFF),
-                timestamp=datetime.now(TZ)
+                timestamp=clock.now()
             )
 
             for quest_key in accessible_quests:
-                cursor.execute("""
-                    SELECT quest_name, xp FROM daily_quest_rotation
-                    WHERE quest_key = ? AND date = ?
-                """, (quest_key, today))
-
-                result = cursor.fetchone()
+                result = daily_rotation.get(quest_key)
                 if result:
                     quest_name, xp = result
                     command = f"!{quest_key.replace('_', '')}"
@@ -581,12 +506,7 @@ async def post_daily_quests():
                         inline=False
                     )
 
-            cursor.execute("""
-                SELECT quest_name, xp FROM weekly_quest_rotation
-                WHERE rank = ? AND week_start = ?
-            """, (rank_name_lower, week))
-
-            weekly = cursor.fetchone()
+            weekly = weekly_rotation.get(rank_name_lower)
             if weekly:
                 quest_name, xp = weekly
                 embed.add_field(
@@ -597,132 +517,237 @@ async def post_daily_quests():
 
             embed.set_footer(text="New quests posted daily at midnight EST")
 
-            try:
-                await channel.send(
-                    content=header_message,
-                    embed=embed
-                )
-            except Exception as e:
-                print(f"Error posting to {channel_name}: {e}")
-
-    # 🔧 NEW: mark quests as posted for today
-    cursor.execute(
-        "INSERT OR IGNORE INTO daily_quest_post_log (date) VALUES (?)",
-        (today,)
-    )
-    conn.commit()
+            posting_steps.add(step)
+            sent = dispatcher.post(channel, header_message, embed=embed)
+            bot.loop.create_task(finish_quest_post(today, step, sent))
 
 # ========================
 # DAILY SCHEDULER
 # ========================
 
-@tasks.loop(minutes=5)
-async def daily_reset_task():
+async def generate_rotations(today, journal):
+    """Generate today's rotations if this process is the rotation leader"""
+    if not await acquire_lease(ROTATION_LEASE):
+        return False
+
+    for step, generate in (("daily", generate_daily_quests), ("weekly", generate_weekly_quests)):
+        if step not in journal:
+            # does nothing if the rotation was saved but the step wasn't
+            await generate()
+            await storage.finish_rollover_step(today, step)
+    return True
+
+async def run_rollover():
+    """Carry today's rollover on from its last finished step"""
     today = today_est()
-    cursor.execute(
-        "SELECT 1 FROM daily_quest_post_log WHERE date = ?",
-        (today,)
-    )
-    if cursor.fetchone():
-        return
+    journal = await storage.rollover_journal(today)
+    await generate_rotations(today, journal)
+    await post_daily_quests(today, journal)
 
-    generate_daily_quests()
-    generate_weekly_quests()
-    await post_daily_quests()
+@tasks.loop(minutes=5)
+@timed(TASK_SECONDS, task="daily_reset_task")
+async def daily_reset_task():
+    await run_rollover()
 
 @daily_reset_task.before_loop
 async def before_daily_reset():
     await bot.wait_until_ready()
-    # Calculate time until next midnight EST
-    now = datetime.now(TZ)
-    next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-    wait_seconds = (next_midnight - now).total_seconds()
-    await asyncio.sleep(wait_seconds)
+    # first run at the next midnight EST
+    await clock.sleep(clock.seconds_until(0))
 
 # ========================
 # QUEST NOTIFICATIONS
 # ========================
 
-@tasks.loop(minutes=60)
-async def quest_notifications():
-    now = datetime.now(TZ)
-    current_hour = now.hour
+# Hour (EST) -> reminder text. A slot stays due for NOTIFICATION_GRACE_HOURS
+# so a restart around the hour still sends it, but never sends it twice.
+NOTIFICATION_SLOTS = {
+    9: "Don’t forget to complete a quest today!",
+    13: "Your streak! You still have time to complete a quest!"
+}
+NOTIFICATION_GRACE_HOURS = 2
 
-    # Only run at 9am or 1pm EST
-    if current_hour not in (9, 13):
-        return
+# pings are deleted in the background so sends don't wait on the delete
+notification_delete_queue = asyncio.Queue()
 
-    guild = bot.guilds[0]  # assumes single-server bot
+async def notification_delete_worker():
+    while True:
+        msg = await notification_delete_queue.get()
+        try:
+            await msg.delete()
+        except discord.HTTPException as e:
+            print(f"Error deleting notification in {msg.channel}: {e}")
+        finally:
+            notification_delete_queue.task_done()
 
-    for rank_key, channel_name in QUEST_CHANNELS.items():
-        channel = discord.utils.get(guild.text_channels, name=channel_name)
-        role = discord.utils.get(guild.roles, name=rank_key.capitalize())
+def get_due_notification_slot(now):
+    """Return the slot hour that should be sent at `now`, or None"""
+    due = [hour for hour in NOTIFICATION_SLOTS if hour <= now.hour < hour + NOTIFICATION_GRACE_HOURS]
+    return max(due) if due else None
+
+async def send_notification(channel, content):
+    msg = await dispatcher.send(channel, content)
+
+    # 🔔 ping is delivered, the message itself doesn't need to stay
+    if msg:
+        notification_delete_queue.put_nowait(msg)
+
+async def notify_guild(guild, slot):
+    text = NOTIFICATION_SLOTS[slot]
+    sends = []
+
+    for rank_key, channel_name in game.channels.items():
+        channel = guild_cache.text_channel(guild, channel_name)
+        role = guild_cache.role(guild, rank_key.capitalize())
 
         if not channel or not role:
             continue
 
-        if current_hour == 9:
-            text = "Don’t forget to complete a quest today!"
-        else:
-            text = "Your streak! You still have time to complete a quest!"
+        sends.append(send_notification(channel, f"{role.mention} {text}"))
 
-        # 🔔 send ping, then delete message (notification remains)
-        msg = await channel.send(f"{role.mention} {text}")
-        await msg.delete()
+    await asyncio.gather(*sends)
+
+    await storage.mark_notified(guild.id, today_est(), slot)
+
+@tasks.loop(minutes=5)
+@timed(TASK_SECONDS, task="quest_notifications")
+async def quest_notifications():
+    slot = get_due_notification_slot(clock.now())
+    if slot is None:
+        return
+
+    today = today_est()
+
+    sent = await storage.notified_guilds(today, slot)
+
+    pending = [guild for guild in bot.guilds if guild.id not in sent]
+    if not pending:
+        return
+
+    # the dispatcher paces the sends of all guilds
+    await asyncio.gather(*(notify_guild(guild, slot) for guild in pending))
 
 # ========================
 # QUEST COMMANDS
 # ========================
 
+class ClaimIndex:
+    """
+    Today's claims (and this week's weekly ones) as one small int bitmask
+    per member, so repeat claims are turned away without a query. The
+    unique index on quest_claims stays the source of truth.
+    """
+
+    def __init__(self, keys):
+        self.bits = {key: 1 << i for i, key in enumerate(keys)}
+        self.weekly_mask = sum(bit for key, bit in self.bits.items() if key.startswith(WEEKLY_KEY_PREFIX))
+        self.date = None
+        self.week = None
+        self.claims = {}
+
+    async def load(self):
+        today, week = today_est(), week_start_est()
+        claims = {}
+        for guild_id, user_id, key in await storage.current_claims(today, week):
+            bit = self.bits.get(key)
+            if bit:
+                claims[(guild_id, user_id)] = claims.get((guild_id, user_id), 0) | bit
+        self.date, self.week, self.claims = today, week, claims
+
+    def roll_over(self):
+        """Drop daily bits at EST midnight, weekly ones when the week changes"""
+        today = today_est()
+        if today == self.date:
+            return
+
+        week = week_start_est()
+        claims = {}
+        if week == self.week:
+            for member, mask in self.claims.items():
+                if mask & self.weekly_mask:
+                    claims[member] = mask & self.weekly_mask
+        # one assignment, nothing sees a half-cleared index
+        self.date, self.week, self.claims = today, week, claims
+
+    def has(self, guild_id, user_id, key):
+        self.roll_over()
+        return bool(self.claims.get((guild_id, user_id), 0) & self.bits.get(key, 0))
+
+    def add(self, guild_id, user_id, key, date):
+        """Record a claim dated `date` (the week start for weekly keys)"""
+        self.roll_over()
+        current = self.week if key.startswith(WEEKLY_KEY_PREFIX) else self.date
+        if date != current or key not in self.bits:
+            return  # claimed before a rollover, it's already irrelevant
+        member = (guild_id, user_id)
+        self.claims[member] = self.claims.get(member, 0) | self.bits[key]
+
+def build_claim_index(config):
+    return ClaimIndex(list(config.quests) + [f"{WEEKLY_KEY_PREFIX}{rank}" for rank in config.weekly])
+
+claim_index = build_claim_index(game)
+
+async def reply(ctx, content):
+    """
+    Answer a claim. Slash commands answer their interaction, "!" answers in
+    a busy quest channel are coalesced, naming (not pinging) each member.
+    """
+    if ctx.interaction:
+        await ctx.send(content)
+    else:
+        dispatcher.post(ctx.channel, f"{ctx.author.mention} {content}", allowed_mentions=NO_MENTIONS, coalesce=True)
+
 async def quest_command(ctx, quest_key):
     # Check channel permissions
     if ctx.channel.name not in ALLOWED_QUEST_CHANNEL:
         valid_channel = False
-        for channel_name in QUEST_CHANNELS.values():
+        for channel_name in game.channels.values():
             if ctx.channel.name == channel_name:
                 valid_channel = True
                 break
         
         if not valid_channel:
-            await ctx.send("❌ Quest commands can only be used in quest channels.")
+            await reply(ctx, "❌ Quest commands can only be used in quest channels.")
             return
 
     # Get user's rank
-    user = get_user(ctx.author.id)
+    user = await storage.get_user(ctx.guild.id, ctx.author.id)
     user_rank = user[2]
     
     # Check if user has access to this quest
-    if quest_key not in RANK_QUEST_ACCESS[user_rank]:
-        await ctx.send(f"❌ You don't have access to this quest. Your current rank is {RANKS[user_rank]}.")
+    if not game.can_access(user_rank, quest_key):
+        await reply(ctx, f"❌ You don't have access to this quest. Your current rank is {RANKS[user_rank]}.")
         return
 
     # Check if quest exists for today
-    cursor.execute("""
-        SELECT quest_name, xp FROM daily_quest_rotation
-        WHERE quest_key = ? AND date = ?
-    """, (quest_key, today_est()))
+    today = today_est()
+    daily_rotation = await storage.get_daily_rotation(today)
 
-    result = cursor.fetchone()
+    result = daily_rotation.get(quest_key)
     if not result:
-        await ctx.send("❌ This quest is not available today.")
+        await reply(ctx, "❌ This quest is not available today.")
         return
 
     quest_name, xp = result
 
     # Check if already claimed
-    if has_claimed(ctx.author.id, quest_key):
-        await ctx.send("❌ You have already completed this quest today.")
+    if claim_index.has(ctx.guild.id, ctx.author.id, quest_key):
+        await reply(ctx, "❌ You have already completed this quest today.")
         return
 
-    # Award XP
-    old_xp = user[1]
-    add_xp(ctx.author.id, xp)
-    claim_quest(ctx.author.id, quest_key)
+    # Award XP (claim + XP + log in one transaction, so it can't double-claim)
+    new_xp = await storage.record_claim(ctx.guild.id, ctx.author.id, quest_key, xp, today, "quest")
+    claim_index.add(ctx.guild.id, ctx.author.id, quest_key, today)
+    if new_xp is None:
+        await reply(ctx, "❌ You have already completed this quest today.")
+        return
+    completion_counts.add(ctx.guild.id, ctx.author.id, quest_key)
+    old_xp = new_xp - xp
 
-    update_streak(ctx.author.id)
+    # the claim's date, even if midnight passed since
+    await update_streak(ctx.guild.id, ctx.author.id, today)
     
     # Check for rank up
-    new_xp = old_xp + xp
     old_rank = user[2]
     new_rank = get_rank_from_xp(new_xp)
 
@@ -739,7 +764,7 @@ async def quest_command(ctx, quest_key):
 
     # Rank up
     if new_rank > old_rank:
-        set_rank(ctx.author.id, new_rank)
+        await storage.set_rank(ctx.guild.id, ctx.author.id, new_rank)
         await assign_rank_role(ctx.author, new_rank)
         message_parts.append(f"🎉 **RANK UP!** You are now {RANKS[new_rank]}!")
     
@@ -747,7 +772,7 @@ async def quest_command(ctx, quest_key):
     elif new_tier > old_tier:
         message_parts.append(f"✨ **TIER UP!** You are now {RANKS[new_rank]} — Tier {new_tier}!")
 
-    await ctx.send("\n".join(message_parts))
+    await reply(ctx, "\n".join(message_parts))
 
 
 # Daily Quest Commands
@@ -785,42 +810,41 @@ async def leader_2(ctx):
 
 # Weekly Quest Commands
 async def weekly_quest_command(ctx, rank_name):
-    user = get_user(ctx.author.id)
+    user = await storage.get_user(ctx.guild.id, ctx.author.id)
     user_rank = user[2]
     user_rank_name = RANKS[user_rank].lower()
     
     # Check if user's rank matches the quest rank
     if user_rank_name != rank_name:
-        await ctx.send(f"❌ You cannot claim this weekly quest. Your current rank is {RANKS[user_rank]}.")
+        await reply(ctx, f"❌ You cannot claim this weekly quest. Your current rank is {RANKS[user_rank]}.")
         return
     
     week = week_start_est()
-    quest_key = f"weekly_{rank_name}_{week}"
+    index_key = f"{WEEKLY_KEY_PREFIX}{rank_name}"
+    quest_key = f"{index_key}_{week}"
     
-    if has_claimed(ctx.author.id, quest_key):
-        await ctx.send("❌ You have already completed your weekly quest this week.")
+    # weekly claims are dated by week start, so they stay claimed all week
+    if claim_index.has(ctx.guild.id, ctx.author.id, index_key):
+        await reply(ctx, "❌ You have already completed your weekly quest this week.")
         return
     
-    cursor.execute("""
-        SELECT quest_name, xp FROM weekly_quest_rotation
-        WHERE rank = ? AND week_start = ?
-    """, (rank_name, week))
+    weekly_rotation = await storage.get_weekly_rotation(week)
     
-    result = cursor.fetchone()
+    result = weekly_rotation.get(rank_name)
     if not result:
-        await ctx.send("❌ No weekly quest available.")
+        await reply(ctx, "❌ No weekly quest available.")
         return
     
     quest_name, xp = result
     
-    old_xp = user[1]
-    add_xp(ctx.author.id, xp)
-    claim_quest(ctx.author.id, quest_key)
-    
-    new_xp = old_xp + xp
-    new_rank = get_rank_from_xp(new_xp)
+    new_xp = await storage.record_claim(ctx.guild.id, ctx.author.id, quest_key, xp, week, "weekly")
+    claim_index.add(ctx.guild.id, ctx.author.id, index_key, week)
+    if new_xp is None:
+        await reply(ctx, "❌ You have already completed your weekly quest this week.")
+        return
+    completion_counts.add(ctx.guild.id, ctx.author.id, index_key)
+    old_xp = new_xp - xp
     
-    new_xp = old_xp + xp
     new_rank = get_rank_from_xp(new_xp)
     old_rank = user[2]
     old_tier = get_current_tier(old_rank, old_xp)
@@ -834,7 +858,7 @@ async def weekly_quest_command(ctx, rank_name):
 
     # Rank up
     if new_rank > old_rank:
-        set_rank(ctx.author.id, new_rank)
+        await storage.set_rank(ctx.guild.id, ctx.author.id, new_rank)
         await assign_rank_role(ctx.author, new_rank)
         message_parts.append(f"🎉 **RANK UP!** You are now {RANKS[new_rank]}!")
 
@@ -842,7 +866,7 @@ async def weekly_quest_command(ctx, rank_name):
     elif new_tier > old_tier:
         message_parts.append(f"✨ **TIER UP!** You are now {RANKS[new_rank]} — Tier {new_tier}!")
 
-    await ctx.send("\n".join(message_parts))
+    await reply(ctx, "\n".join(message_parts))
 
 @bot.command(name="initiateweekly")
 async def initiate_weekly(ctx):
@@ -864,6 +888,42 @@ async def leader_weekly(ctx):
 async def master_weekly(ctx):
     await weekly_quest_command(ctx, "master")
 
+# Slash equivalents. They defer first, so Discord gets its answer within
+# 3 seconds whatever the storage calls cost.
+@bot.hybrid_command(name="quest")
+@app_commands.describe(quest="Today's quest to claim")
+async def quest_slash(ctx, quest: str):
+    """Claim one of today's quests."""
+    await ctx.defer()
+    if quest not in game.quests:
+        await ctx.send("❌ Unknown quest.")
+        return
+    await quest_command(ctx, quest)
+
+@quest_slash.autocomplete("quest")
+async def quest_autocomplete(interaction: discord.Interaction, current: str):
+    if interaction.guild_id is None:
+        return []
+    user = await storage.get_user(interaction.guild_id, interaction.user.id)
+    rotation = await storage.get_daily_rotation(today_est())
+    current = current.lower()
+
+    choices = []
+    for key in game.rank_access[user[2]]:
+        if key not in rotation:
+            continue
+        label = f"{key} — {rotation[key][0]}"
+        if current in label.lower():
+            choices.append(app_commands.Choice(name=label[:100], value=key))
+    return choices[:25]
+
+@bot.hybrid_command(name="weekly")
+async def weekly_slash(ctx):
+    """Claim this week's quest for your rank."""
+    await ctx.defer()
+    user = await storage.get_user(ctx.guild.id, ctx.author.id)
+    await weekly_quest_command(ctx, RANKS[user[2]].lower())
+
 # ========================
 # STORY SHARING
 # ========================
@@ -871,47 +931,114 @@ async def master_weekly(ctx):
 STORY_CHANNEL = ["story-feed"]
 STORY_XP_PER_REACTION = 2
 STORY_XP_MAX = 10
+# max XP-earning reactions per story, and per reactor per day
+STORY_REACTION_CAP = 3
+# stories earn XP for this many days, then they're archived
+STORY_ACTIVE_DAYS = 7
+# XP awarded within this many seconds is announced in one go
+STORY_NOTICE_DELAY = 5.0
+
+class Story:
+    __slots__ = ("guild_id", "author_id", "date", "xp_awarded", "reactions", "notice_id")
+
+    def __init__(self, guild_id, author_id, date, xp_awarded=0, reactions=0, notice_id=None):
+        self.guild_id = guild_id
+        self.author_id = author_id
+        self.date = date
+        self.xp_awarded = xp_awarded
+        self.reactions = reactions
+        self.notice_id = notice_id
+
+    def can_earn(self, reactor_id):
+        return (
+            reactor_id != self.author_id
+            and self.xp_awarded < STORY_XP_MAX
+            and self.reactions < STORY_REACTION_CAP
+        )
 
-# Create tables for story tracking
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS story_posts (
-    message_id INTEGER PRIMARY KEY,
-    author_id INTEGER,
-    xp_awarded INTEGER DEFAULT 0,
-    date_posted TEXT
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS story_reactions (
-    message_id INTEGER,
-    reactor_id INTEGER,
-    date TEXT,
-    PRIMARY KEY(message_id, reactor_id)
-)
-""")
-conn.commit()
+class StoryFeed:
+    """
+    The stories that can still earn XP, with their author and XP so far,
+    so reactions on anything else never reach storage. XP awarded within
+    STORY_NOTICE_DELAY is announced together, in one message per story that
+    later awards edit instead of posting again.
+    """
+
+    def __init__(self):
+        self.stories = {}  # story message id -> Story
+        self.pending = set()
+
+    def active_since(self):
+        return (clock.date() - timedelta(days=STORY_ACTIVE_DAYS)).isoformat()
+
+    async def load(self):
+        rows = await storage.active_stories(self.active_since())
+        self.stories = {row[0]: Story(*row[1:]) for row in rows}
+
+    def add(self, message_id, guild_id, author_id, date):
+        self.stories[message_id] = Story(guild_id, author_id, date)
+
+    def prune(self):
+        since = self.active_since()
+        self.stories = {message_id: s for message_id, s in self.stories.items() if s.date >= since}
+
+    def drop_guild(self, guild_id):
+        self.stories = {message_id: s for message_id, s in self.stories.items() if s.guild_id != guild_id}
+
+    def awarded(self, message_id, channel_id, xp):
+        story = self.stories.get(message_id)
+        if story is None:
+            return
+        story.xp_awarded += xp
+        story.reactions += 1
+        if message_id not in self.pending:
+            self.pending.add(message_id)
+            bot.loop.create_task(self.announce(message_id, channel_id))
+
+    async def announce(self, message_id, channel_id):
+        await asyncio.sleep(STORY_NOTICE_DELAY)
+        self.pending.discard(message_id)
+
+        story = self.stories.get(message_id)
+        channel = bot.get_channel(channel_id)
+        if story is None or channel is None:
+            return
+
+        # by id, members aren't cached
+        content = f"🎉 <@{story.author_id}> received {story.xp_awarded} XP for their story!"
+        if story.notice_id and await dispatcher.edit(channel, story.notice_id, content):
+            return
+
+        # first award, or the notice was deleted
+        notice = await dispatcher.send(channel, content)
+        if notice:
+            story.notice_id = notice.id
+            await storage.set_story_notice(message_id, notice.id)
+
+story_feed = StoryFeed()
 
 # Command to submit a story
-@bot.command()
+@bot.hybrid_command()
 async def story(ctx, *, content: str):
     """Submit a story or experience to share with the server."""
+    await ctx.defer()
     if ctx.channel.name not in STORY_CHANNEL:
         await ctx.send(f"❌ Stories can only be submitted in: {', '.join(STORY_CHANNEL)}")
         return
 
-    # Remove original user message
-    try:
-        await ctx.message.delete()
-    except:
-        pass
+    # Remove original user message (slash commands have none)
+    if not ctx.interaction:
+        try:
+            await ctx.message.delete()
+        except:
+            pass
 
     # Create embed with user's name
     embed = discord.Embed(
         title=f"📖 {ctx.author.display_name}'s Story!",
         description=content,
         color=0xFFA500,
-        timestamp=datetime.now(TZ)
+        timestamp=clock.now()
     )
     embed.set_footer(text=f"React to award XP! Max {STORY_XP_MAX} XP per story.")
 
@@ -920,123 +1047,56 @@ async def story(ctx, *, content: str):
 
     # Track in database
     today = today_est()
-    cursor.execute("""
-        INSERT INTO story_posts (message_id, author_id, xp_awarded, date_posted)
-        VALUES (?, ?, ?, ?)
-    """, (bot_message.id, ctx.author.id, 0, today))
-    conn.commit()
+    await storage.add_story(bot_message.id, ctx.guild.id, ctx.author.id, today)
+    story_feed.add(bot_message.id, ctx.guild.id, ctx.author.id, today)
 
-# Reaction listener to grant XP
+# Reaction listener to grant XP. Raw, so stories posted before a restart
+# (no longer in the message cache) still count.
 @bot.event
-async def on_reaction_add(reaction, user):
+async def on_raw_reaction_add(payload):
     """Award XP when someone reacts to a story embed."""
-
-    message = reaction.message
-
-    if user.bot:
-        return  # Ignore bot reactions
-
-    if message.author.id == user.id:
-        return
-
-    cursor.execute(
-        "SELECT COUNT(*) FROM story_reactions WHERE message_id = ?",
-        (message.id,)
-    )
-    if cursor.fetchone()[0] >= 3:
+    if payload.guild_id is None or (payload.member and payload.member.bot):
         return
 
-    cursor.execute(
-        "SELECT COUNT(*) FROM story_reactions WHERE user_id = ?",
-        (user.id,)
-    )
-    if cursor.fetchone()[0] >= 3:
-        return
-
-    # Only allow reactions in story channel
-    if message.channel.name not in STORY_CHANNEL:
+    tracked = story_feed.stories.get(payload.message_id)
+    if tracked is None or not tracked.can_earn(payload.user_id):
         return
 
-    cursor.execute(
-        "INSERT OR IGNORE INTO story_reactions (message_id, user_id) VALUES (?, ?)",
-        (message.id, user.id)
+    # checks the story, the per-story and per-reactor caps, and awards the
+    # author in one transaction
+    awarded = await storage.award_story_reaction(
+        payload.guild_id, payload.message_id, payload.user_id, today_est(),
+        STORY_XP_PER_REACTION, STORY_XP_MAX, STORY_REACTION_CAP
     )
-    conn.commit()
-
-    # Check if this message is a tracked story
-    cursor.execute("SELECT author_id, xp_awarded FROM story_posts WHERE message_id = ?", (message.id,))
-    result = cursor.fetchone()
-    if not result:
-        return  # Not a story post
-
-    author_id, current_xp = result
+    if awarded:
+        story_feed.awarded(payload.message_id, payload.channel_id, awarded[1])
 
-    # Check if reactor has already given a story XP today
-    today = today_est()
-    cursor.execute("""
-        SELECT 1 FROM story_reactions
-        WHERE message_id = ? AND reactor_id = ? AND date = ?
-    """, (message.id, user.id, today))
-    if cursor.fetchone():
-        return  # Reactor already gave XP today for this story
-
-    # Only give XP if story hasn't reached max
-    if current_xp >= STORY_XP_MAX:
-        return  # Max XP reached
-
-    # Grant XP to original author
-    xp_to_add = min(STORY_XP_PER_REACTION, STORY_XP_MAX - current_xp)
-    add_xp(author_id, xp_to_add)
-
-    # Log reaction
-    cursor.execute("""
-        INSERT INTO story_reactions (message_id, reactor_id, date)
-        VALUES (?, ?, ?)
-    """, (message.id, user.id, today))
-
-    # Update XP in story_posts table
-    cursor.execute("""
-        UPDATE story_posts SET xp_awarded = xp_awarded + ? WHERE message_id = ?
-    """, (xp_to_add, message.id))
-    conn.commit()
-
-    # Optionally, notify the author in the channel
-    author = message.guild.get_member(author_id)
-    if author:
-        try:
-            await message.channel.send(f"🎉 {author.mention} received {xp_to_add} XP for their story!")
-        except:
-            pass
+@tasks.loop(hours=1)
+@timed(TASK_SECONDS, task="archive_stories_task")
+async def archive_stories_task():
+    story_feed.prune()
+    if await acquire_lease(ROTATION_LEASE):
+        await storage.archive_stories(story_feed.active_since())
 
 # ========================
 # STREAK HANDLING
 # ========================
 
 @tasks.loop(minutes=10)
+@timed(TASK_SECONDS, task="reset_missed_streaks")
 async def reset_missed_streaks():
-    today = today_est()
-
-    cursor.execute("""
-        UPDATE users
-        SET streak = 0
-        WHERE last_quest_date IS NOT NULL
-        AND DATE(last_quest_date) < DATE(?)
-        AND streak != 0
-    """, (today,))
+    # a streak lives through the day after its last quest
+    yesterday = (clock.date() - timedelta(days=1)).isoformat()
+    await storage.reset_missed_streaks(yesterday)
 
-    conn.commit()
-
-def update_streak(user_id):
-    cursor.execute(
-        "SELECT last_quest_date, streak FROM users WHERE user_id = ?",
-        (user_id,)
-    )
-    result = cursor.fetchone()
+async def update_streak(guild_id, user_id, today):
+    """Count a quest claimed on `today` (ISO date) towards the streak"""
+    result = await storage.get_streak(guild_id, user_id)
     if not result:
         return 1
 
     last_date, streak = result
-    today = datetime.now(TZ).date()
+    today = datetime.fromisoformat(today).date()
 
     if last_date:
         last_date = datetime.strptime(last_date, "%Y-%m-%d").date()
@@ -1051,67 +1111,138 @@ def update_streak(user_id):
     else:
         streak = 1
 
-    cursor.execute(
-        "UPDATE users SET streak = ?, last_quest_date = ? WHERE user_id = ?",
-        (streak, today.isoformat(), user_id)
-    )
-    conn.commit()
+    await storage.set_streak(guild_id, user_id, streak, today.isoformat())
     return streak
 
 @reset_missed_streaks.before_loop
 async def before_reset_missed_streaks():
     await bot.wait_until_ready()
-    now = datetime.now(TZ)
-    next_midnight = (now + timedelta(days=1)).replace(
-        hour=0, minute=0, second=0, microsecond=0
-    )
-    await asyncio.sleep((next_midnight - now).total_seconds())
+    await clock.sleep(clock.seconds_until(0))
 
 # ========================
-# RANK SELECTION VIEW
+# CLAIM HISTORY
 # ========================
 
-class RankSelectView(View):
-    def __init__(self, member_id):
-        super().__init__(timeout=None)
-        self.member_id = member_id
+# Claims that can't be repeated anymore are folded into per-week completion
+# counters, so quest_claims only holds today's and this week's claims.
+@tasks.loop(hours=1)
+@timed(TASK_SECONDS, task="compact_claims_task")
+async def compact_claims_task():
+    if await acquire_lease(ROTATION_LEASE):
+        await storage.compact_claims(today_est(), week_start_est())
 
-    @discord.ui.button(label="🟢 Start as Initiate", style=discord.ButtonStyle.success, custom_id="rank_initiate")
-    async def initiate_button(self, interaction: discord.Interaction, button: Button):
-        await self.assign_rank(interaction, 1, 0)
+# ========================
+# XP LEDGER
+# ========================
 
-    @discord.ui.button(label="🔵 Start as Explorer", style=discord.ButtonStyle.primary, custom_id="rank_explorer")
-    async def explorer_button(self, interaction: discord.Interaction, button: Button):
-        await self.assign_rank(interaction, 2, 150)
+# Every XP change is appended to xp_log and users.xp is its projection.
+# Snapshots fold the log into xp_snapshot so a check or rebuild only has
+# to replay the events since the last one.
+LEDGER_SNAPSHOT_HOURS = 6
 
-    async def assign_rank(self, interaction: discord.Interaction, rank_number, bonus_xp):
-        if interaction.user.id != self.member_id:
-            await interaction.response.send_message("❌ This selection is not for you.", ephemeral=True)
-            return
+@tasks.loop(hours=LEDGER_SNAPSHOT_HOURS)
+@timed(TASK_SECONDS, task="ledger_snapshot_task")
+async def ledger_snapshot_task():
+    # the rotation leader does it, so shard processes don't all take snapshots
+    if await acquire_lease(ROTATION_LEASE):
+        await storage.snapshot_ledger()
 
-        member = interaction.user
-        guild = interaction.guild
+@bot.command(name="ledger-check")
+@commands.has_permissions(administrator=True)
+async def ledger_check(ctx):
+    """Compare this server's XP balances with the XP ledger."""
+    drift = [row for row in await storage.ledger_drift() if row[0] == ctx.guild.id]
+    if not drift:
+        await ctx.send("✅ Every XP balance matches the ledger.")
+        return
 
-        set_rank(member.id, rank_number)
+    lines = [
+        f"<@{user_id}> — stored {stored_xp} XP, ledger {ledger_xp} XP"
+        for _, user_id, stored_xp, ledger_xp in drift[:10]
+    ]
+    if len(drift) > 10:
+        lines.append(f"…and {len(drift) - 10} more")
+    await ctx.send(
+        f"⚠️ {len(drift)} XP balances drifted from the ledger:\n" + "\n".join(lines) +
+        "\nRun `python storage.py ledger-rebuild <DATABASE_URL>` to restore them from the ledger.",
+        allowed_mentions=discord.AllowedMentions.none()
+    )
 
-        if bonus_xp > 0:
-            add_bonus_xp(member.id, bonus_xp)
+# ========================
+# RANK SELECTION VIEW
+# ========================
 
-        await assign_rank_role(member, rank_number)
+# Starting ranks offered on welcome messages: (rank, bonus XP, label, style).
+# The buttons' custom_ids name the rank and a selection id. Who may press
+# them is kept in storage (rank_selections) under that id, so the buttons
+# are stateless and keep working across restarts. The id is made up before
+# the welcome is sent, so its rows exist before anyone can click. Welcomes
+# from before selection ids have bare "rank_<rank>" ids and are keyed by
+# their message id.
+STARTING_RANKS = {
+    "initiate": (1, 0, "🟢 Start as Initiate", discord.ButtonStyle.success),
+    "explorer": (2, 150, "🔵 Start as Explorer", discord.ButtonStyle.primary),
+}
+
+class RankSelectButton(discord.ui.DynamicItem[Button], template=r"rank_(?P<rank>initiate|explorer)(?::(?P<selection>\d+))?"):
+    def __init__(self, rank, selection=None):
+        _, _, label, style = STARTING_RANKS[rank]
+        custom_id = f"rank_{rank}:{selection}" if selection else f"rank_{rank}"
+        super().__init__(Button(label=label, style=style, custom_id=custom_id))
+        self.rank = rank
+        self.selection = selection
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        selection = match["selection"]
+        return cls(match["rank"], int(selection) if selection else None)
+
+    async def callback(self, interaction: discord.Interaction):
+        rank_number, bonus_xp, _, _ = STARTING_RANKS[self.rank]
+        selection = self.selection or interaction.message.id
+        await assign_starting_rank(interaction, selection, rank_number, bonus_xp)
+
+def build_rank_select_view(selection):
+    view = View(timeout=None)
+    for rank in STARTING_RANKS:
+        view.add_item(RankSelectButton(rank, selection))
+    return view
+
+# unique across restarts and shard processes sharing a database
+selection_ids = itertools.count(time.time_ns())
+
+async def assign_starting_rank(interaction: discord.Interaction, selection, rank_number, bonus_xp):
+    member = interaction.user
+    guild = interaction.guild
+
+    remaining = await storage.take_rank_selection(guild.id, member.id, selection)
+    if remaining is None:
+        await interaction.response.send_message("❌ This selection is not for you.", ephemeral=True)
+        return
+    await interaction.response.defer()
 
+    await storage.set_rank(guild.id, member.id, rank_number)
+
+    if bonus_xp > 0:
+        await storage.add_xp(guild.id, member.id, bonus_xp, "start_bonus")
+
+    await assign_rank_role(member, rank_number)
+
+    # a bulk welcome stays up until everyone on it has picked
+    if remaining == 0:
         try:
             await interaction.message.delete()
         except:
             pass
 
-        welcome_channel = discord.utils.get(guild.text_channels, name="welcome")
-        if welcome_channel:
-            await welcome_channel.send(
-                f"🎉 Welcome {member.mention}!\n\n"
-                "📜 Please read the rules in **#rules**\n"
-                "🎓 Learn how the game works in **#tutorial**\n\n"
-                "Your journey starts now — complete your first quest today!"
-            )
+    welcome_channel = guild_cache.text_channel(guild, "welcome")
+    if welcome_channel:
+        await welcome_channel.send(
+            f"🎉 Welcome {member.mention}!\n\n"
+            "📜 Please read the rules in **#rules**\n"
+            "🎓 Learn how the game works in **#tutorial**\n\n"
+            "Your journey starts now — complete your first quest today!"
+        )
 
 # ========================
 # EVENTS
@@ -1126,12 +1257,18 @@ async def on_ready():
 
     print(f"✅ Logged in as {bot.user}")
 
-    bot.add_view(RankSelectView(0))
+    # rows from before multi-guild support go to LEGACY_GUILD_ID, or to the
+    # only guild if the bot serves just one (a shard process may see a single
+    # guild without being the only one, so sharded mode needs LEGACY_GUILD_ID)
+    legacy_guild_id = int(os.getenv("LEGACY_GUILD_ID", 0))
+    if not legacy_guild_id and len(bot.guilds) == 1 and not SHARDED:
+        legacy_guild_id = bot.guilds[0].id
+    if legacy_guild_id:
+        leftover = await storage.adopt_legacy_rows(legacy_guild_id)
+        if leftover:
+            print(f"⚠️ {leftover} legacy user rows already exist in guild {legacy_guild_id} and were left unassigned")
 
-    generate_daily_quests()
-    generate_weekly_quests()
-
-    await post_daily_quests()
+    await run_rollover()
 
     if not daily_reset_task.is_running():
         daily_reset_task.start()
@@ -1139,43 +1276,289 @@ async def on_ready():
     if not quest_notifications.is_running():
         quest_notifications.start()
 
+    for guild_id in await storage.role_reset_guilds():
+        if bot.get_guild(guild_id):
+            queue_role_resets(guild_id)
+
     if not reset_missed_streaks.is_running():
         reset_missed_streaks.start()
 
+    if not ledger_snapshot_task.is_running():
+        ledger_snapshot_task.start()
+
+    if not compact_claims_task.is_running():
+        compact_claims_task.start()
+
+    if not archive_stories_task.is_running():
+        archive_stories_task.start()
+
+
+
+
+@bot.check
+async def guild_only(ctx):
+    # all game state is per guild, so commands are ignored in DMs
+    return ctx.guild is not None
+
+@bot.event
+async def on_guild_channel_create(channel):
+    guild_cache.invalidate_channels(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    guild_cache.invalidate_channels(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    guild_cache.invalidate_channels(after.guild.id)
+
+@bot.event
+async def on_guild_role_create(role):
+    guild_cache.invalidate_roles(role.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    guild_cache.invalidate_roles(role.guild.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    guild_cache.invalidate_roles(after.guild.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    guild_cache.drop(guild.id)
+    join_times.pop(guild.id, None)
+    bulk_guilds.discard(guild.id)
+
+# ========================
+# MEMBER JOINS
+# ========================
+
+# Joins are queued and handled by one worker: user rows are created in one
+# batch per guild, and the role and welcome REST calls go out one at a time,
+# pausing longer whenever Discord answers with a 429. Past JOIN_BULK_RATE
+# joins a minute in a guild (a raid or an invite wave) the welcomes are
+# merged into one message per batch until the rate halves.
+JOIN_BULK_RATE = int(os.getenv("JOIN_BULK_RATE", 30))
+JOIN_BATCH_SIZE = 100
+JOIN_BULK_MENTIONS = 40
+JOIN_MAX_PAUSE = 10.0
+
+join_queue = asyncio.Queue()
+join_times = {}  # guild id -> deque of join times in the last minute
+bulk_guilds = set()
+
+WELCOME_TEXT = (
+    "This server is a **real-world** social confidence game. It's a place for people to step out of their comfort zone as they complete **daily and weekly challenges** made to suit your own progression.\n"
+    "You complete these small challenges in real life, earn XP, rank up, and build confidence step by step.\n\n"
+    "For those who want to start small, we recommend starting with the **Initiate Rank**. For those who want to build on their existing social skills, we recommend choosing the **Explorer Rank**.\n"
+    "Choose your starting path:\n"
+    "🟢 **Initiate** — slower, gentler challenges\n"
+    "🔵 **Explorer** — for confident starters\n"
+)
 
+def track_join_rate(guild_id):
+    now = time.monotonic()
+    times = join_times.setdefault(guild_id, deque())
+    times.append(now)
+    while times[0] < now - 60:
+        times.popleft()
 
+    if len(times) >= JOIN_BULK_RATE and guild_id not in bulk_guilds:
+        bulk_guilds.add(guild_id)
+        print(f"⚠️ {len(times)} joins/min in guild {guild_id}, switching to bulk welcomes")
+    elif len(times) < JOIN_BULK_RATE // 2 and guild_id in bulk_guilds:
+        bulk_guilds.discard(guild_id)
+        print(f"✅ Join rate back to normal in guild {guild_id}")
 
 @bot.event
 async def on_member_join(member):
     if member.bot:
         return
 
-    get_user(member.id)
+    track_join_rate(member.guild.id)
+    join_queue.put_nowait(member)
 
-    guild = member.guild
+@bot.event
+async def on_raw_member_remove(payload):
+    # raw, so it fires for members that aren't cached too
+    await storage.drop_rank_selections(payload.guild_id, [payload.user.id])
+
+async def next_join_batch():
+    """Wait for a join, then take whatever else queued up meanwhile"""
+    batch = [await join_queue.get()]
+    while len(batch) < JOIN_BATCH_SIZE and not join_queue.empty():
+        batch.append(join_queue.get_nowait())
+    return batch
+
+def rate_limit_count():
+    return sum(metrics.REST_RATE_LIMITS.values.values())
+
+async def paced(pause, action, what="welcoming new members"):
+    """Run a REST call, then wait `pause`, doubled after a 429 and halved otherwise"""
+    limited = rate_limit_count()
+    try:
+        await action
+    except Exception as e:
+        print(f"Error {what}: {e}")
+
+    if rate_limit_count() > limited:
+        pause = min(max(pause * 2, 0.5), JOIN_MAX_PAUSE)
+    else:
+        pause = pause / 2 if pause > 0.05 else 0.0
+
+    if pause:
+        await asyncio.sleep(pause)
+    return pause
+
+async def send_rank_selection(channel, members):
+    # stored before sending, so a click right after the welcome appears is theirs
+    selection = next(selection_ids)
+    user_ids = [member.id for member in members]
+    await storage.add_rank_selections(channel.guild.id, selection, user_ids)
+
+    mentions = " ".join(member.mention for member in members)
+    message = None
+    try:
+        message = await dispatcher.send(
+            channel,
+            f"👋 Welcome {mentions} to the Social Guinea Pigs!\n\n" + WELCOME_TEXT,
+            view=build_rank_select_view(selection)
+        )
+    finally:
+        if message is None:
+            # no welcome went out, so nobody can ever use these picks
+            await storage.drop_rank_selections(channel.guild.id, user_ids)
+
+async def join_worker():
+    pause = 0.0
+    while True:
+        batch = await next_join_batch()
+
+        by_guild = {}
+        for member in batch:
+            by_guild.setdefault(member.guild, []).append(member)
+
+        for guild, members in by_guild.items():
+            try:
+                await storage.ensure_users(guild.id, [member.id for member in members])
+            except Exception as e:
+                print(f"Error creating users for {len(members)} joins in guild {guild.id}: {e}")
 
-    unranked_role = discord.utils.get(guild.roles, name="Unranked")
-    if unranked_role:
+            unranked_role = guild_cache.role(guild, "Unranked")
+            start_channel = guild_cache.text_channel(guild, "start-here")
+
+            if unranked_role:
+                for member in members:
+                    pause = await paced(pause, member.add_roles(unranked_role))
+
+            if not start_channel:
+                continue
+
+            if guild.id in bulk_guilds:
+                for i in range(0, len(members), JOIN_BULK_MENTIONS):
+                    pause = await paced(pause, send_rank_selection(start_channel, members[i:i + JOIN_BULK_MENTIONS]))
+            else:
+                for member in members:
+                    pause = await paced(pause, send_rank_selection(start_channel, [member]))
+
+# ========================
+# BULK RANK ROLES
+# ========================
+
+# Rank changes of many members at once (bulk grants, season ends) cost two
+# REST calls per member, so they're queued and worked off by one worker at
+# the paced() rate. Queue items are (guild id, [(user_id, old_rank,
+# new_rank)]), or (guild id, None) to work off the role resets a season end
+# stored, which survive a restart.
+ROLE_RESET_BATCH_SIZE = 500
+ROLE_RESET_RETRY_SECONDS = 60  # a failed role reset drain is queued again after this
+
+role_queue = asyncio.Queue()
+queued_role_resets = set()
+
+def queue_role_resets(guild_id):
+    if guild_id not in queued_role_resets:
+        queued_role_resets.add(guild_id)
+        role_queue.put_nowait((guild_id, None))
+
+async def swap_rank_roles(guild, changes, pause):
+    reason = "Rank changed in bulk"
+    for user_id, old_rank, new_rank in changes:
         try:
-            await member.add_roles(unranked_role)
-        except:
-            pass
+            old_role = guild_cache.role(guild, RANK_ROLE_NAMES[RANKS[old_rank]])
+            new_role = guild_cache.role(guild, RANK_ROLE_NAMES[RANKS[new_rank]])
+        except KeyError as e:
+            # one bad row mustn't hold up the rest of the batch
+            print(f"Error changing rank roles of {user_id} in guild {guild.id}: unknown rank {e}")
+            continue
+        # by id, so members don't have to be cached or fetched
+        if old_role:
+            pause = await paced(pause, bot.http.remove_role(guild.id, user_id, old_role.id, reason=reason), "changing rank roles")
+        if new_role:
+            pause = await paced(pause, bot.http.add_role(guild.id, user_id, new_role.id, reason=reason), "changing rank roles")
+    return pause
+
+async def drain_role_resets(guild, pause):
+    while True:
+        resets = await storage.pending_role_resets(guild.id, ROLE_RESET_BATCH_SIZE)
+        if not resets:
+            return pause
+        pause = await swap_rank_roles(guild, [(user_id, old_rank, 1) for user_id, old_rank in resets], pause)
+        await storage.finish_role_resets(guild.id, [user_id for user_id, _ in resets])
+
+async def role_worker():
+    pause = 0.0
+    while True:
+        guild_id, changes = await role_queue.get()
+        guild = bot.get_guild(guild_id)
+        try:
+            if guild is None:
+                continue
+            if changes is None:
+                pause = await drain_role_resets(guild, pause)
+            else:
+                pause = await swap_rank_roles(guild, changes, pause)
+        except Exception as e:
+            print(f"Error changing rank roles in guild {guild_id}: {e}")
+            if changes is None:
+                # what's left stays in storage, try it again later
+                bot.loop.call_later(ROLE_RESET_RETRY_SECONDS, queue_role_resets, guild_id)
+        finally:
+            if changes is None:
+                queued_role_resets.discard(guild_id)
+
+# ========================
+# SEASONS
+# ========================
 
-    start_channel = discord.utils.get(guild.text_channels, name="start-here")
-    if not start_channel:
+# !endseason archives the guild's standings and resets everyone in one
+# storage transaction, the rank roles follow through the role queue.
+@bot.command(name="endseason")
+@commands.has_permissions(administrator=True)
+async def end_season_command(ctx, confirm: str = ""):
+    """End the season: archive standings and reset everyone's XP, rank and streak."""
+    if confirm != "confirm":
+        await ctx.send("⚠️ This resets XP, ranks and streaks of every member. Run `!endseason confirm` to go ahead.")
         return
 
-    view = RankSelectView(member.id)
-
-    await start_channel.send(
-        f"👋 Welcome {member.mention} to the Social Guinea Pigs!\n\n"
-        "This server is a **real-world** social confidence game. It's a place for people to step out of their comfort zone as they complete **daily and weekly challenges** made to suit your own progression.\n"
-        "You complete these small challenges in real life, earn XP, rank up, and build confidence step by step.\n\n"
-        "For those who want to start small, we recommend starting with the **Initiate Rank**. For those who want to build on their existing social skills, we recommend choosing the **Explorer Rank**.\n"
-        "Choose your starting path:\n"
-        "🟢 **Initiate** — slower, gentler challenges\n"
-        "🔵 **Explorer** — for confident starters\n",
-        view=view
+    start = time.perf_counter()
+    season, members = await storage.end_season(ctx.guild.id, clock.now().isoformat(), today_est(), week_start_est())
+    story_feed.drop_guild(ctx.guild.id)
+    queue_role_resets(ctx.guild.id)
+
+    top = await storage.season_standings(ctx.guild.id, season, 3)
+    names = await member_names.resolve(ctx.guild, [user_id for user_id, _, _ in top])
+    podium = "\n".join(
+        f"{place}. {names.get(user_id) or f'User {user_id}'} — {xp} XP ({RANKS[rank]})"
+        for place, (user_id, xp, rank) in enumerate(top, start=1)
+    )
+
+    await ctx.send(
+        f"🏁 **Season {season} has ended!** {members} members earned XP this season.\n"
+        f"{podium or 'Nobody earned XP this season.'}\n\n"
+        f"Everyone starts again as Initiate. Rank roles are being reset in the background. "
+        f"({time.perf_counter() - start:.1f}s)"
     )
 
 # ========================
@@ -1184,7 +1567,7 @@ async def on_member_join(member):
 
 def get_next_goal(rank_number, xp):
     rank_name = RANKS[rank_number]
-    tiers = RANK_TIERS.get(rank_name, [])
+    tiers = game.rank_tiers[rank_name]
 
     current_tier = get_current_tier(rank_number, xp)
 
@@ -1195,7 +1578,7 @@ def get_next_goal(rank_number, xp):
     elif rank_number < max(RANKS.keys()):
         next_rank_number = rank_number + 1
         next_rank_name = RANKS[next_rank_number]
-        next_rank_first_xp = RANK_XP_THRESHOLDS[next_rank_number][0]
+        next_rank_first_xp = game.rank_floors[next_rank_number - 1]
         return f"{next_rank_name} — Tier 1", next_rank_first_xp - xp
 
     return "Max Rank", 0
@@ -1204,57 +1587,194 @@ def get_next_goal(rank_number, xp):
 # PROFILE WIDGET
 # ========================
 
-@bot.command()
-async def profile(ctx, member: discord.Member = None):
-    target = member or ctx.author
-    user = get_user(target.id)
-    xp, rank_number, streak = user[1], user[2], user[3]
+# Everything !profile derives from a user row. It only depends on
+# (xp, rank, streak), so it's cached on exactly that.
+ProfileStats = namedtuple("ProfileStats", "rank_name tier goal_label xp_to_goal progress color streak_label")
 
+@functools.lru_cache(maxsize=4096)
+def profile_stats(xp, rank_number, streak):
     rank_name = RANKS[rank_number]
-
-    # ===== Current tier and next goal =====
     tier = get_current_tier(rank_number, xp)
-    next_goal_label, xp_to_next_goal = get_next_goal(rank_number, xp)
+    goal_label, xp_to_goal = get_next_goal(rank_number, xp)
+
+    # progress from the start of the current tier to the next goal
+    tiers = game.rank_tiers[rank_name]
+    tier_start = tiers[tier - 2] if tier > 1 else game.rank_floors[rank_number - 1]
+    span = xp + xp_to_goal - tier_start
+    progress = (xp - tier_start) / span if xp_to_goal > 0 and span > 0 else 1.0
+
+    return ProfileStats(
+        rank_name=rank_name,
+        tier=tier,
+        goal_label=goal_label,
+        xp_to_goal=xp_to_goal,
+        progress=max(0.0, min(1.0, progress)),
+        color=RANK_COLORS.get(rank_name, 0xFFFFFF),
+        streak_label=f"{streak} day{'s' if streak != 1 else ''}"
+    )
+
+class CompletionCounts:
+    """
+    Bounded LRU of members' {quest_key: completions} for !profile. Claims
+    count into cached entries, so storage is only read for a member's
+    first profile since a restart or eviction.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.counts = OrderedDict()
+        self.loading = set()
+        self.raced = set()  # loading members who claimed meanwhile
+
+    async def get(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        counts = self.counts.get(key)
+        if counts is not None:
+            self.counts.move_to_end(key)
+            return counts
+
+        self.loading.add(key)
+        try:
+            counts = await storage.quest_completions(guild_id, user_id)
+        finally:
+            self.loading.discard(key)
+
+        # the read may or may not include a claim made while it ran
+        if key in self.raced:
+            self.raced.discard(key)
+            return counts
+
+        self.counts[key] = counts
+        while len(self.counts) > self.size:
+            self.counts.popitem(last=False)
+        return counts
+
+    def add(self, guild_id, user_id, quest_key):
+        """Count a claim of `quest_key` (weekly keys without their week)"""
+        key = (guild_id, user_id)
+        counts = self.counts.get(key)
+        if counts is not None:
+            counts[quest_key] = counts.get(quest_key, 0) + 1
+        elif key in self.loading:
+            self.raced.add(key)
+
+completion_counts = CompletionCounts()
+
+# PROFILE_CARDS=1 attaches a PNG card to !profile (needs Pillow)
+PROFILE_CARDS = os.getenv("PROFILE_CARDS", "0") == "1"
+if PROFILE_CARDS and not cards_available():
+    print("⚠️ PROFILE_CARDS needs Pillow (pip install Pillow), profile cards are off")
+    PROFILE_CARDS = False
+card_renderer = CardRenderer() if PROFILE_CARDS else None
+
+@bot.hybrid_command()
+async def profile(ctx, member: discord.Member = None):
+    """Show your profile, or another member's."""
+    await ctx.defer()
+    target = member or ctx.author
+    user = await storage.get_user(ctx.guild.id, target.id)
+    xp, rank_number, streak = user[1], user[2], user[3]
+    stats = profile_stats(xp, rank_number, streak)
 
     embed = discord.Embed(
         title=f"{target.display_name}'s Profile",
-        description=f"**{rank_name}** — Tier {tier}",
-        color=RANK_COLORS.get(rank_name, 0xFFFFFF)
+        description=f"**{stats.rank_name}** — Tier {stats.tier}",
+        color=stats.color
     )
 
-
     embed.set_thumbnail(url=target.display_avatar.url)
 
+    embed.add_field(name="🔥 Streak", value=stats.streak_label, inline=True)
+    embed.add_field(name="⭐ XP", value=f"{xp} XP", inline=True)
     embed.add_field(
-        name="🔥 Streak",
-        value=f"{streak} day{'s' if streak != 1 else ''}",
-        inline=True
-    )
-    embed.add_field(
-        name="⭐ XP",
-        value=f"{xp} XP",
-        inline=True
+        name="Next Goal",
+        value=f"{stats.goal_label} ({stats.xp_to_goal} XP to go)",
+        inline=False
     )
+
+    completions = await completion_counts.get(ctx.guild.id, target.id)
+    weekly = sum(count for key, count in completions.items() if key.startswith(WEEKLY_KEY_PREFIX))
     embed.add_field(
-        name="Next Goal",
-        value=f"{next_goal_label} ({xp_to_next_goal} XP to go)",
+        name="📜 Quests Completed",
+        value=f"{sum(completions.values()) - weekly} daily · {weekly} weekly",
         inline=False
     )
 
-    await ctx.send(embed=embed)
+    if not card_renderer:
+        await ctx.send(embed=embed)
+        return
+
+    try:
+        png = await card_renderer.render(
+            target.display_name, stats.rank_name, stats.tier, xp, streak,
+            stats.goal_label, stats.xp_to_goal, stats.progress, stats.color
+        )
+    except Exception as e:
+        print(f"Error rendering profile card: {e}")
+        await ctx.send(embed=embed)
+        return
+
+    embed.set_image(url="attachment://profile.png")
+    await ctx.send(embed=embed, file=discord.File(BytesIO(png), filename="profile.png"))
 
 # ========================
 # LEADERBOARDS
 # ========================
 
-@bot.command(name="lb")
-async def leaderboard(ctx):
-    for member in ctx.guild.members:
-        if not member.bot:
-            get_user(member.id)
+class MemberNames:
+    """
+    Bounded LRU of display names for members that aren't cached. Misses are
+    resolved with one gateway member query, members who left are
+    remembered as None.
+    """
 
-    cursor.execute("SELECT user_id, xp FROM users ORDER BY xp DESC")
-    results = cursor.fetchall()
+    def __init__(self, size=2048, ttl=3600):
+        self.size = size
+        self.ttl = ttl
+        self.names = OrderedDict()
+
+    async def resolve(self, guild, user_ids):
+        """Return {user_id: display name or None}"""
+        now = time.monotonic()
+        names = {}
+        missing = []
+
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            entry = self.names.get((guild.id, user_id))
+            if member:
+                names[user_id] = member.display_name
+            elif entry and entry[1] > now:
+                self.names.move_to_end((guild.id, user_id))
+                names[user_id] = entry[0]
+            else:
+                missing.append(user_id)
+
+        if missing:
+            try:
+                members = await guild.query_members(user_ids=missing, cache=False)
+            except Exception as e:
+                print(f"Error fetching leaderboard members: {e}")
+                return names
+
+            found = {member.id: member.display_name for member in members}
+            for user_id in missing:
+                names[user_id] = found.get(user_id)
+                self.names[(guild.id, user_id)] = (names[user_id], now + self.ttl)
+                self.names.move_to_end((guild.id, user_id))
+            while len(self.names) > self.size:
+                self.names.popitem(last=False)
+
+        return names
+
+member_names = MemberNames()
+
+@bot.hybrid_command(name="lb")
+async def leaderboard(ctx):
+    """Show the server's top 10."""
+    await ctx.defer()
+    results = await storage.top_users(ctx.guild.id, 10)
+    names = await member_names.resolve(ctx.guild, [user_id for user_id, _ in results])
 
     embed = discord.Embed(
         title="🏆 Global Leaderboard",
@@ -1263,9 +1783,8 @@ async def leaderboard(ctx):
 
     user_rank = None
 
-    for index, (user_id, xp) in enumerate(results[:10], start=1):
-        member = ctx.guild.get_member(user_id)
-        name = member.display_name if member else f"User {user_id}"
+    for index, (user_id, xp) in enumerate(results, start=1):
+        name = names.get(user_id) or f"User {user_id}"
         embed.add_field(name=f"#{index} — {name}", value=f"{xp} XP", inline=False)
 
         if user_rank is None and user_id == ctx.author.id:
@@ -1280,34 +1799,30 @@ async def leaderboard(ctx):
 # ADMIN COMMAND
 # ========================
 
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
 async def givexp(ctx, member: discord.Member, amount: int):
+    """Give a member XP."""
+    await ctx.defer()
     if amount <= 0:
         await ctx.send("❌ XP must be positive.")
         return
 
-    get_user(member.id)
-
     # Get current XP and tier
-    cursor.execute("SELECT xp, rank FROM users WHERE user_id = ?", (member.id,))
-    user_data = cursor.fetchone()
-    old_xp = user_data[0]
-    old_rank = user_data[1]
+    user_data = await storage.get_user(ctx.guild.id, member.id)
+    old_xp = user_data[1]
+    old_rank = user_data[2]
     old_tier = get_current_tier(old_rank, old_xp)
 
-    # Add XP
-    add_bonus_xp(member.id, amount)
-
-    # Get new XP, rank, and tier
-    cursor.execute("SELECT xp FROM users WHERE user_id = ?", (member.id,))
-    new_xp = cursor.fetchone()[0]
+    # Add XP, get new XP, rank, and tier
+    new_xp = await storage.add_xp(ctx.guild.id, member.id, amount, "admin")
     new_rank = get_rank_from_xp(new_xp)
     new_tier = get_current_tier(new_rank, new_xp)
 
     # Update rank role if rank changed
     if new_rank != old_rank:
-        set_rank(member.id, new_rank)
+        await storage.set_rank(ctx.guild.id, member.id, new_rank)
         await assign_rank_role(member, new_rank)
 
     # Build message
@@ -1320,23 +1835,283 @@ async def givexp(ctx, member: discord.Member, amount: int):
 
     await ctx.send("\n".join(message_parts))
 
-@bot.command()
+# CSV files for !grantxp hold "user id or mention, XP" lines
+GRANT_MAX_BYTES = 1_000_000
+
+def parse_grants(text):
+    """Return ({user_id: xp}, numbers of lines that couldn't be read)"""
+    grants, bad_lines = {}, []
+    for number, row in enumerate(csv.reader(StringIO(text)), start=1):
+        if not any(field.strip() for field in row):
+            continue
+        try:
+            user_id = int(row[0].strip().strip("<@!>"))
+            amount = int(row[1])
+        except (IndexError, ValueError):
+            if number > 1:  # a header line
+                bad_lines.append(number)
+            continue
+        if amount <= 0:
+            bad_lines.append(number)
+            continue
+        grants[user_id] = grants.get(user_id, 0) + amount
+    return grants, bad_lines
+
+@bot.hybrid_command()
 @commands.has_permissions(administrator=True)
-async def resetxp(ctx, member: discord.Member):
-    get_user(member.id)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(amount="XP for every member of the role", role="Members to give XP", file="CSV of user id, XP lines")
+async def grantxp(ctx, amount: int = 0, role: discord.Role = None, file: discord.Attachment = None):
+    """Give XP to every member of a role, or per member from a CSV file."""
+    await ctx.defer()
+    bad_lines, unknown_ids = [], []
+    if file:
+        if file.size > GRANT_MAX_BYTES:
+            await ctx.send("❌ The file is too big.")
+            return
+        grants, bad_lines = parse_grants((await file.read()).decode("utf-8-sig", errors="replace"))
+        # the file can name anyone, only this guild's members get XP (and a users row)
+        members = ctx.guild.members if ctx.guild.chunked else await ctx.guild.chunk(cache=False)
+        member_ids = {member.id for member in members if not member.bot}
+        unknown_ids = [user_id for user_id in grants if user_id not in member_ids]
+        for user_id in unknown_ids:
+            del grants[user_id]
+    elif role and amount > 0:
+        # members aren't cached unless MEMBER_CACHE=all, one chunk request fetches them all
+        members = role.members if ctx.guild.chunked else [
+            member for member in await ctx.guild.chunk(cache=False) if member.get_role(role.id)
+        ]
+        grants = {member.id: amount for member in members if not member.bot}
+    else:
+        await ctx.send("❌ Use `!grantxp <amount> <role>` or attach a CSV of `user id, XP` lines.")
+        return
 
-    cursor.execute(
-        "UPDATE users SET xp = 0, rank = 1 WHERE user_id = ?",
-        (member.id,)
-    )
-    conn.commit()
+    if not grants:
+        await ctx.send("❌ Nobody to give XP to." + (" None of the ids are members here." if unknown_ids else ""))
+        return
+
+    start = time.perf_counter()
+    users = await storage.grant_xp(ctx.guild.id, list(grants.items()), "admin")
+
+    rank_ups = []
+    for user_id, new_xp, rank in users:
+        new_rank = get_rank_from_xp(new_xp)
+        if new_rank > rank:
+            rank_ups.append((user_id, rank, new_rank))
+    if rank_ups:
+        await storage.set_ranks(ctx.guild.id, [(user_id, new_rank) for user_id, _, new_rank in rank_ups])
+        role_queue.put_nowait((ctx.guild.id, rank_ups))
+
+    message_parts = [
+        f"✅ Gave {sum(grants.values())} XP to {len(users)} members ({time.perf_counter() - start:.1f}s)"
+    ]
+    if rank_ups:
+        shown = ", ".join(f"<@{user_id}> → {RANKS[new_rank]}" for user_id, _, new_rank in rank_ups[:10])
+        more = f" and {len(rank_ups) - 10} more" if len(rank_ups) > 10 else ""
+        message_parts.append(f"🎉 **{len(rank_ups)} RANK UP{'S' if len(rank_ups) > 1 else ''}!** {shown}{more}")
+    if bad_lines:
+        message_parts.append(f"⚠️ Skipped unreadable lines: {', '.join(map(str, bad_lines[:20]))}")
+    if unknown_ids:
+        message_parts.append(f"⚠️ Skipped ids that aren't members here (or are bots): {', '.join(map(str, unknown_ids[:20]))}")
+
+    await ctx.send("\n".join(message_parts))
+
+@bot.hybrid_command()
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def resetxp(ctx, member: discord.Member):
+    """Reset a member's XP and rank to Initiate."""
+    await ctx.defer()
+    await storage.get_user(ctx.guild.id, member.id)
+    await storage.reset_user(ctx.guild.id, member.id)
 
     await assign_rank_role(member, 1)
 
     await ctx.send(f"⚠️ {member.mention}'s XP and rank have been reset to Initiate.")
 
+async def reload_game_config():
+    """Load GAME_CONFIG again and swap it in, raises ConfigError if it's invalid"""
+    global game, claim_index
+
+    config = await asyncio.get_running_loop().run_in_executor(None, load_game_config, GAME_CONFIG, RANKS)
+
+    # today's rotation stays in storage, only the claim bits are re-keyed
+    index = build_claim_index(config)
+    await index.load()
+
+    game, claim_index = config, index
+    profile_stats.cache_clear()
+    return config
+
+@bot.command(name="reload")
+@commands.is_owner()
+async def reload_command(ctx):
+    """Reload quests and rank thresholds from GAME_CONFIG (this process only)."""
+    try:
+        config = await reload_game_config()
+    except ConfigError as e:
+        await ctx.send(f"❌ Config not reloaded, the current one stays active:\n```{str(e)[:1800]}```")
+        return
+
+    await ctx.send(f"✅ Reloaded `{config.source}`: {len(config.quests)} daily quests, {len(config.weekly)} weekly quests.")
+
+def format_histogram(histogram, limit, sort_by_total=False):
+    rows = histogram.summary()
+    rows.sort(key=(lambda r: r[1] * r[2]) if sort_by_total else (lambda r: r[1]), reverse=True)
+    lines = [
+        f"`{' '.join(labels) or 'all'}` — {count}× avg {avg * 1000:.1f}ms p95 ≤{p95 * 1000:.0f}ms"
+        for labels, count, avg, p95 in rows[:limit]
+    ]
+    return "\n".join(lines) or "No data yet"
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def stats(ctx):
+    """Show command, DB, REST and event loop metrics since startup."""
+    embed = discord.Embed(title="📊 Bot Stats", color=0xFFFFFF)
+
+    embed.add_field(name="Commands", value=format_histogram(metrics.COMMAND_SECONDS, 8), inline=False)
+    embed.add_field(name="Storage (by total time)", value=format_histogram(metrics.DB_QUERY_SECONDS, 8, True), inline=False)
+    embed.add_field(name="REST routes", value=format_histogram(metrics.REST_SECONDS, 6), inline=False)
+
+    rate_limits = sorted(metrics.REST_RATE_LIMITS.values.items(), key=lambda item: item[1], reverse=True)
+    embed.add_field(
+        name="429s",
+        value="\n".join(f"`{route}` — {count}" for (route,), count in rate_limits[:5]) or "None",
+        inline=False
+    )
+    embed.add_field(name="Tasks", value=format_histogram(metrics.TASK_SECONDS, 5), inline=False)
+
+    lag = metrics.LOOP_LAG.values.get((), 0)
+    embed.add_field(name="Event loop lag", value=f"{lag * 1000:.1f}ms", inline=False)
+
+    sent = metrics.OUTBOUND_MESSAGES.values
+    embed.add_field(
+        name="Outbound messages",
+        value=f"{dispatcher.depth()} queued, {sent.get(('sent',), 0)} sent, "
+              f"{metrics.OUTBOUND_COALESCED.values.get((), 0)} coalesced, {sent.get(('error',), 0)} failed",
+        inline=False
+    )
+
+    await ctx.send(embed=embed)
+
+# ========================
+# PROFILER
+# ========================
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/data/profiles")
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_MAX_SECONDS = 300
+
+profiler = None
+profile_stop = asyncio.Event()
+
+async def run_profile(channel, seconds):
+    profile_stop.clear()
+    try:
+        await asyncio.wait_for(profile_stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+    result = profiler.stop()
+    prefix = f"profile-{clock.now():%Y%m%d-%H%M%S}"
+    loop = asyncio.get_running_loop()
+    collapsed_path, summary_path = await loop.run_in_executor(None, result.write, PROFILE_DIR, prefix)
+
+    summary = result.summary()
+    if len(summary) > 1800:
+        summary = summary[:1800] + "\n..."
+    await channel.send(f"🧪 Profile written to `{collapsed_path}` and `{summary_path}`\n```\n{summary}```")
+
+@bot.command(name="profile-start")
+@commands.has_permissions(administrator=True)
+async def profile_start(ctx, seconds: int = PROFILE_DEFAULT_SECONDS):
+    """Sample the event loop and DB thread for up to `seconds` (max 5 minutes)."""
+    global profiler
+
+    if profiler is None:
+        # the event loop runs on the thread handling this command
+        profiler = SamplingProfiler(
+            threading.get_ident(),
+            thread_prefixes=("sqlite",),
+            statement_histogram=metrics.DB_QUERY_SECONDS
+        )
+
+    if profiler.running:
+        await ctx.send("❌ A profile is already running. Use `!profile-stop` to finish it.")
+        return
+
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    profiler.start(seconds)
+    bot.loop.create_task(run_profile(ctx.channel, seconds))
+
+    await ctx.send(f"🧪 Profiling for up to {seconds}s...")
+
+@bot.command(name="profile-stop")
+@commands.has_permissions(administrator=True)
+async def profile_stop_command(ctx):
+    """Finish the running profile early and post its summary."""
+    if profiler is None or not profiler.running:
+        await ctx.send("❌ No profile is running.")
+        return
+
+    profile_stop.set()
+
+# exports are written on the bot's host, they're far too big to upload
+EXPORT_DIR = os.getenv("EXPORT_DIR", "/data/exports")
+
+@bot.command(name="export")
+@commands.is_owner()
+async def export_command(ctx, layout: str = "rows"):
+    """Snapshot the whole game state to EXPORT_DIR while the bot keeps running."""
+    if layout not in EXPORT_LAYOUTS:
+        await ctx.send(f"❌ Layout must be one of: {', '.join(EXPORT_LAYOUTS)}")
+        return
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"export-{clock.now():%Y%m%d-%H%M%S}.jsonl.gz")
+
+    await ctx.send("⏳ Export started...")
+    counts = await export_state(storage, path, layout)
+
+    summary = "\n".join(f"{table}: {count}" for table, count in counts.items())
+    await ctx.send(f"✅ Exported to `{path}`\n{summary}")
+
+# ========================
+# ANALYTICS
+# ========================
+
+analytics_lock = asyncio.Lock()
+
+@bot.command(name="analytics")
+@commands.has_permissions(administrator=True)
+async def analytics_command(ctx):
+    """Post quest completion, retention, streak and rank progression stats."""
+    if not analytics_available():
+        await ctx.send("❌ Analytics needs NumPy (pip install numpy).")
+        return
+    if analytics_lock.locked():
+        await ctx.send("❌ A report is already being built.")
+        return
+
+    async with analytics_lock:
+        await ctx.send("⏳ Building the report...")
+        started = time.perf_counter()
+        # days are counted in the bot's timezone at today's UTC offset
+        utc_offset = int(clock.now().utcoffset().total_seconds())
+        report = await guild_report(storage, ctx.guild.id, RANKS, game.rank_floors, utc_offset)
+
+    elapsed = time.perf_counter() - started
+    filename = f"analytics-{clock.now():%Y%m%d-%H%M%S}.txt"
+    await ctx.send(
+        f"📈 Report built in {elapsed:.1f}s",
+        file=discord.File(BytesIO(report.encode()), filename=filename)
+    )
+
 # ========================
 # START BOT
 # ========================
 
-bot.run(os.getenv("DISCORD_TOKEN"))
+# importing main without running the bot is for tools like simulate.py
+if __name__ == "__main__":
+    bot.run(os.getenv("DISCORD_TOKEN"))
@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+
+# ========================
+# METRIC TYPES
+# ========================
+
+# seconds, covers a fast cache hit up to a stuck REST call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        REGISTRY.register(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        super().__init__(name, description, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, key)} {value}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+class HistogramSeries:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.bounds = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = HistogramSeries(len(self.bounds) + 1)
+        series.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        series.count += 1
+        series.sum += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, q, series):
+        """Estimate a quantile from the bucket counts (upper bound of its bucket)"""
+        target = q * series.count
+        seen = 0
+        for bound, count in zip(self.bounds, series.buckets):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds, series.buckets):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(self.labels, key, [('le', '+Inf')])} {series.count}"
+            yield f"{self.name}_sum{format_labels(self.labels, key)} {series.sum}"
+            yield f"{self.name}_count{format_labels(self.labels, key)} {series.count}"
+
+    def summary(self):
+        """Return [(labels, count, avg, p95)] for every series"""
+        return [
+            (key, series.count, series.sum / series.count, self.quantile(0.95, series))
+            for key, series in self.series.items() if series.count
+        ]
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ========================
+# BOT METRICS
+# ========================
+
+COMMAND_SECONDS = Histogram("bot_command_seconds", "Command latency from invoke to completion", ["command"])
+COMMAND_ERRORS = Counter("bot_command_errors_total", "Commands that raised", ["command"])
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "Storage call latency including queueing", ["statement"])
+DB_QUERY_ERRORS = Counter("bot_db_query_errors_total", "Storage calls that raised", ["statement"])
+REST_REQUESTS = Counter("bot_rest_requests_total", "Discord REST requests by route and outcome", ["route", "status"])
+REST_SECONDS = Histogram("bot_rest_request_seconds", "Discord REST latency including rate limit waits", ["route"])
+REST_RATE_LIMITS = Counter("bot_rest_rate_limits_total", "429 responses from Discord", ["route"])
+TASK_SECONDS = Histogram("bot_task_run_seconds", "Background task iteration duration", ["task"])
+LOOP_LAG_SECONDS = Histogram("bot_event_loop_lag_seconds", "Event loop scheduling delay")
+LOOP_LAG = Gauge("bot_event_loop_lag_current_seconds", "Most recent event loop scheduling delay")
+OUTBOUND_QUEUE_DEPTH = Gauge("bot_outbound_queue_depth", "Messages waiting in the outbound dispatcher")
+OUTBOUND_WAIT_SECONDS = Histogram("bot_outbound_wait_seconds", "Time a message waited in the dispatcher before sending")
+OUTBOUND_MESSAGES = Counter("bot_outbound_messages_total", "Messages sent or edited by the dispatcher", ["outcome"])
+OUTBOUND_COALESCED = Counter("bot_outbound_coalesced_total", "Messages merged into an earlier queued message")
+
+# ========================
+# INSTRUMENTATION
+# ========================
+
+def timed(histogram, **labels):
+    """Decorator timing every call of a coroutine function"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_storage(storage, interface):
+    """Time every coroutine method of `interface` on the `storage` instance"""
+    for name, member in inspect.getmembers(interface, inspect.iscoroutinefunction):
+        method = getattr(storage, name)
+
+        @functools.wraps(method)
+        async def wrapper(*args, _method=method, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await _method(*args, **kwargs)
+            except Exception:
+                DB_QUERY_ERRORS.inc(statement=_name)
+                raise
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, statement=_name)
+
+        setattr(storage, name, wrapper)
+
+# route template of the REST request running in the current task
+current_route = contextvars.ContextVar("current_route", default="unknown")
+
+class RateLimitLogHandler(logging.Handler):
+    """discord.py handles 429s internally and only logs them, count those logs"""
+
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith("We are being rate limited"):
+            REST_RATE_LIMITS.inc(route=current_route.get())
+
+def instrument_http(http):
+    """Count and time REST calls on a discord.py HTTPClient"""
+    request = http.request
+
+    @functools.wraps(request)
+    async def wrapper(route, **kwargs):
+        label = f"{route.method} {route.path}"
+        token = current_route.set(label)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await request(route, **kwargs)
+        except Exception as e:
+            status = str(getattr(e, "status", type(e).__name__))
+            raise
+        finally:
+            REST_SECONDS.observe(time.perf_counter() - start, route=label)
+            REST_REQUESTS.inc(route=label, status=status)
+            current_route.reset(token)
+
+    http.request = wrapper
+    logging.getLogger("discord.http").addHandler(RateLimitLogHandler())
+
+async def monitor_loop_lag(interval=0.5):
+    """Measure how late the loop wakes us up, i.e. how long callbacks block it"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG.set(lag)
+
+# ========================
+# HTTP ENDPOINT
+# ========================
+
+async def start_metrics_server(host, port):
+    """Serve REGISTRY in the Prometheus text format on http://host:port/metrics"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(
+            text=REGISTRY.expose(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
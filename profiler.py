@@ -0,0 +1,156 @@
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# ========================
+# SAMPLING PROFILER
+# ========================
+
+SAMPLE_INTERVAL = 0.005  # 200 Hz
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the event loop thread and of threads whose name
+    starts with one of `thread_prefixes` (the DB executor) from a background
+    thread. Nothing runs while it isn't started, so it costs nothing when off.
+    """
+
+    def __init__(self, loop_thread_id, thread_prefixes=(), interval=SAMPLE_INTERVAL, statement_histogram=None):
+        self.loop_thread_id = loop_thread_id
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.interval = interval
+        self.statement_histogram = statement_histogram
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration):
+        if self.running:
+            raise RuntimeError("profiler is already running")
+
+        self.stacks = Counter()
+        self.coroutines = Counter()
+        self.samples = 0
+        self.started_at = time.perf_counter()
+        self.deadline = self.started_at + duration
+        self.statements_before = self.statement_snapshot()
+        self.stop_event.clear()
+
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling and return a ProfileResult"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+        return ProfileResult(
+            duration=time.perf_counter() - self.started_at,
+            samples=self.samples,
+            stacks=self.stacks,
+            coroutines=self.coroutines,
+            statements=self.statement_delta()
+        )
+
+    def targets(self):
+        targets = {self.loop_thread_id: "event-loop"}
+        if self.thread_prefixes:
+            for thread in threading.enumerate():
+                if thread.name.startswith(self.thread_prefixes):
+                    targets[thread.ident] = thread.name
+        return targets
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if time.perf_counter() >= self.deadline:
+                break
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        self.samples += 1
+
+        for thread_id, label in self.targets().items():
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            running = set()
+            while frame is not None:
+                stack.append(frame_label(frame))
+                if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                    running.add(stack[-1])
+                frame = frame.f_back
+
+            stack.append(label)
+            self.stacks[";".join(reversed(stack))] += 1
+            self.coroutines.update(running)
+
+    def statement_snapshot(self):
+        if self.statement_histogram is None:
+            return {}
+        return {
+            key: (series.count, series.sum)
+            for key, series in list(self.statement_histogram.series.items())
+        }
+
+    def statement_delta(self):
+        before = self.statements_before
+        delta = {}
+        for key, (count, total) in self.statement_snapshot().items():
+            old_count, old_total = before.get(key, (0, 0.0))
+            if count > old_count:
+                delta[" ".join(key)] = (count - old_count, total - old_total)
+        return delta
+
+class ProfileResult:
+    def __init__(self, duration, samples, stacks, coroutines, statements):
+        self.duration = duration
+        self.samples = samples
+        self.stacks = stacks
+        self.coroutines = coroutines
+        self.statements = statements
+
+    def collapsed(self):
+        """Collapsed-stack lines, as read by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top=10):
+        seconds_per_sample = self.duration / self.samples if self.samples else 0
+        lines = [f"{self.samples} samples over {self.duration:.1f}s", "", "Slowest coroutines (time on the loop):"]
+
+        for name, count in self.coroutines.most_common(top):
+            lines.append(f"  {count * seconds_per_sample:8.3f}s  {name}")
+
+        lines += ["", "Storage calls (total time):"]
+        statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (count, total) in statements[:top]:
+            lines.append(f"  {total:8.3f}s  {count:6d}×  {name}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory, prefix):
+        """Write <prefix>.collapsed and <prefix>.txt into `directory`, returns both paths"""
+        os.makedirs(directory, exist_ok=True)
+        collapsed_path = os.path.join(directory, f"{prefix}.collapsed")
+        summary_path = os.path.join(directory, f"{prefix}.txt")
+
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(self.summary())
+
+        return collapsed_path, summary_path
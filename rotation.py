@@ -0,0 +1,78 @@
+import math
+import random
+
+# ========================
+# ROTATION POLICIES
+# ========================
+
+# How the midnight job picks each daily quest from its pool. A policy is
+# built once per rotation from storage.quest_stats() and then asked once per
+# quest key, so a rotation costs O(quest pool size) whatever the claim
+# history. New policies subclass UniformPolicy and go into POLICIES.
+PRIOR_OFFERS = 3  # a quest starts out as if offered this often at its rank's average rate
+BALANCE_SPREAD = 0.25  # a rank's last pick loses weight by e for every 25% of the average it's off target
+
+class UniformPolicy:
+    """Every candidate is equally likely"""
+
+    def __init__(self, stats, rng=random):
+        self.stats = stats  # {(quest_key, quest_name): (offered, completions)}
+        self.rng = rng
+
+    def choose(self, quest, candidates):
+        """Pick one of `candidates`, names from the pool of `quest`"""
+        return self.rng.choice(candidates)
+
+class BalancedPolicy(UniformPolicy):
+    """
+    Keeps each rank's daily quests near the rank's average completion rate
+    (claims per day offered): after a pick that gets claimed less than
+    average, the rank's next quest leans towards ones claimed more, and
+    the other way round. Early picks are held to the target more loosely
+    than the last, which has nothing left to make up for it. Rates are
+    smoothed towards the rank average, so quests with little history
+    still come up.
+    """
+
+    def __init__(self, stats, rng=random, prior=PRIOR_OFFERS, spread=BALANCE_SPREAD):
+        super().__init__(stats, rng)
+        self.prior = prior
+        self.spread = spread
+        self.picked = {}  # rank -> rates of the quests picked so far
+
+        totals, keys = {}, {}
+        for (quest_key, _), (offered, completions) in stats.items():
+            rank = quest_key.split("_")[0]
+            rank_offered, rank_completions = totals.get(rank, (0, 0))
+            totals[rank] = (rank_offered + offered, rank_completions + completions)
+            keys.setdefault(rank, set()).add(quest_key)
+        self.rank_rates = {
+            rank: completions / offered for rank, (offered, completions) in totals.items() if offered
+        }
+        self.rank_keys = {rank: len(quest_keys) for rank, quest_keys in keys.items()}
+
+    def rate(self, quest, name):
+        offered, completions = self.stats.get((quest.key, name), (0, 0))
+        average = self.rank_rates.get(quest.rank, 0.0)
+        return (completions + self.prior * average) / (offered + self.prior)
+
+    def choose(self, quest, candidates):
+        average = self.rank_rates.get(quest.rank)
+        if not average:
+            return super().choose(quest, candidates)
+
+        picked = self.picked.setdefault(quest.rank, [])
+        target = average * (len(picked) + 1) - sum(picked)
+        still_to_pick = max(0, self.rank_keys.get(quest.rank, 1) - len(picked) - 1)
+        tolerance = self.spread * average * (1 + still_to_pick)
+        rates = [self.rate(quest, name) for name in candidates]
+        weights = [math.exp(-abs(rate - target) / tolerance) for rate in rates]
+
+        i = self.rng.choices(range(len(candidates)), weights)[0]
+        picked.append(rates[i])
+        return candidates[i]
+
+POLICIES = {
+    "uniform": UniformPolicy,
+    "balanced": BalancedPolicy,
+}
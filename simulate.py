@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from clock import VirtualClock
+
+# ========================
+# ECONOMY SIMULATOR
+# ========================
+
+# Runs synthetic members through months of virtual days to see how XP
+# values, story XP and rank thresholds play out, without Discord:
+#
+#   python simulate.py --users 100000 --days 365 --config game.toml
+#
+# Every day's quests come from the bot's own rotation code (including the
+# ROTATION_POLICY) on an in-memory database, with main.clock swapped for a
+# VirtualClock. The population itself is simulated with NumPy
+# arrays. The first --trace members also go through the bot's real claim,
+# streak, story and rank code, and the run checks that they end up exactly
+# where the arrays say. Needs NumPy (`pip install numpy`).
+SIM_GUILD = 1
+REACTOR_IDS = 10 ** 15  # synthetic reactors, far from member ids
+
+class Population:
+    """Per-member state as arrays, member i has user id i + 1"""
+
+    def __init__(self, rng, args, bot):
+        import numpy as np
+
+        n = args.users
+        self.bot = bot
+        self.ids = np.arange(1, n + 1, dtype=np.int64)
+        self.join_day = rng.integers(0, max(1, args.join_days), n)
+        self.engagement = rng.beta(args.engagement_a, args.engagement_b, n)
+        self.explorer = rng.random(n) < args.explorer_share
+        self.joined = np.zeros(n, dtype=bool)
+        self.churned = np.zeros(n, dtype=bool)
+        self.xp = np.zeros(n, dtype=np.int64)
+        self.rank = np.ones(n, dtype=np.int64)
+        self.streak = np.zeros(n, dtype=np.int64)
+        self.last_quest_day = np.full(n, -1, dtype=np.int64)  # -1: never
+        self.weekly_done = np.zeros(n, dtype=bool)
+        self.last_active_day = np.full(n, -1, dtype=np.int64)
+        # first day at each rank, -1 if not reached
+        self.reached = np.full((n, len(bot.RANKS) + 1), -1, dtype=np.int64)
+        self.xp_by_source = {}
+
+    def credit(self, source, mask, amount):
+        """Give the members in `mask` `amount` XP (a number, or an array of per-member XP)"""
+        import numpy as np
+
+        gained = np.where(mask, amount, 0)
+        self.xp += gained
+        self.xp_by_source[source] = self.xp_by_source.get(source, 0) + int(gained.sum())
+
+    def rank_for_xp(self, xp):
+        import numpy as np
+        # game.rank_for_xp over an array
+        return np.maximum(1, np.searchsorted(self.bot.game.rank_floors, xp, side="right"))
+
+def quest_appeal(rng, game, args):
+    """How likely each pool quest is to be done, relative to a member's engagement"""
+    daily = {
+        (quest.key, name): rng.beta(args.appeal_a, args.appeal_b)
+        for quest in game.quests.values() for name in quest.pool
+    }
+    weekly = {
+        (rank, name): rng.beta(args.appeal_a, args.appeal_b)
+        for rank, (_, pool) in game.weekly.items() for name in pool
+    }
+    return daily, weekly
+
+class Tracer:
+    """Replays the traced members' days through the bot's own code paths"""
+
+    def __init__(self, bot, count):
+        self.bot = bot
+        self.count = count
+        self.next_story = 1
+        self.next_reactor = REACTOR_IDS
+
+    async def join(self, user_ids, explorer):
+        bot = self.bot
+        await bot.storage.ensure_users(SIM_GUILD, user_ids)
+        for user_id, is_explorer in zip(user_ids, explorer):
+            if is_explorer:
+                # what assign_starting_rank does for the Explorer button
+                rank_number, bonus_xp, _, _ = bot.STARTING_RANKS["explorer"]
+                await bot.storage.set_rank(SIM_GUILD, user_id, rank_number)
+                await bot.storage.add_xp(SIM_GUILD, user_id, bonus_xp, "start_bonus")
+
+    async def story(self, user_id, reactions):
+        bot = self.bot
+        message_id, self.next_story = self.next_story, self.next_story + 1
+        await bot.storage.add_story(message_id, SIM_GUILD, user_id, bot.clock.today())
+        # the first reactions past the cap are tried too, they must earn nothing
+        for _ in range(min(reactions, bot.STORY_REACTION_CAP + 1)):
+            self.next_reactor += 1
+            await bot.storage.award_story_reaction(
+                SIM_GUILD, message_id, self.next_reactor, bot.clock.today(),
+                bot.STORY_XP_PER_REACTION, bot.STORY_XP_MAX, bot.STORY_REACTION_CAP
+            )
+
+    async def claim(self, user_id, quest_key, xp, date, source):
+        # the storage and progression steps of quest_command / weekly_quest_command
+        bot = self.bot
+        user = await bot.storage.get_user(SIM_GUILD, user_id)
+        new_xp = await bot.storage.record_claim(SIM_GUILD, user_id, quest_key, xp, date, source)
+        if new_xp is None:
+            return
+        if source == "quest":
+            await bot.update_streak(SIM_GUILD, user_id, date)
+        new_rank = bot.get_rank_from_xp(new_xp)
+        if new_rank > user[2]:
+            await bot.storage.set_rank(SIM_GUILD, user_id, new_rank)
+
+    async def check(self, population):
+        """Return the traced members whose stored state differs from the arrays"""
+        mismatched = []
+        for i in range(min(self.count, len(population.ids))):
+            user = await self.bot.storage.get_user(SIM_GUILD, int(population.ids[i]))
+            expected = (int(population.xp[i]), int(population.rank[i]), int(population.streak[i]))
+            if tuple(user[1:4]) != expected:
+                mismatched.append((int(population.ids[i]), tuple(user[1:4]), expected))
+        return mismatched
+
+async def simulate_day(bot, day, clock, population, rng, appeal, tracer, args):
+    import numpy as np
+
+    pop = population
+    traced = tracer.count
+    storage = bot.storage
+
+    # midnight: the rotation job and the missed-streak reset
+    await bot.generate_daily_quests()
+    await bot.generate_weekly_quests()
+    daily_rotation = await storage.get_daily_rotation(clock.today())
+    weekly_rotation = await storage.get_weekly_rotation(clock.week_start())
+    if clock.date().weekday() == 0:
+        pop.weekly_done[:] = False
+
+    await bot.reset_missed_streaks()
+    pop.streak[pop.last_quest_day < day - 1] = 0
+
+    # new members pick a starting rank
+    joining = np.flatnonzero((pop.join_day == day) & ~pop.joined)
+    pop.joined[joining] = True
+    rank_number, bonus_xp, _, _ = bot.STARTING_RANKS["explorer"]
+    explorers = joining[pop.explorer[joining]]
+    pop.rank[explorers] = rank_number
+    explorer_mask = np.zeros(len(pop.ids), dtype=bool)
+    explorer_mask[explorers] = True
+    pop.credit("start_bonus", explorer_mask, bonus_xp)
+    traced_joins = joining[joining < traced]
+    if len(traced_joins):
+        await tracer.join([int(pop.ids[i]) for i in traced_joins], pop.explorer[traced_joins])
+
+    alive = pop.joined & ~pop.churned
+    n = len(pop.ids)
+
+    # stories, XP as award_story_reaction hands it out
+    posts = alive & (rng.random(n) < args.story_rate * pop.engagement)
+    reactions = rng.poisson(args.story_reactions, n)
+    story_xp = np.minimum(np.minimum(reactions, bot.STORY_REACTION_CAP) * bot.STORY_XP_PER_REACTION, bot.STORY_XP_MAX)
+    pop.credit("story", posts, story_xp)
+    for i in np.flatnonzero(posts[:traced]):
+        await tracer.story(int(pop.ids[i]), int(reactions[i]))
+
+    # daily quests, with the access each member had at the start of the day
+    start_rank = pop.rank.copy()
+    claimed_daily = np.zeros(n, dtype=bool)
+    for quest_key, (quest_name, xp) in daily_rotation.items():
+        access = np.array([bot.game.can_access(r, quest_key) for r in range(len(bot.RANKS) + 1)])
+        chance = pop.engagement * appeal[0].get((quest_key, quest_name), 0.0)
+        claims = alive & access[start_rank] & (rng.random(n) < chance)
+        pop.credit("quest", claims, xp)
+        claimed_daily |= claims
+        for i in np.flatnonzero(claims[:traced]):
+            await tracer.claim(int(pop.ids[i]), quest_key, xp, clock.today(), "quest")
+        # streaks follow every claim, like update_streak after each command
+        pop.streak[claims & (pop.last_quest_day == day - 1)] += 1
+        pop.streak[claims & (pop.last_quest_day < day - 1)] = 1
+        pop.last_quest_day[claims] = day
+        pop.rank[claims] = np.maximum(pop.rank[claims], pop.rank_for_xp(pop.xp[claims]))
+
+    # the weekly quest of the member's rank, at most once a week
+    weekly_claims = np.zeros(n, dtype=bool)
+    for rank_number, rank_name in bot.RANKS.items():
+        entry = weekly_rotation.get(rank_name.lower())
+        if entry is None:
+            continue
+        quest_name, xp = entry
+        weekly_chance = pop.engagement * appeal[1].get((rank_name.lower(), quest_name), 0.0)
+        daily_chance = 1 - (1 - weekly_chance) ** (1 / 7)
+        claims = alive & ~pop.weekly_done & (start_rank == rank_number) & (rng.random(n) < daily_chance)
+        pop.credit("weekly", claims, xp)
+        pop.weekly_done |= claims
+        weekly_claims |= claims
+        quest_key = f"{bot.WEEKLY_KEY_PREFIX}{rank_name.lower()}_{clock.week_start()}"
+        for i in np.flatnonzero(claims[:traced]):
+            await tracer.claim(int(pop.ids[i]), quest_key, xp, clock.week_start(), "weekly")
+        pop.rank[claims] = np.maximum(pop.rank[claims], pop.rank_for_xp(pop.xp[claims]))
+
+    active = claimed_daily | weekly_claims | posts
+    pop.last_active_day[active] = day
+    for rank_number in range(2, len(bot.RANKS) + 1):
+        newly = (pop.rank >= rank_number) & (pop.reached[:, rank_number] < 0)
+        pop.reached[newly, rank_number] = day
+
+    pop.churned |= alive & (rng.random(n) < args.churn)
+
+def period_line(bot, day, clock, population):
+    import numpy as np
+
+    pop = population
+    joined = pop.joined
+    active = joined & (pop.last_active_day > day - 7)
+    ranks = np.bincount(pop.rank[joined], minlength=len(bot.RANKS) + 1)[1:]
+    shares = " ".join(
+        f"{name[:4]} {count / max(1, joined.sum()):4.0%}" for name, count in zip(bot.RANKS.values(), ranks)
+    )
+    median_xp = int(np.median(pop.xp[joined])) if joined.any() else 0
+    return (
+        f"{clock.today()}  day {day + 1:4d}  members {int(joined.sum()):7d}  active 7d {int(active.sum()):7d}  "
+        f"median XP {median_xp:6d}  {shares}"
+    )
+
+def summary(bot, population, quest_stats, mismatched, elapsed, args):
+    import numpy as np
+
+    pop = population
+    lines = ["", "XP by source:"]
+    total = sum(pop.xp_by_source.values()) or 1
+    for source, xp in sorted(pop.xp_by_source.items(), key=lambda item: -item[1]):
+        lines.append(f"  {source:<12} {xp:14d}  {xp / total:5.1%}")
+
+    lines += ["", "Days from joining to rank (members, median, p75):"]
+    for rank_number, rank_name in list(bot.RANKS.items())[1:]:
+        reached = pop.reached[:, rank_number] >= 0
+        taken = pop.reached[reached, rank_number] - pop.join_day[reached]
+        if reached.any():
+            lines.append(
+                f"  {rank_name:<10} {int(reached.sum()):8d}  {np.median(taken):6.1f} {np.percentile(taken, 75):6.1f}"
+            )
+        else:
+            lines.append(f"  {rank_name:<10} {0:8d}       -      -")
+
+    joined = pop.joined
+    streaks = pop.streak[joined]
+    lines += [
+        "",
+        f"Streaks at the end: mean {streaks.mean() if len(streaks) else 0:.2f}, "
+        f"longest {int(streaks.max()) if len(streaks) else 0}, "
+        f"7+ days {int((streaks >= 7).sum())} members",
+    ]
+
+    rates = sorted(
+        ((completions / offered, key, name) for (key, name), (offered, completions) in quest_stats.items() if offered),
+        reverse=True
+    )
+    if rates:
+        lines += ["", f"Claims per day offered, traced members (best and worst of {len(rates)}):"]
+        for rate, key, name in rates[:3] + rates[-3:]:
+            lines.append(f"  {rate:6.2f}  {key:<12} {name[:60]}")
+
+    lines.append("")
+    if mismatched:
+        lines.append(f"⚠️ {len(mismatched)} traced members differ from the model, e.g. (id, stored, model):")
+        lines += [f"  {row}" for row in mismatched[:5]]
+    else:
+        lines.append(f"Traced members match the model: {min(args.trace, args.users)} of {args.users}")
+    lines.append(f"Simulated {args.users} members over {args.days} days in {elapsed:.1f}s")
+    return "\n".join(lines)
+
+async def run(args):
+    import numpy as np
+
+    # main reads these at import, the bot itself never starts
+    os.environ["DATABASE_URL"] = ":memory:"
+    if args.config:
+        os.environ["GAME_CONFIG"] = args.config
+    if args.policy:
+        os.environ["ROTATION_POLICY"] = args.policy
+    import main as bot
+
+    clock = bot.clock = VirtualClock(bot.TZ, bot.clock.local(args.start))
+
+    random.seed(args.seed)  # the rotation code draws from the random module
+    rng = np.random.default_rng(args.seed)
+    appeal = quest_appeal(rng, bot.game, args)
+    population = Population(rng, args, bot)
+    tracer = Tracer(bot, min(args.trace, args.users))
+
+    started = time.perf_counter()
+    await bot.storage.connect()
+    try:
+        for day in range(args.days):
+            await clock.advance_to(clock.local(args.start + timedelta(days=day)))
+            await simulate_day(bot, day, clock, population, rng, appeal, tracer, args)
+            if (day + 1) % args.report_every == 0 or day == args.days - 1:
+                print(period_line(bot, day, clock, population))
+
+        quest_stats = await bot.storage.quest_stats()
+        mismatched = await tracer.check(population)
+    finally:
+        await bot.storage.close()
+
+    print(summary(bot, population, quest_stats, mismatched, time.perf_counter() - started, args))
+    return not mismatched
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the quest economy over virtual days.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2030, 1, 7), help="first virtual day")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--config", help="game config to simulate, defaults to GAME_CONFIG / game.toml")
+    parser.add_argument("--policy", help="rotation policy, defaults to ROTATION_POLICY")
+    parser.add_argument("--trace", type=int, default=100, help="members replayed through the bot's code")
+    parser.add_argument("--join-days", type=int, default=90, help="members join evenly over this many days")
+    parser.add_argument("--explorer-share", type=float, default=0.3, help="share starting as Explorer")
+    parser.add_argument("--engagement-a", type=float, default=2.0, help="engagement ~ Beta(a, b)")
+    parser.add_argument("--engagement-b", type=float, default=5.0)
+    parser.add_argument("--appeal-a", type=float, default=6.0, help="quest appeal ~ Beta(a, b)")
+    parser.add_argument("--appeal-b", type=float, default=4.0)
+    parser.add_argument("--story-rate", type=float, default=0.1, help="daily story chance at full engagement")
+    parser.add_argument("--story-reactions", type=float, default=2.5, help="mean reactions per story")
+    parser.add_argument("--churn", type=float, default=0.01, help="daily chance an active member leaves")
+    parser.add_argument("--report-every", type=int, default=30, help="days between progress lines")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec("numpy") is None:
+        sys.exit("simulate.py needs NumPy (pip install numpy)")
+
+    sys.exit(0 if asyncio.run(run(args)) else 1)
@@ -0,0 +1,2415 @@
+import asyncio
+import functools
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+
+# ========================
+# STORAGE INTERFACE
+# ========================
+
+# Rows written before multi-guild support belong to this placeholder guild
+# until they are adopted by a real guild (see adopt_legacy_rows).
+UNASSIGNED_GUILD_ID = 0
+
+# tables whose rows are partitioned by guild_id
+GUILD_TABLES = [
+    "users", "xp_log", "quest_claims", "story_posts", "story_reactions", "xp_snapshot", "quest_completions"
+]
+
+# weekly claims use "weekly_<rank>_<week start>" keys, dated by the week start
+WEEKLY_KEY_PREFIX = "weekly_"
+
+# xp_log is the ledger every XP change is appended to, tagged with its
+# source. users.xp is a projection of it: the balance at the last ledger
+# snapshot plus the events logged since. "opening" rows are written once
+# when the ledger is introduced, for XP that was never logged before.
+XP_SOURCES = ("quest", "weekly", "story", "admin", "reset", "start_bonus", "opening")
+
+# table -> columns, in the order rows are exported and imported
+EXPORT_TABLES = {
+    "users": ["guild_id", "user_id", "xp", "rank", "streak", "last_quest_date"],
+    "quest_claims": ["guild_id", "user_id", "quest_key", "date"],
+    "quest_completions": ["guild_id", "user_id", "quest_key", "week_start", "completions"],
+    "daily_quest_rotation": ["rank", "quest_key", "quest_name", "xp", "date"],
+    "weekly_quest_rotation": ["rank", "quest_name", "xp", "week_start"],
+    "quest_seven_day_pool": ["quest_key", "used_quests", "cycle_start"],
+    "quest_stats": ["quest_key", "quest_name", "offered", "completions"],
+    "story_posts": ["message_id", "guild_id", "author_id", "xp_awarded", "date_posted", "notice_id"],
+    "story_reactions": ["message_id", "guild_id", "reactor_id", "date"],
+    "story_archive": ["message_id", "guild_id", "author_id", "xp_awarded", "reactions", "date_posted"],
+    "xp_log": ["id", "guild_id", "user_id", "xp", "timestamp", "source"],
+    "rank_selections": ["guild_id", "user_id", "message_id"],
+    "seasons": ["guild_id", "season", "ended_at", "members"],
+    "season_standings": ["guild_id", "season", "user_id", "xp", "rank", "streak", "place"],
+    "season_xp": ["guild_id", "season", "source", "xp", "events"],
+    "role_resets": ["guild_id", "user_id", "old_rank"],
+}
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+class Storage:
+    """
+    Everything the bot persists. Dates are ISO strings computed by the
+    caller (EST day / week start), so backends never read the clock for
+    game logic. User rows are (user_id, xp, rank, streak, last_quest_date).
+    """
+
+    async def connect(self):
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    # ----- users -----
+
+    async def get_user(self, guild_id, user_id):
+        """Return the user row, creating it if missing"""
+        raise NotImplementedError
+
+    async def ensure_users(self, guild_id, user_ids):
+        """Create missing user rows for a batch of members"""
+        raise NotImplementedError
+
+    async def add_xp(self, guild_id, user_id, amount, source):
+        """Add XP and log it under `source`. Returns the new XP total"""
+        raise NotImplementedError
+
+    async def set_rank(self, guild_id, user_id, rank):
+        raise NotImplementedError
+
+    async def grant_xp(self, guild_id, grants, source):
+        """
+        Add XP to many members in one transaction, creating missing users.
+        `grants` is [(user_id, amount)] with unique user ids. Returns
+        [(user_id, new_xp, rank)]
+        """
+        raise NotImplementedError
+
+    async def set_ranks(self, guild_id, ranks):
+        """Apply [(user_id, rank)] in one batch"""
+        raise NotImplementedError
+
+    async def reset_user(self, guild_id, user_id):
+        """Set XP to 0 and rank to Initiate, logging the XP taken away"""
+        raise NotImplementedError
+
+    async def get_streak(self, guild_id, user_id):
+        """Return (last_quest_date, streak) or None"""
+        raise NotImplementedError
+
+    async def set_streak(self, guild_id, user_id, streak, last_quest_date):
+        raise NotImplementedError
+
+    async def reset_missed_streaks(self, before):
+        """Zero the streaks of users whose last quest was before `before`"""
+        raise NotImplementedError
+
+    async def top_users(self, guild_id, limit):
+        """Return [(user_id, xp)] ordered by XP, highest first"""
+        raise NotImplementedError
+
+    async def adopt_legacy_rows(self, guild_id):
+        """Move unassigned rows into `guild_id`. Returns user rows left behind"""
+        raise NotImplementedError
+
+    # ----- claims -----
+
+    async def has_claimed(self, guild_id, user_id, quest_key, date):
+        raise NotImplementedError
+
+    async def record_claim(self, guild_id, user_id, quest_key, xp, date, source):
+        """
+        Claim a quest and award its XP atomically, counting a daily ("quest")
+        claim towards the quest_stats of `date`'s rotation. Creates the user
+        row if needed. Returns the new XP total, or None if the quest was
+        already claimed on `date`.
+        """
+        raise NotImplementedError
+
+    async def compact_claims(self, today, week_start):
+        """
+        Fold claims that can no longer be repeated (daily claims before
+        `today`, weekly ones before `week_start`) into per-week
+        quest_completions counters and delete them. Returns rows compacted.
+        """
+        raise NotImplementedError
+
+    async def quest_completions(self, guild_id, user_id):
+        """Return {quest_key: all-time completions}, weekly keys without their week"""
+        raise NotImplementedError
+
+    async def current_claims(self, today, week_start):
+        """Return [(guild_id, user_id, quest_key)] claimed today or this week, weekly keys without their week"""
+        raise NotImplementedError
+
+    # ----- xp ledger -----
+
+    async def snapshot_ledger(self):
+        """
+        Fold the ledger events logged since the last snapshot into
+        xp_snapshot. Returns the id of the last event folded in.
+        """
+        raise NotImplementedError
+
+    async def ledger_drift(self):
+        """Return [(guild_id, user_id, stored_xp, ledger_xp)] for users whose XP disagrees with the ledger"""
+        raise NotImplementedError
+
+    async def rebuild_balances(self):
+        """Replay snapshot + ledger tail into users.xp. Returns the number of users corrected"""
+        raise NotImplementedError
+
+    # ----- rotations -----
+
+    async def get_seven_day_pool(self, quest_key):
+        """Return (used_quests, cycle_start) or None"""
+        raise NotImplementedError
+
+    async def save_seven_day_pool(self, quest_key, used_quests, cycle_start):
+        raise NotImplementedError
+
+    async def daily_rotation_exists(self, date):
+        raise NotImplementedError
+
+    async def save_daily_rotation(self, date, rows, pools=()):
+        """
+        Replace the daily rotation with [(rank, quest_key, quest_name, xp)],
+        and the seven day pools with [(quest_key, used_quests, cycle_start)]
+        in the same transaction. Quests new to `date`'s rotation count as
+        offered once more in quest_stats.
+        """
+        raise NotImplementedError
+
+    async def get_daily_rotation(self, date):
+        """Return {quest_key: (quest_name, xp)}"""
+        raise NotImplementedError
+
+    async def quest_stats(self):
+        """
+        Return {(quest_key, quest_name): (offered, completions)}: the days each
+        pool quest was in the daily rotation and the claims it got on them.
+        """
+        raise NotImplementedError
+
+    async def weekly_rotation_exists(self, week_start):
+        raise NotImplementedError
+
+    async def save_weekly_rotation(self, week_start, rows):
+        """Replace the weekly rotation with [(rank, quest_name, xp)]"""
+        raise NotImplementedError
+
+    async def get_weekly_rotation(self, week_start):
+        """Return {rank: (quest_name, xp)}"""
+        raise NotImplementedError
+
+    # ----- posting, notifications, leases -----
+
+    async def legacy_post_logged(self, date):
+        """True if a version without per-guild markers posted on `date`"""
+        raise NotImplementedError
+
+    async def posted_guilds(self, date):
+        """Guild ids posted to on `date` by a version without the rollover journal"""
+        raise NotImplementedError
+
+    async def rollover_journal(self, date):
+        """Return {step: message_id or None} for the finished steps of `date`'s rollover, pruning older days"""
+        raise NotImplementedError
+
+    async def begin_rollover_step(self, date, step, holder, ttl):
+        """
+        Claim an unfinished rollover step for `holder` until `ttl` seconds from
+        now, like a lease. Returns None if it is finished or held by someone
+        else, otherwise how many times it was begun before.
+        """
+        raise NotImplementedError
+
+    async def finish_rollover_step(self, date, step, message_id=None):
+        raise NotImplementedError
+
+    async def notified_guilds(self, date, slot):
+        """Guild ids already pinged for `slot`, pruning older days"""
+        raise NotImplementedError
+
+    async def mark_notified(self, guild_id, date, slot):
+        raise NotImplementedError
+
+    async def acquire_lease(self, name, holder, ttl):
+        """Take or renew a lease. Returns True if `holder` holds it"""
+        raise NotImplementedError
+
+    async def release_lease(self, name, holder):
+        raise NotImplementedError
+
+    # ----- rank selection -----
+
+    async def add_rank_selections(self, guild_id, message_id, user_ids):
+        """
+        Let `user_ids` pick their starting rank on the welcome whose buttons
+        carry selection id `message_id` (its message id for older welcomes)
+        """
+        raise NotImplementedError
+
+    async def take_rank_selection(self, guild_id, user_id, message_id):
+        """
+        Use up a member's pending pick on `message_id`. Returns how many
+        picks are still pending on that message, or None if the member
+        had none there.
+        """
+        raise NotImplementedError
+
+    async def drop_rank_selections(self, guild_id, user_ids):
+        """Forget the members' pending picks (welcome never sent, member left)"""
+        raise NotImplementedError
+
+    # ----- stories -----
+
+    async def add_story(self, message_id, guild_id, author_id, date):
+        raise NotImplementedError
+
+    async def active_stories(self, since):
+        """Return [(message_id, guild_id, author_id, date_posted, xp_awarded, reactions, notice_id)] posted on or after `since`"""
+        raise NotImplementedError
+
+    async def set_story_notice(self, message_id, notice_id):
+        """Remember the message announcing a story's XP"""
+        raise NotImplementedError
+
+    async def archive_stories(self, before):
+        """
+        Move stories posted before `before` into story_archive, keeping
+        only their reaction count. Returns the number archived.
+        """
+        raise NotImplementedError
+
+    async def award_story_reaction(self, guild_id, message_id, reactor_id, date,
+                                   xp_per_reaction, xp_max, reaction_cap):
+        """
+        Record a reaction on a story and award the author XP, creating their
+        user row if needed. Returns (author_id, xp_awarded) or None if the
+        reaction earns nothing.
+        """
+        raise NotImplementedError
+
+    # ----- seasons -----
+
+    async def end_season(self, guild_id, ended_at, today, week_start):
+        """
+        Close the guild's season in one transaction: archive its standings
+        and XP by source, reset every member's XP, rank and streak, clear
+        its ledger, stories and claims (compacted first; today's and this
+        week's are kept so they can't be claimed twice) and queue role
+        resets for members above Initiate. Returns (season, members archived).
+        """
+        raise NotImplementedError
+
+    async def season_standings(self, guild_id, season, limit):
+        """Return [(user_id, xp, rank)] of an archived season, highest first"""
+        raise NotImplementedError
+
+    async def role_reset_guilds(self):
+        """Guild ids with queued role resets"""
+        raise NotImplementedError
+
+    async def pending_role_resets(self, guild_id, limit):
+        """Return [(user_id, old_rank)] queued for `guild_id`"""
+        raise NotImplementedError
+
+    async def finish_role_resets(self, guild_id, user_ids):
+        raise NotImplementedError
+
+    # ----- bulk transfer -----
+
+    def snapshot(self, guild_id=None):
+        """
+        Async context manager yielding a consistent read-only view of the
+        EXPORT_TABLES. Its `chunks(table, size)` async-iterates row lists.
+        With `guild_id`, chunks only hold that guild's rows (tables with a
+        guild_id column only).
+        """
+        raise NotImplementedError
+
+    async def populated_tables(self):
+        """The EXPORT_TABLES that hold any rows"""
+        raise NotImplementedError
+
+    async def import_rows(self, table, rows):
+        """
+        Insert rows in EXPORT_TABLES column order, skipping existing keys.
+        Returns the number of rows inserted.
+        """
+        raise NotImplementedError
+
+    async def finish_import(self):
+        """Fix up backend state (e.g. sequences) after an import"""
+        raise NotImplementedError
+
+# ========================
+# SQLITE BACKEND
+# ========================
+
+def threaded(fn):
+    """Run a blocking SQLiteStorage method on the storage's DB thread"""
+    @functools.wraps(fn)
+    async def wrapper(self, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, self, *args))
+    return wrapper
+
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    guild_id INTEGER NOT NULL DEFAULT 0,
+    user_id INTEGER NOT NULL,
+    xp INTEGER DEFAULT 0,
+    rank INTEGER DEFAULT 1,
+    streak INTEGER DEFAULT 0,
+    last_quest_date TEXT,
+    PRIMARY KEY (guild_id, user_id)
+)
+"""
+
+SQLITE_SCHEMA = [
+    USERS_SCHEMA,
+    """
+    CREATE TABLE IF NOT EXISTS xp_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        user_id INTEGER,
+        xp INTEGER,
+        timestamp TEXT,
+        source TEXT
+    )
+    """,
+    # XP balances as of ledger_snapshots' latest last_log_id
+    """
+    CREATE TABLE IF NOT EXISTS xp_snapshot (
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        user_id INTEGER,
+        xp INTEGER,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ledger_snapshots (
+        last_log_id INTEGER PRIMARY KEY,
+        taken_at TEXT
+    )
+    """,
+    # daily quest rotation (stores today's chosen quests)
+    """
+    CREATE TABLE IF NOT EXISTS daily_quest_rotation (
+        rank TEXT,
+        quest_key TEXT,
+        quest_name TEXT,
+        xp INTEGER,
+        date TEXT
+    )
+    """,
+    # Track used quests for 7-day rotation (for _2 type quests)
+    """
+    CREATE TABLE IF NOT EXISTS quest_seven_day_pool (
+        quest_key TEXT,
+        used_quests TEXT,
+        cycle_start TEXT
+    )
+    """,
+    # per pool quest: days it was in the daily rotation and claims it got
+    # then, kept up to date as rotations are saved and claims come in
+    """
+    CREATE TABLE IF NOT EXISTS quest_stats (
+        quest_key TEXT,
+        quest_name TEXT,
+        offered INTEGER DEFAULT 0,
+        completions INTEGER DEFAULT 0,
+        PRIMARY KEY (quest_key, quest_name)
+    )
+    """,
+    # weekly quest rotation
+    """
+    CREATE TABLE IF NOT EXISTS weekly_quest_rotation (
+        rank TEXT,
+        quest_name TEXT,
+        xp INTEGER,
+        week_start TEXT
+    )
+    """,
+    # quest claim tracking
+    """
+    CREATE TABLE IF NOT EXISTS quest_claims (
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        user_id INTEGER,
+        quest_key TEXT,
+        date TEXT
+    )
+    """,
+    # completions per user, quest and week for claims compacted out of quest_claims
+    """
+    CREATE TABLE IF NOT EXISTS quest_completions (
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        user_id INTEGER,
+        quest_key TEXT,
+        week_start TEXT,
+        completions INTEGER,
+        PRIMARY KEY (guild_id, user_id, quest_key, week_start)
+    )
+    """,
+    # story tracking
+    """
+    CREATE TABLE IF NOT EXISTS story_posts (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        author_id INTEGER,
+        xp_awarded INTEGER DEFAULT 0,
+        date_posted TEXT,
+        notice_id INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS story_reactions (
+        message_id INTEGER,
+        guild_id INTEGER NOT NULL DEFAULT 0,
+        reactor_id INTEGER,
+        date TEXT,
+        PRIMARY KEY(message_id, reactor_id)
+    )
+    """,
+    # stories past the active window, with their reactions counted
+    """
+    CREATE TABLE IF NOT EXISTS story_archive (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER,
+        author_id INTEGER,
+        xp_awarded INTEGER,
+        reactions INTEGER,
+        date_posted TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_quest_post_log (
+        date TEXT PRIMARY KEY
+    )
+    """,
+    # per-guild daily post markers of versions before rollover_journal
+    """
+    CREATE TABLE IF NOT EXISTS guild_quest_post_log (
+        guild_id INTEGER,
+        date TEXT,
+        PRIMARY KEY (guild_id, date)
+    )
+    """,
+    # steps of each day's midnight rollover: "daily", "weekly" and one
+    # "post:<guild>:<channel>" per quest post. holder/expires_at lease an
+    # unfinished step to one process, attempts tells a retry it may have
+    # been sent already
+    """
+    CREATE TABLE IF NOT EXISTS rollover_journal (
+        date TEXT,
+        step TEXT,
+        holder TEXT,
+        expires_at REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0,
+        message_id INTEGER,
+        PRIMARY KEY (date, step)
+    )
+    """,
+    # per-guild "sent" markers for each notification slot
+    """
+    CREATE TABLE IF NOT EXISTS notification_log (
+        guild_id INTEGER,
+        date TEXT,
+        slot INTEGER,
+        PRIMARY KEY (guild_id, date, slot)
+    )
+    """,
+    # leases for jobs that must run on exactly one shard process
+    """
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT,
+        expires_at REAL
+    )
+    """,
+    # new members who haven't picked a starting rank on their welcome message yet
+    """
+    CREATE TABLE IF NOT EXISTS rank_selections (
+        guild_id INTEGER,
+        user_id INTEGER,
+        message_id INTEGER,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+    # final standings and XP by source of every ended season
+    """
+    CREATE TABLE IF NOT EXISTS seasons (
+        guild_id INTEGER,
+        season INTEGER,
+        ended_at TEXT,
+        members INTEGER,
+        PRIMARY KEY (guild_id, season)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS season_standings (
+        guild_id INTEGER,
+        season INTEGER,
+        user_id INTEGER,
+        xp INTEGER,
+        rank INTEGER,
+        streak INTEGER,
+        place INTEGER,
+        PRIMARY KEY (guild_id, season, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS season_xp (
+        guild_id INTEGER,
+        season INTEGER,
+        source TEXT,
+        xp INTEGER,
+        events INTEGER,
+        PRIMARY KEY (guild_id, season, source)
+    )
+    """,
+    # rank roles still to be taken back after a season ended
+    """
+    CREATE TABLE IF NOT EXISTS role_resets (
+        guild_id INTEGER,
+        user_id INTEGER,
+        old_rank INTEGER,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+]
+
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_users_guild_xp ON users (guild_id, xp DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_xp_log_guild_user ON xp_log (guild_id, user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_story_posts_guild_date ON story_posts (guild_id, date_posted)",
+    "CREATE INDEX IF NOT EXISTS idx_story_posts_date ON story_posts (date_posted)",
+    "CREATE INDEX IF NOT EXISTS idx_story_reactions_guild_reactor ON story_reactions (guild_id, reactor_id)",
+    "CREATE INDEX IF NOT EXISTS idx_story_archive_guild_author ON story_archive (guild_id, author_id)",
+    "CREATE INDEX IF NOT EXISTS idx_rank_selections_message ON rank_selections (message_id)",
+    "CREATE INDEX IF NOT EXISTS idx_season_standings_place ON season_standings (guild_id, season, place)",
+]
+
+# bound parameters per IN (...) list, well under SQLite's limit
+SQLITE_MAX_PARAMS = 500
+
+# claims that can no longer be repeated, and how they are counted
+SQLITE_COMPACTABLE_CLAIM = f"""
+    (date < ? OR (date < ? AND quest_key NOT LIKE '{WEEKLY_KEY_PREFIX}%'))
+"""
+SQLITE_COMPLETION_KEY = f"""
+    CASE WHEN quest_key LIKE '{WEEKLY_KEY_PREFIX}%'
+    THEN substr(quest_key, 1, length(quest_key) - 11) ELSE quest_key END
+"""
+
+class SQLiteStorage(Storage):
+    """
+    The single-file backend. All queries run on one dedicated thread, so the
+    event loop never blocks on SQLite and the connection is never shared
+    between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    @threaded
+    def connect(self):
+        # autocommit mode, transactions are opened explicitly
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+
+        # WAL lets shard processes sharing the file read while another one writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+
+        with self.transaction() as cursor:
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            self.migrate_guild_partitioning(cursor)
+            self.migrate_xp_ledger(cursor)
+            if "notice_id" not in self.table_columns(cursor, "story_posts"):
+                cursor.execute("ALTER TABLE story_posts ADD COLUMN notice_id INTEGER")
+            for statement in SQLITE_INDEXES:
+                cursor.execute(statement)
+
+    @threaded
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock up front, so concurrent processes
+        # serialize instead of failing on lock upgrade
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+
+    def query(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchone()
+
+    def table_columns(self, cursor, table):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {row[1] for row in cursor.fetchall()}
+
+    def migrate_guild_partitioning(self, cursor):
+        """Add guild_id to databases created before multi-guild support"""
+        if "guild_id" not in self.table_columns(cursor, "users"):
+            # user_id was the primary key, so the table has to be rebuilt
+            cursor.execute("ALTER TABLE users RENAME TO users_legacy")
+            cursor.execute(USERS_SCHEMA)
+            cursor.execute("""
+                INSERT INTO users (guild_id, user_id, xp, rank, streak, last_quest_date)
+                SELECT ?, user_id, xp, rank, streak, last_quest_date FROM users_legacy
+            """, (UNASSIGNED_GUILD_ID,))
+            cursor.execute("DROP TABLE users_legacy")
+
+        for table in GUILD_TABLES[1:]:
+            if "guild_id" not in self.table_columns(cursor, table):
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD COLUMN guild_id INTEGER NOT NULL DEFAULT {UNASSIGNED_GUILD_ID}"
+                )
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_quest_claims_unique'")
+        if not cursor.fetchone():
+            # older databases could hold duplicate claims, keep the first one
+            cursor.execute("""
+                DELETE FROM quest_claims WHERE rowid NOT IN (
+                    SELECT MIN(rowid) FROM quest_claims
+                    GROUP BY guild_id, user_id, quest_key, date
+                )
+            """)
+            cursor.execute("""
+                CREATE UNIQUE INDEX idx_quest_claims_unique
+                ON quest_claims (guild_id, user_id, quest_key, date)
+            """)
+
+    def migrate_xp_ledger(self, cursor):
+        """Type xp_log entries, logging XP the log never saw as opening balances"""
+        if "source" in self.table_columns(cursor, "xp_log"):
+            return
+
+        cursor.execute("ALTER TABLE xp_log ADD COLUMN source TEXT")
+        cursor.execute("""
+            INSERT INTO xp_log (guild_id, user_id, xp, timestamp, source)
+            SELECT u.guild_id, u.user_id, u.xp - COALESCE(l.xp, 0), ?, 'opening'
+            FROM users u
+            LEFT JOIN (
+                SELECT guild_id, user_id, SUM(xp) AS xp FROM xp_log GROUP BY guild_id, user_id
+            ) l ON l.guild_id = u.guild_id AND l.user_id = u.user_id
+            WHERE u.xp != COALESCE(l.xp, 0)
+        """, (utc_now(),))
+
+    # ----- users -----
+
+    def select_user(self, guild_id, user_id):
+        return self.query_one("""
+            SELECT user_id, xp, rank, streak, last_quest_date FROM users
+            WHERE guild_id = ? AND user_id = ?
+        """, (guild_id, user_id))
+
+    @threaded
+    def get_user(self, guild_id, user_id):
+        user = self.select_user(guild_id, user_id)
+        if not user:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO users (guild_id, user_id, xp, rank, streak) VALUES (?, ?, 0, 1, 0)",
+                (guild_id, user_id)
+            )
+            user = self.select_user(guild_id, user_id)
+        return user
+
+    @threaded
+    def ensure_users(self, guild_id, user_ids):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO users (guild_id, user_id, xp, rank, streak) VALUES (?, ?, 0, 1, 0)",
+                [(guild_id, user_id) for user_id in user_ids]
+            )
+
+    def insert_user(self, cursor, guild_id, user_id):
+        cursor.execute(
+            "INSERT OR IGNORE INTO users (guild_id, user_id, xp, rank, streak) VALUES (?, ?, 0, 1, 0)",
+            (guild_id, user_id)
+        )
+
+    def increment_xp(self, cursor, guild_id, user_id, amount):
+        cursor.execute("""
+            UPDATE users SET xp = xp + ? WHERE guild_id = ? AND user_id = ?
+            RETURNING xp
+        """, (amount, guild_id, user_id))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def insert_xp_log(self, cursor, guild_id, user_id, amount, source):
+        cursor.execute(
+            "INSERT INTO xp_log (guild_id, user_id, xp, timestamp, source) VALUES (?, ?, ?, ?, ?)",
+            (guild_id, user_id, amount, utc_now(), source)
+        )
+
+    @threaded
+    def add_xp(self, guild_id, user_id, amount, source):
+        with self.transaction() as cursor:
+            new_xp = self.increment_xp(cursor, guild_id, user_id, amount)
+            if new_xp is not None:
+                self.insert_xp_log(cursor, guild_id, user_id, amount, source)
+        return new_xp
+
+    @threaded
+    def set_rank(self, guild_id, user_id, rank):
+        self.conn.execute(
+            "UPDATE users SET rank = ? WHERE guild_id = ? AND user_id = ?",
+            (rank, guild_id, user_id)
+        )
+
+    @threaded
+    def grant_xp(self, guild_id, grants, source):
+        now = utc_now()
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO users (guild_id, user_id, xp, rank, streak) VALUES (?, ?, 0, 1, 0)",
+                [(guild_id, user_id) for user_id, _ in grants]
+            )
+            cursor.executemany(
+                "UPDATE users SET xp = xp + ? WHERE guild_id = ? AND user_id = ?",
+                [(amount, guild_id, user_id) for user_id, amount in grants]
+            )
+            cursor.executemany(
+                "INSERT INTO xp_log (guild_id, user_id, xp, timestamp, source) VALUES (?, ?, ?, ?, ?)",
+                [(guild_id, user_id, amount, now, source) for user_id, amount in grants]
+            )
+
+            users = []
+            user_ids = [user_id for user_id, _ in grants]
+            for i in range(0, len(user_ids), SQLITE_MAX_PARAMS):
+                chunk = user_ids[i:i + SQLITE_MAX_PARAMS]
+                cursor.execute(
+                    f"SELECT user_id, xp, rank FROM users WHERE guild_id = ? AND user_id IN ({', '.join('?' * len(chunk))})",
+                    (guild_id, *chunk)
+                )
+                users.extend(cursor.fetchall())
+        return users
+
+    @threaded
+    def set_ranks(self, guild_id, ranks):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "UPDATE users SET rank = ? WHERE guild_id = ? AND user_id = ?",
+                [(rank, guild_id, user_id) for user_id, rank in ranks]
+            )
+
+    @threaded
+    def reset_user(self, guild_id, user_id):
+        with self.transaction() as cursor:
+            cursor.execute("SELECT xp FROM users WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return
+
+            cursor.execute(
+                "UPDATE users SET xp = 0, rank = 1 WHERE guild_id = ? AND user_id = ?",
+                (guild_id, user_id)
+            )
+            if row[0]:
+                self.insert_xp_log(cursor, guild_id, user_id, -row[0], "reset")
+
+    @threaded
+    def get_streak(self, guild_id, user_id):
+        return self.query_one(
+            "SELECT last_quest_date, streak FROM users WHERE guild_id = ? AND user_id = ?",
+            (guild_id, user_id)
+        )
+
+    @threaded
+    def set_streak(self, guild_id, user_id, streak, last_quest_date):
+        self.conn.execute(
+            "UPDATE users SET streak = ?, last_quest_date = ? WHERE guild_id = ? AND user_id = ?",
+            (streak, last_quest_date, guild_id, user_id)
+        )
+
+    @threaded
+    def reset_missed_streaks(self, before):
+        self.conn.execute("""
+            UPDATE users
+            SET streak = 0
+            WHERE last_quest_date IS NOT NULL
+            AND DATE(last_quest_date) < DATE(?)
+            AND streak != 0
+        """, (before,))
+
+    @threaded
+    def top_users(self, guild_id, limit):
+        return self.query("""
+            SELECT user_id, xp FROM users WHERE guild_id = ?
+            ORDER BY xp DESC LIMIT ?
+        """, (guild_id, limit))
+
+    @threaded
+    def adopt_legacy_rows(self, guild_id):
+        with self.transaction() as cursor:
+            for table in GUILD_TABLES:
+                cursor.execute(
+                    f"UPDATE OR IGNORE {table} SET guild_id = ? WHERE guild_id = ?",
+                    (guild_id, UNASSIGNED_GUILD_ID)
+                )
+        return self.query_one("SELECT COUNT(*) FROM users WHERE guild_id = ?", (UNASSIGNED_GUILD_ID,))[0]
+
+    # ----- claims -----
+
+    @threaded
+    def has_claimed(self, guild_id, user_id, quest_key, date):
+        return self.query_one("""
+            SELECT 1 FROM quest_claims
+            WHERE guild_id = ? AND user_id = ? AND quest_key = ? AND date = ?
+        """, (guild_id, user_id, quest_key, date)) is not None
+
+    @threaded
+    def record_claim(self, guild_id, user_id, quest_key, xp, date, source):
+        with self.transaction() as cursor:
+            cursor.execute("""
+                INSERT OR IGNORE INTO quest_claims (guild_id, user_id, quest_key, date)
+                VALUES (?, ?, ?, ?)
+            """, (guild_id, user_id, quest_key, date))
+            if cursor.rowcount == 0:
+                return None
+
+            # the claim's XP and its ledger entry need a row to land on
+            self.insert_user(cursor, guild_id, user_id)
+            new_xp = self.increment_xp(cursor, guild_id, user_id, xp)
+            self.insert_xp_log(cursor, guild_id, user_id, xp, source)
+            if source == "quest":
+                cursor.execute("""
+                    UPDATE quest_stats SET completions = completions + 1
+                    WHERE quest_key = ? AND quest_name = (
+                        SELECT quest_name FROM daily_quest_rotation WHERE quest_key = ? AND date = ?
+                    )
+                """, (quest_key, quest_key, date))
+        return new_xp
+
+    @threaded
+    def compact_claims(self, today, week_start):
+        with self.transaction() as cursor:
+            cursor.execute(f"""
+                INSERT INTO quest_completions (guild_id, user_id, quest_key, week_start, completions)
+                SELECT guild_id, user_id, {SQLITE_COMPLETION_KEY}, DATE(date, 'weekday 0', '-6 days'), COUNT(*)
+                FROM quest_claims
+                WHERE {SQLITE_COMPACTABLE_CLAIM}
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (guild_id, user_id, quest_key, week_start)
+                DO UPDATE SET completions = completions + excluded.completions
+            """, (week_start, today))
+            cursor.execute(f"DELETE FROM quest_claims WHERE {SQLITE_COMPACTABLE_CLAIM}", (week_start, today))
+            return cursor.rowcount
+
+    @threaded
+    def quest_completions(self, guild_id, user_id):
+        rows = self.query(f"""
+            SELECT quest_key, SUM(completions) FROM (
+                SELECT quest_key, completions FROM quest_completions
+                WHERE guild_id = ? AND user_id = ?
+                UNION ALL
+                SELECT {SQLITE_COMPLETION_KEY}, 1 FROM quest_claims
+                WHERE guild_id = ? AND user_id = ?
+            )
+            GROUP BY quest_key
+        """, (guild_id, user_id, guild_id, user_id))
+        return dict(rows)
+
+    @threaded
+    def current_claims(self, today, week_start):
+        return self.query(f"""
+            SELECT guild_id, user_id, {SQLITE_COMPLETION_KEY} FROM quest_claims
+            WHERE date = ? OR (date = ? AND quest_key LIKE '{WEEKLY_KEY_PREFIX}%')
+        """, (today, week_start))
+
+    # ----- xp ledger -----
+
+    @threaded
+    def snapshot_ledger(self):
+        with self.transaction() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(last_log_id), 0) FROM ledger_snapshots")
+            last_log_id = cursor.fetchone()[0]
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM xp_log")
+            head = cursor.fetchone()[0]
+            if head <= last_log_id:
+                return last_log_id
+
+            cursor.execute("""
+                INSERT INTO xp_snapshot (guild_id, user_id, xp)
+                SELECT guild_id, user_id, SUM(xp) FROM xp_log
+                WHERE id > ? AND id <= ?
+                GROUP BY guild_id, user_id
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET xp = xp_snapshot.xp + excluded.xp
+            """, (last_log_id, head))
+            cursor.execute(
+                "INSERT INTO ledger_snapshots (last_log_id, taken_at) VALUES (?, ?)",
+                (head, utc_now())
+            )
+        return head
+
+    def select_ledger_drift(self, cursor):
+        # one statement, so the snapshot and tail can't be read from different points in time
+        cursor.execute("""
+            SELECT u.guild_id, u.user_id, u.xp, COALESCE(s.xp, 0) + COALESCE(t.xp, 0) AS ledger_xp
+            FROM users u
+            LEFT JOIN xp_snapshot s ON s.guild_id = u.guild_id AND s.user_id = u.user_id
+            LEFT JOIN (
+                SELECT guild_id, user_id, SUM(xp) AS xp FROM xp_log
+                WHERE id > (SELECT COALESCE(MAX(last_log_id), 0) FROM ledger_snapshots)
+                GROUP BY guild_id, user_id
+            ) t ON t.guild_id = u.guild_id AND t.user_id = u.user_id
+            WHERE u.xp != ledger_xp
+        """)
+        return cursor.fetchall()
+
+    @threaded
+    def ledger_drift(self):
+        return self.select_ledger_drift(self.conn.cursor())
+
+    @threaded
+    def rebuild_balances(self):
+        with self.transaction() as cursor:
+            drift = self.select_ledger_drift(cursor)
+            cursor.executemany(
+                "UPDATE users SET xp = ? WHERE guild_id = ? AND user_id = ?",
+                [(ledger_xp, guild_id, user_id) for guild_id, user_id, _, ledger_xp in drift]
+            )
+        return len(drift)
+
+    # ----- rotations -----
+
+    @threaded
+    def get_seven_day_pool(self, quest_key):
+        result = self.query_one(
+            "SELECT used_quests, cycle_start FROM quest_seven_day_pool WHERE quest_key = ?",
+            (quest_key,)
+        )
+        if not result:
+            return None
+        used_quests_str, cycle_start = result
+        return (used_quests_str.split(',') if used_quests_str else []), cycle_start
+
+    @threaded
+    def save_seven_day_pool(self, quest_key, used_quests, cycle_start):
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM quest_seven_day_pool WHERE quest_key = ?", (quest_key,))
+            cursor.execute("""
+                INSERT INTO quest_seven_day_pool (quest_key, used_quests, cycle_start)
+                VALUES (?, ?, ?)
+            """, (quest_key, ','.join(used_quests), cycle_start))
+
+    @threaded
+    def daily_rotation_exists(self, date):
+        return self.query_one("SELECT 1 FROM daily_quest_rotation WHERE date = ? LIMIT 1", (date,)) is not None
+
+    @threaded
+    def save_daily_rotation(self, date, rows, pools=()):
+        with self.transaction() as cursor:
+            for quest_key, used_quests, cycle_start in pools:
+                cursor.execute("DELETE FROM quest_seven_day_pool WHERE quest_key = ?", (quest_key,))
+                cursor.execute("""
+                    INSERT INTO quest_seven_day_pool (quest_key, used_quests, cycle_start)
+                    VALUES (?, ?, ?)
+                """, (quest_key, ','.join(used_quests), cycle_start))
+            cursor.execute("SELECT quest_key, quest_name FROM daily_quest_rotation WHERE date = ?", (date,))
+            offered = set(cursor.fetchall())
+            cursor.execute("DELETE FROM daily_quest_rotation")
+            cursor.executemany("""
+                INSERT INTO daily_quest_rotation (rank, quest_key, quest_name, xp, date)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(rank, key, name, xp, date) for rank, key, name, xp in rows])
+            cursor.executemany("""
+                INSERT INTO quest_stats (quest_key, quest_name, offered, completions) VALUES (?, ?, 1, 0)
+                ON CONFLICT (quest_key, quest_name) DO UPDATE SET offered = offered + 1
+            """, [(key, name) for _, key, name, _ in rows if (key, name) not in offered])
+
+    @threaded
+    def get_daily_rotation(self, date):
+        rows = self.query(
+            "SELECT quest_key, quest_name, xp FROM daily_quest_rotation WHERE date = ?",
+            (date,)
+        )
+        return {key: (name, xp) for key, name, xp in rows}
+
+    @threaded
+    def quest_stats(self):
+        rows = self.query("SELECT quest_key, quest_name, offered, completions FROM quest_stats")
+        return {(key, name): (offered, completions) for key, name, offered, completions in rows}
+
+    @threaded
+    def weekly_rotation_exists(self, week_start):
+        return self.query_one(
+            "SELECT 1 FROM weekly_quest_rotation WHERE week_start = ? LIMIT 1", (week_start,)
+        ) is not None
+
+    @threaded
+    def save_weekly_rotation(self, week_start, rows):
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM weekly_quest_rotation")
+            cursor.executemany("""
+                INSERT INTO weekly_quest_rotation (rank, quest_name, xp, week_start)
+                VALUES (?, ?, ?, ?)
+            """, [(rank, name, xp, week_start) for rank, name, xp in rows])
+
+    @threaded
+    def get_weekly_rotation(self, week_start):
+        rows = self.query(
+            "SELECT rank, quest_name, xp FROM weekly_quest_rotation WHERE week_start = ?",
+            (week_start,)
+        )
+        return {rank: (name, xp) for rank, name, xp in rows}
+
+    # ----- posting, notifications, leases -----
+
+    @threaded
+    def legacy_post_logged(self, date):
+        return self.query_one("SELECT 1 FROM daily_quest_post_log WHERE date = ?", (date,)) is not None
+
+    @threaded
+    def posted_guilds(self, date):
+        return {row[0] for row in self.query("SELECT guild_id FROM guild_quest_post_log WHERE date = ?", (date,))}
+
+    @threaded
+    def rollover_journal(self, date):
+        self.conn.execute("DELETE FROM rollover_journal WHERE date < ?", (date,))
+        return dict(self.query(
+            "SELECT step, message_id FROM rollover_journal WHERE date = ? AND done = 1", (date,)
+        ))
+
+    @threaded
+    def begin_rollover_step(self, date, step, holder, ttl):
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO rollover_journal (date, step) VALUES (?, ?)", (date, step)
+            )
+            cursor.execute(
+                "SELECT holder, expires_at, attempts, done FROM rollover_journal WHERE date = ? AND step = ?",
+                (date, step)
+            )
+            current, expires_at, attempts, done = cursor.fetchone()
+            if done or (current not in (None, holder) and expires_at >= now):
+                return None
+            cursor.execute("""
+                UPDATE rollover_journal SET holder = ?, expires_at = ?, attempts = attempts + 1
+                WHERE date = ? AND step = ?
+            """, (holder, now + ttl, date, step))
+        return attempts
+
+    @threaded
+    def finish_rollover_step(self, date, step, message_id=None):
+        self.conn.execute("""
+            INSERT INTO rollover_journal (date, step, done, message_id) VALUES (?, ?, 1, ?)
+            ON CONFLICT (date, step) DO UPDATE SET done = 1, message_id = excluded.message_id
+        """, (date, step, message_id))
+
+    @threaded
+    def notified_guilds(self, date, slot):
+        self.conn.execute("DELETE FROM notification_log WHERE date < ?", (date,))
+        rows = self.query(
+            "SELECT guild_id FROM notification_log WHERE date = ? AND slot = ?",
+            (date, slot)
+        )
+        return {row[0] for row in rows}
+
+    @threaded
+    def mark_notified(self, guild_id, date, slot):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO notification_log (guild_id, date, slot) VALUES (?, ?, ?)",
+            (guild_id, date, slot)
+        )
+
+    @threaded
+    def acquire_lease(self, name, holder, ttl):
+        now = time.time()
+        # single statement, so SQLite's write lock makes it atomic across processes
+        self.conn.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        """, (name, holder, now + ttl, now))
+        return self.query_one("SELECT holder FROM leases WHERE name = ?", (name,))[0] == holder
+
+    @threaded
+    def release_lease(self, name, holder):
+        self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    # ----- rank selection -----
+
+    @threaded
+    def add_rank_selections(self, guild_id, message_id, user_ids):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO rank_selections (guild_id, user_id, message_id) VALUES (?, ?, ?)",
+                [(guild_id, user_id, message_id) for user_id in user_ids]
+            )
+
+    @threaded
+    def take_rank_selection(self, guild_id, user_id, message_id):
+        with self.transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM rank_selections WHERE guild_id = ? AND user_id = ? AND message_id = ?",
+                (guild_id, user_id, message_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+            cursor.execute("SELECT COUNT(*) FROM rank_selections WHERE message_id = ?", (message_id,))
+            return cursor.fetchone()[0]
+
+    @threaded
+    def drop_rank_selections(self, guild_id, user_ids):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "DELETE FROM rank_selections WHERE guild_id = ? AND user_id = ?",
+                [(guild_id, user_id) for user_id in user_ids]
+            )
+
+    # ----- stories -----
+
+    @threaded
+    def add_story(self, message_id, guild_id, author_id, date):
+        self.conn.execute("""
+            INSERT INTO story_posts (message_id, guild_id, author_id, xp_awarded, date_posted)
+            VALUES (?, ?, ?, 0, ?)
+        """, (message_id, guild_id, author_id, date))
+
+    @threaded
+    def active_stories(self, since):
+        return self.query("""
+            SELECT p.message_id, p.guild_id, p.author_id, p.date_posted, p.xp_awarded,
+                   (SELECT COUNT(*) FROM story_reactions r WHERE r.message_id = p.message_id),
+                   p.notice_id
+            FROM story_posts p WHERE p.date_posted >= ?
+        """, (since,))
+
+    @threaded
+    def set_story_notice(self, message_id, notice_id):
+        self.conn.execute("UPDATE story_posts SET notice_id = ? WHERE message_id = ?", (notice_id, message_id))
+
+    @threaded
+    def archive_stories(self, before):
+        with self.transaction() as cursor:
+            cursor.execute("""
+                INSERT OR IGNORE INTO story_archive (message_id, guild_id, author_id, xp_awarded, reactions, date_posted)
+                SELECT p.message_id, p.guild_id, p.author_id, p.xp_awarded,
+                       (SELECT COUNT(*) FROM story_reactions r WHERE r.message_id = p.message_id),
+                       p.date_posted
+                FROM story_posts p WHERE p.date_posted < ?
+            """, (before,))
+            cursor.execute("""
+                DELETE FROM story_reactions
+                WHERE message_id IN (SELECT message_id FROM story_posts WHERE date_posted < ?)
+            """, (before,))
+            cursor.execute("DELETE FROM story_posts WHERE date_posted < ?", (before,))
+            return cursor.rowcount
+
+    @threaded
+    def award_story_reaction(self, guild_id, message_id, reactor_id, date,
+                             xp_per_reaction, xp_max, reaction_cap):
+        with self.transaction() as cursor:
+            cursor.execute(
+                "SELECT author_id, xp_awarded FROM story_posts WHERE message_id = ?",
+                (message_id,)
+            )
+            story = cursor.fetchone()
+            if not story:
+                return None  # Not a story post
+
+            author_id, current_xp = story
+            if author_id == reactor_id or current_xp >= xp_max:
+                return None
+
+            cursor.execute("SELECT COUNT(*) FROM story_reactions WHERE message_id = ?", (message_id,))
+            if cursor.fetchone()[0] >= reaction_cap:
+                return None
+
+            cursor.execute(
+                "SELECT COUNT(*) FROM story_reactions WHERE guild_id = ? AND reactor_id = ? AND date = ?",
+                (guild_id, reactor_id, date)
+            )
+            if cursor.fetchone()[0] >= reaction_cap:
+                return None
+
+            cursor.execute("""
+                INSERT OR IGNORE INTO story_reactions (message_id, guild_id, reactor_id, date)
+                VALUES (?, ?, ?, ?)
+            """, (message_id, guild_id, reactor_id, date))
+            if cursor.rowcount == 0:
+                return None  # Reactor already gave XP for this story
+
+            xp_to_add = min(xp_per_reaction, xp_max - current_xp)
+            cursor.execute(
+                "UPDATE story_posts SET xp_awarded = xp_awarded + ? WHERE message_id = ?",
+                (xp_to_add, message_id)
+            )
+            # the author may never have used a command, and the XP has to
+            # land somewhere the ledger entry accounts for
+            self.insert_user(cursor, guild_id, author_id)
+            self.increment_xp(cursor, guild_id, author_id, xp_to_add)
+            self.insert_xp_log(cursor, guild_id, author_id, xp_to_add, "story")
+        return author_id, xp_to_add
+
+    # ----- seasons -----
+
+    @threaded
+    def end_season(self, guild_id, ended_at, today, week_start):
+        with self.transaction() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(season), 0) + 1 FROM seasons WHERE guild_id = ?", (guild_id,))
+            season = cursor.fetchone()[0]
+
+            cursor.execute("""
+                INSERT INTO season_standings (guild_id, season, user_id, xp, rank, streak, place)
+                SELECT guild_id, ?, user_id, xp, rank, streak, RANK() OVER (ORDER BY xp DESC)
+                FROM users WHERE guild_id = ? AND xp > 0
+            """, (season, guild_id))
+            members = cursor.rowcount
+            cursor.execute("""
+                INSERT INTO season_xp (guild_id, season, source, xp, events)
+                SELECT guild_id, ?, COALESCE(source, 'opening'), SUM(xp), COUNT(*)
+                FROM xp_log WHERE guild_id = ?
+                GROUP BY 1, 2, 3
+            """, (season, guild_id))
+            cursor.execute(
+                "INSERT INTO seasons (guild_id, season, ended_at, members) VALUES (?, ?, ?, ?)",
+                (guild_id, season, ended_at, members)
+            )
+
+            cursor.execute("""
+                INSERT OR REPLACE INTO role_resets (guild_id, user_id, old_rank)
+                SELECT guild_id, user_id, rank FROM users WHERE guild_id = ? AND rank > 1
+            """, (guild_id,))
+            cursor.execute("""
+                UPDATE users SET xp = 0, rank = 1, streak = 0, last_quest_date = NULL
+                WHERE guild_id = ? AND (xp != 0 OR rank != 1 OR streak != 0 OR last_quest_date IS NOT NULL)
+            """, (guild_id,))
+
+            # every balance is 0 now, so is the guild's ledger without its history
+            cursor.execute("DELETE FROM xp_log WHERE guild_id = ?", (guild_id,))
+            cursor.execute("DELETE FROM xp_snapshot WHERE guild_id = ?", (guild_id,))
+
+            cursor.execute(f"""
+                INSERT INTO quest_completions (guild_id, user_id, quest_key, week_start, completions)
+                SELECT guild_id, user_id, {SQLITE_COMPLETION_KEY}, DATE(date, 'weekday 0', '-6 days'), COUNT(*)
+                FROM quest_claims
+                WHERE guild_id = ? AND {SQLITE_COMPACTABLE_CLAIM}
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (guild_id, user_id, quest_key, week_start)
+                DO UPDATE SET completions = completions + excluded.completions
+            """, (guild_id, week_start, today))
+            cursor.execute(
+                f"DELETE FROM quest_claims WHERE guild_id = ? AND {SQLITE_COMPACTABLE_CLAIM}",
+                (guild_id, week_start, today)
+            )
+
+            # old stories stop earning XP
+            cursor.execute("DELETE FROM story_reactions WHERE guild_id = ?", (guild_id,))
+            cursor.execute("DELETE FROM story_posts WHERE guild_id = ?", (guild_id,))
+        return season, members
+
+    @threaded
+    def season_standings(self, guild_id, season, limit):
+        return self.query("""
+            SELECT user_id, xp, rank FROM season_standings
+            WHERE guild_id = ? AND season = ?
+            ORDER BY place LIMIT ?
+        """, (guild_id, season, limit))
+
+    @threaded
+    def role_reset_guilds(self):
+        return {row[0] for row in self.query("SELECT DISTINCT guild_id FROM role_resets")}
+
+    @threaded
+    def pending_role_resets(self, guild_id, limit):
+        return self.query(
+            "SELECT user_id, old_rank FROM role_resets WHERE guild_id = ? LIMIT ?",
+            (guild_id, limit)
+        )
+
+    @threaded
+    def finish_role_resets(self, guild_id, user_ids):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "DELETE FROM role_resets WHERE guild_id = ? AND user_id = ?",
+                [(guild_id, user_id) for user_id in user_ids]
+            )
+
+    # ----- bulk transfer -----
+
+    def backup_to(self, source, target_path):
+        target = sqlite3.connect(target_path)
+        try:
+            # one step: in WAL mode the backup's read lock doesn't block
+            # writers, and a stepped backup would restart on every write
+            source.backup(target)
+        finally:
+            target.close()
+
+    def backup_file_to(self, target_path):
+        source = sqlite3.connect(self.path, timeout=30)
+        try:
+            self.backup_to(source, target_path)
+        finally:
+            source.close()
+
+    @asynccontextmanager
+    async def snapshot(self, guild_id=None):
+        loop = asyncio.get_running_loop()
+        if guild_id is not None and self.path != ":memory:":
+            # one guild is read in place: a WAL read transaction sees a single
+            # point in time without blocking writers, no copy of the file needed
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            try:
+                conn.execute("PRAGMA query_only = ON")
+                await loop.run_in_executor(None, conn.execute, "BEGIN")
+                yield SQLiteSnapshot(conn, guild_id)
+            finally:
+                conn.close()
+            return
+
+        fd, snapshot_path = tempfile.mkstemp(
+            suffix=".snapshot.db", dir=os.path.dirname(os.path.abspath(self.path))
+        )
+        os.close(fd)
+        try:
+            if self.path == ":memory:":
+                await loop.run_in_executor(self.executor, self.backup_to, self.conn, snapshot_path)
+            else:
+                # separate connection and thread, the bot keeps using the DB thread
+                await loop.run_in_executor(None, self.backup_file_to, snapshot_path)
+
+            conn = sqlite3.connect(snapshot_path, check_same_thread=False)
+            try:
+                yield SQLiteSnapshot(conn, guild_id)
+            finally:
+                conn.close()
+        finally:
+            os.remove(snapshot_path)
+
+    @threaded
+    def populated_tables(self):
+        return [
+            table for table in EXPORT_TABLES
+            if self.query_one(f"SELECT 1 FROM {table} LIMIT 1") is not None
+        ]
+
+    @threaded
+    def import_rows(self, table, rows):
+        columns = EXPORT_TABLES[table]
+        placeholders = ", ".join("?" * len(columns))
+        with self.transaction() as cursor:
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                rows
+            )
+            return cursor.rowcount
+
+    async def finish_import(self):
+        # AUTOINCREMENT already tracks explicitly inserted xp_log ids
+        pass
+
+class SQLiteSnapshot:
+    def __init__(self, conn, guild_id=None):
+        self.conn = conn
+        self.guild_id = guild_id
+
+    async def chunks(self, table, size):
+        loop = asyncio.get_running_loop()
+        sql, params = f"SELECT {', '.join(EXPORT_TABLES[table])} FROM {table}", ()
+        if self.guild_id is not None:
+            sql, params = sql + " WHERE guild_id = ?", (self.guild_id,)
+        cursor = await loop.run_in_executor(None, self.conn.execute, sql, params)
+        while True:
+            rows = await loop.run_in_executor(None, cursor.fetchmany, size)
+            if not rows:
+                break
+            yield rows
+
+# ========================
+# POSTGRESQL BACKEND
+# ========================
+
+POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        xp INTEGER NOT NULL DEFAULT 0,
+        rank INTEGER NOT NULL DEFAULT 1,
+        streak INTEGER NOT NULL DEFAULT 0,
+        last_quest_date TEXT,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS xp_log (
+        id BIGSERIAL PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT,
+        xp INTEGER,
+        timestamp TEXT,
+        source TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS xp_snapshot (
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        xp INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ledger_snapshots (
+        last_log_id BIGINT PRIMARY KEY,
+        taken_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_quest_rotation (
+        rank TEXT,
+        quest_key TEXT,
+        quest_name TEXT,
+        xp INTEGER,
+        date TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quest_seven_day_pool (
+        quest_key TEXT PRIMARY KEY,
+        used_quests TEXT,
+        cycle_start TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quest_stats (
+        quest_key TEXT,
+        quest_name TEXT,
+        offered INTEGER NOT NULL DEFAULT 0,
+        completions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (quest_key, quest_name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS weekly_quest_rotation (
+        rank TEXT,
+        quest_name TEXT,
+        xp INTEGER,
+        week_start TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quest_claims (
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        quest_key TEXT NOT NULL,
+        date TEXT NOT NULL,
+        PRIMARY KEY (guild_id, user_id, quest_key, date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quest_completions (
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        quest_key TEXT NOT NULL,
+        week_start TEXT NOT NULL,
+        completions INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id, quest_key, week_start)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS story_posts (
+        message_id BIGINT PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        author_id BIGINT,
+        xp_awarded INTEGER NOT NULL DEFAULT 0,
+        date_posted TEXT,
+        notice_id BIGINT
+    )
+    """,
+    "ALTER TABLE story_posts ADD COLUMN IF NOT EXISTS notice_id BIGINT",
+    """
+    CREATE TABLE IF NOT EXISTS story_reactions (
+        message_id BIGINT,
+        guild_id BIGINT NOT NULL,
+        reactor_id BIGINT,
+        date TEXT,
+        PRIMARY KEY (message_id, reactor_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS story_archive (
+        message_id BIGINT PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        author_id BIGINT,
+        xp_awarded INTEGER NOT NULL,
+        reactions INTEGER NOT NULL,
+        date_posted TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS guild_quest_post_log (
+        guild_id BIGINT,
+        date TEXT,
+        PRIMARY KEY (guild_id, date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollover_journal (
+        date TEXT,
+        step TEXT,
+        holder TEXT,
+        expires_at DOUBLE PRECISION,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0,
+        message_id BIGINT,
+        PRIMARY KEY (date, step)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS notification_log (
+        guild_id BIGINT,
+        date TEXT,
+        slot INTEGER,
+        PRIMARY KEY (guild_id, date, slot)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT,
+        expires_at DOUBLE PRECISION
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rank_selections (
+        guild_id BIGINT,
+        user_id BIGINT,
+        message_id BIGINT NOT NULL,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS seasons (
+        guild_id BIGINT,
+        season INTEGER,
+        ended_at TEXT,
+        members INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, season)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS season_standings (
+        guild_id BIGINT,
+        season INTEGER,
+        user_id BIGINT,
+        xp INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        streak INTEGER NOT NULL,
+        place INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, season, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS season_xp (
+        guild_id BIGINT,
+        season INTEGER,
+        source TEXT,
+        xp BIGINT NOT NULL,
+        events INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, season, source)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS role_resets (
+        guild_id BIGINT,
+        user_id BIGINT,
+        old_rank INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_guild_xp ON users (guild_id, xp DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_xp_log_guild_user ON xp_log (guild_id, user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_story_posts_guild_date ON story_posts (guild_id, date_posted)",
+    "CREATE INDEX IF NOT EXISTS idx_story_posts_date ON story_posts (date_posted)",
+    "CREATE INDEX IF NOT EXISTS idx_story_reactions_guild_reactor ON story_reactions (guild_id, reactor_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_story_archive_guild_author ON story_archive (guild_id, author_id)",
+    "CREATE INDEX IF NOT EXISTS idx_rank_selections_message ON rank_selections (message_id)",
+    "CREATE INDEX IF NOT EXISTS idx_season_standings_place ON season_standings (guild_id, season, place)",
+]
+
+POSTGRES_COMPACTABLE_CLAIM = f"""
+    (date < $1 OR (date < $2 AND quest_key NOT LIKE '{WEEKLY_KEY_PREFIX}%'))
+"""
+POSTGRES_COMPLETION_KEY = f"""
+    CASE WHEN quest_key LIKE '{WEEKLY_KEY_PREFIX}%'
+    THEN substr(quest_key, 1, length(quest_key) - 11) ELSE quest_key END
+"""
+
+class PostgresStorage(Storage):
+    """
+    Backend for running several bot processes or hosts against one database.
+    Needs asyncpg (`pip install asyncpg`).
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError("PostgreSQL storage needs asyncpg: pip install asyncpg")
+
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn, conn.transaction():
+            for statement in POSTGRES_SCHEMA:
+                await conn.execute(statement)
+            await self.migrate_xp_ledger(conn)
+
+    async def migrate_xp_ledger(self, conn):
+        """Type xp_log entries, logging XP the log never saw as opening balances"""
+        typed = await conn.fetchval("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'xp_log' AND column_name = 'source'
+        """)
+        if typed:
+            return
+
+        await conn.execute("ALTER TABLE xp_log ADD COLUMN source TEXT")
+        await conn.execute("""
+            INSERT INTO xp_log (guild_id, user_id, xp, timestamp, source)
+            SELECT u.guild_id, u.user_id, u.xp - COALESCE(l.xp, 0), $1, 'opening'
+            FROM users u
+            LEFT JOIN (
+                SELECT guild_id, user_id, SUM(xp) AS xp FROM xp_log GROUP BY guild_id, user_id
+            ) l ON l.guild_id = u.guild_id AND l.user_id = u.user_id
+            WHERE u.xp != COALESCE(l.xp, 0)
+        """, utc_now())
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    # ----- users -----
+
+    async def get_user(self, guild_id, user_id):
+        # the row nearly always exists, so reads stay a single SELECT
+        row = await self.pool.fetchrow("""
+            SELECT user_id, xp, rank, streak, last_quest_date FROM users
+            WHERE guild_id = $1 AND user_id = $2
+        """, guild_id, user_id)
+        if row is None:
+            # DO UPDATE, so RETURNING has the row even if another call just created it
+            row = await self.pool.fetchrow("""
+                INSERT INTO users (guild_id, user_id) VALUES ($1, $2)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+                RETURNING user_id, xp, rank, streak, last_quest_date
+            """, guild_id, user_id)
+        return tuple(row)
+
+    async def ensure_users(self, guild_id, user_ids):
+        async with self.pool.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO users (guild_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                [(guild_id, user_id) for user_id in user_ids]
+            )
+
+    async def insert_xp_log(self, conn, guild_id, user_id, amount, source):
+        await conn.execute(
+            "INSERT INTO xp_log (guild_id, user_id, xp, timestamp, source) VALUES ($1, $2, $3, $4, $5)",
+            guild_id, user_id, amount, utc_now(), source
+        )
+
+    async def add_xp(self, guild_id, user_id, amount, source):
+        async with self.pool.acquire() as conn, conn.transaction():
+            new_xp = await conn.fetchval(
+                "UPDATE users SET xp = xp + $1 WHERE guild_id = $2 AND user_id = $3 RETURNING xp",
+                amount, guild_id, user_id
+            )
+            if new_xp is not None:
+                await self.insert_xp_log(conn, guild_id, user_id, amount, source)
+        return new_xp
+
+    async def set_rank(self, guild_id, user_id, rank):
+        await self.pool.execute(
+            "UPDATE users SET rank = $1 WHERE guild_id = $2 AND user_id = $3",
+            rank, guild_id, user_id
+        )
+
+    async def grant_xp(self, guild_id, grants, source):
+        user_ids = [user_id for user_id, _ in grants]
+        amounts = [amount for _, amount in grants]
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                INSERT INTO users (guild_id, user_id)
+                SELECT $1, user_id FROM unnest($2::bigint[]) AS g(user_id)
+                ON CONFLICT DO NOTHING
+            """, guild_id, user_ids)
+            rows = await conn.fetch("""
+                UPDATE users u SET xp = u.xp + g.amount
+                FROM unnest($2::bigint[], $3::int[]) AS g(user_id, amount)
+                WHERE u.guild_id = $1 AND u.user_id = g.user_id
+                RETURNING u.user_id, u.xp, u.rank
+            """, guild_id, user_ids, amounts)
+            await conn.execute("""
+                INSERT INTO xp_log (guild_id, user_id, xp, timestamp, source)
+                SELECT $1, user_id, amount, $4, $5 FROM unnest($2::bigint[], $3::int[]) AS g(user_id, amount)
+            """, guild_id, user_ids, amounts, utc_now(), source)
+        return [tuple(row) for row in rows]
+
+    async def set_ranks(self, guild_id, ranks):
+        await self.pool.executemany(
+            "UPDATE users SET rank = $1 WHERE guild_id = $2 AND user_id = $3",
+            [(rank, guild_id, user_id) for user_id, rank in ranks]
+        )
+
+    async def reset_user(self, guild_id, user_id):
+        async with self.pool.acquire() as conn, conn.transaction():
+            old_xp = await conn.fetchval(
+                "SELECT xp FROM users WHERE guild_id = $1 AND user_id = $2 FOR UPDATE",
+                guild_id, user_id
+            )
+            if old_xp is None:
+                return
+
+            await conn.execute(
+                "UPDATE users SET xp = 0, rank = 1 WHERE guild_id = $1 AND user_id = $2",
+                guild_id, user_id
+            )
+            if old_xp:
+                await self.insert_xp_log(conn, guild_id, user_id, -old_xp, "reset")
+
+    async def get_streak(self, guild_id, user_id):
+        row = await self.pool.fetchrow(
+            "SELECT last_quest_date, streak FROM users WHERE guild_id = $1 AND user_id = $2",
+            guild_id, user_id
+        )
+        return tuple(row) if row else None
+
+    async def set_streak(self, guild_id, user_id, streak, last_quest_date):
+        await self.pool.execute(
+            "UPDATE users SET streak = $1, last_quest_date = $2 WHERE guild_id = $3 AND user_id = $4",
+            streak, last_quest_date, guild_id, user_id
+        )
+
+    async def reset_missed_streaks(self, before):
+        await self.pool.execute("""
+            UPDATE users SET streak = 0
+            WHERE last_quest_date IS NOT NULL AND last_quest_date < $1 AND streak != 0
+        """, before)
+
+    async def top_users(self, guild_id, limit):
+        rows = await self.pool.fetch(
+            "SELECT user_id, xp FROM users WHERE guild_id = $1 ORDER BY xp DESC LIMIT $2",
+            guild_id, limit
+        )
+        return [tuple(row) for row in rows]
+
+    async def adopt_legacy_rows(self, guild_id):
+        # rows predating multi-guild support only exist in SQLite databases
+        return 0
+
+    # ----- claims -----
+
+    async def has_claimed(self, guild_id, user_id, quest_key, date):
+        return await self.pool.fetchval("""
+            SELECT 1 FROM quest_claims
+            WHERE guild_id = $1 AND user_id = $2 AND quest_key = $3 AND date = $4
+        """, guild_id, user_id, quest_key, date) is not None
+
+    async def record_claim(self, guild_id, user_id, quest_key, xp, date, source):
+        async with self.pool.acquire() as conn, conn.transaction():
+            # the claim's XP and its ledger entry need a row to land on
+            await conn.execute(
+                "INSERT INTO users (guild_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                guild_id, user_id
+            )
+            # lock the user row so concurrent XP writes for this user queue up
+            await conn.execute(
+                "SELECT 1 FROM users WHERE guild_id = $1 AND user_id = $2 FOR UPDATE",
+                guild_id, user_id
+            )
+
+            inserted = await conn.fetchval("""
+                INSERT INTO quest_claims (guild_id, user_id, quest_key, date)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            """, guild_id, user_id, quest_key, date)
+            if inserted is None:
+                return None
+
+            new_xp = await conn.fetchval(
+                "UPDATE users SET xp = xp + $1 WHERE guild_id = $2 AND user_id = $3 RETURNING xp",
+                xp, guild_id, user_id
+            )
+            await self.insert_xp_log(conn, guild_id, user_id, xp, source)
+            if source == "quest":
+                await conn.execute("""
+                    UPDATE quest_stats SET completions = completions + 1
+                    WHERE quest_key = $1 AND quest_name = (
+                        SELECT quest_name FROM daily_quest_rotation WHERE quest_key = $1 AND date = $2
+                    )
+                """, quest_key, date)
+        return new_xp
+
+    async def compact_claims(self, today, week_start):
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute(f"""
+                INSERT INTO quest_completions (guild_id, user_id, quest_key, week_start, completions)
+                SELECT guild_id, user_id, {POSTGRES_COMPLETION_KEY},
+                       date_trunc('week', date::date)::date::text, COUNT(*)
+                FROM quest_claims
+                WHERE {POSTGRES_COMPACTABLE_CLAIM}
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (guild_id, user_id, quest_key, week_start)
+                DO UPDATE SET completions = quest_completions.completions + EXCLUDED.completions
+            """, week_start, today)
+            status = await conn.execute(
+                f"DELETE FROM quest_claims WHERE {POSTGRES_COMPACTABLE_CLAIM}", week_start, today
+            )
+        return int(status.split()[-1])
+
+    async def quest_completions(self, guild_id, user_id):
+        rows = await self.pool.fetch(f"""
+            SELECT quest_key, SUM(completions)::int FROM (
+                SELECT quest_key, completions FROM quest_completions
+                WHERE guild_id = $1 AND user_id = $2
+                UNION ALL
+                SELECT {POSTGRES_COMPLETION_KEY}, 1 FROM quest_claims
+                WHERE guild_id = $1 AND user_id = $2
+            ) claims
+            GROUP BY quest_key
+        """, guild_id, user_id)
+        return {row[0]: row[1] for row in rows}
+
+    async def current_claims(self, today, week_start):
+        rows = await self.pool.fetch(f"""
+            SELECT guild_id, user_id, {POSTGRES_COMPLETION_KEY} FROM quest_claims
+            WHERE date = $1 OR (date = $2 AND quest_key LIKE '{WEEKLY_KEY_PREFIX}%')
+        """, today, week_start)
+        return [tuple(row) for row in rows]
+
+    # ----- xp ledger -----
+
+    async def snapshot_ledger(self):
+        async with self.pool.acquire() as conn, conn.transaction():
+            # ids are handed out before commit, so wait for in-flight writers
+            # to finish and hold new ones off until MAX(id) is final
+            await conn.execute("LOCK TABLE xp_log IN EXCLUSIVE MODE")
+            last_log_id = await conn.fetchval("SELECT COALESCE(MAX(last_log_id), 0) FROM ledger_snapshots")
+            head = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM xp_log")
+            if head <= last_log_id:
+                return last_log_id
+
+            await conn.execute("""
+                INSERT INTO xp_snapshot (guild_id, user_id, xp)
+                SELECT guild_id, user_id, SUM(xp) FROM xp_log
+                WHERE id > $1 AND id <= $2
+                GROUP BY guild_id, user_id
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET xp = xp_snapshot.xp + EXCLUDED.xp
+            """, last_log_id, head)
+            await conn.execute(
+                "INSERT INTO ledger_snapshots (last_log_id, taken_at) VALUES ($1, $2)",
+                head, utc_now()
+            )
+        return head
+
+    async def select_ledger_drift(self, conn):
+        rows = await conn.fetch("""
+            SELECT guild_id, user_id, xp, ledger_xp FROM (
+                SELECT u.guild_id, u.user_id, u.xp, COALESCE(s.xp, 0) + COALESCE(t.xp, 0) AS ledger_xp
+                FROM users u
+                LEFT JOIN xp_snapshot s ON s.guild_id = u.guild_id AND s.user_id = u.user_id
+                LEFT JOIN (
+                    SELECT guild_id, user_id, SUM(xp) AS xp FROM xp_log
+                    WHERE id > (SELECT COALESCE(MAX(last_log_id), 0) FROM ledger_snapshots)
+                    GROUP BY guild_id, user_id
+                ) t ON t.guild_id = u.guild_id AND t.user_id = u.user_id
+            ) balances
+            WHERE xp != ledger_xp
+        """)
+        return [tuple(row) for row in rows]
+
+    async def ledger_drift(self):
+        async with self.pool.acquire() as conn:
+            return await self.select_ledger_drift(conn)
+
+    async def rebuild_balances(self):
+        async with self.pool.acquire() as conn, conn.transaction():
+            # blocks every XP writer (they all touch users first) but not readers
+            await conn.execute("LOCK TABLE users IN EXCLUSIVE MODE")
+            drift = await self.select_ledger_drift(conn)
+            await conn.executemany(
+                "UPDATE users SET xp = $1 WHERE guild_id = $2 AND user_id = $3",
+                [(ledger_xp, guild_id, user_id) for guild_id, user_id, _, ledger_xp in drift]
+            )
+        return len(drift)
+
+    # ----- rotations -----
+
+    async def get_seven_day_pool(self, quest_key):
+        row = await self.pool.fetchrow(
+            "SELECT used_quests, cycle_start FROM quest_seven_day_pool WHERE quest_key = $1",
+            quest_key
+        )
+        if not row:
+            return None
+        return (row["used_quests"].split(',') if row["used_quests"] else []), row["cycle_start"]
+
+    async def save_seven_day_pool(self, quest_key, used_quests, cycle_start):
+        await self.pool.execute("""
+            INSERT INTO quest_seven_day_pool (quest_key, used_quests, cycle_start)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (quest_key) DO UPDATE
+            SET used_quests = EXCLUDED.used_quests, cycle_start = EXCLUDED.cycle_start
+        """, quest_key, ','.join(used_quests), cycle_start)
+
+    async def daily_rotation_exists(self, date):
+        return await self.pool.fetchval(
+            "SELECT 1 FROM daily_quest_rotation WHERE date = $1 LIMIT 1", date
+        ) is not None
+
+    async def save_daily_rotation(self, date, rows, pools=()):
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.executemany("""
+                INSERT INTO quest_seven_day_pool (quest_key, used_quests, cycle_start)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (quest_key) DO UPDATE
+                SET used_quests = EXCLUDED.used_quests, cycle_start = EXCLUDED.cycle_start
+            """, [(quest_key, ','.join(used_quests), cycle_start) for quest_key, used_quests, cycle_start in pools])
+            offered = {
+                (row["quest_key"], row["quest_name"]) for row in await conn.fetch(
+                    "SELECT quest_key, quest_name FROM daily_quest_rotation WHERE date = $1 FOR UPDATE", date
+                )
+            }
+            await conn.execute("DELETE FROM daily_quest_rotation")
+            await conn.executemany("""
+                INSERT INTO daily_quest_rotation (rank, quest_key, quest_name, xp, date)
+                VALUES ($1, $2, $3, $4, $5)
+            """, [(rank, key, name, xp, date) for rank, key, name, xp in rows])
+            await conn.executemany("""
+                INSERT INTO quest_stats (quest_key, quest_name, offered, completions) VALUES ($1, $2, 1, 0)
+                ON CONFLICT (quest_key, quest_name) DO UPDATE SET offered = quest_stats.offered + 1
+            """, [(key, name) for _, key, name, _ in rows if (key, name) not in offered])
+
+    async def get_daily_rotation(self, date):
+        rows = await self.pool.fetch(
+            "SELECT quest_key, quest_name, xp FROM daily_quest_rotation WHERE date = $1", date
+        )
+        return {row["quest_key"]: (row["quest_name"], row["xp"]) for row in rows}
+
+    async def quest_stats(self):
+        rows = await self.pool.fetch("SELECT quest_key, quest_name, offered, completions FROM quest_stats")
+        return {(row["quest_key"], row["quest_name"]): (row["offered"], row["completions"]) for row in rows}
+
+    async def weekly_rotation_exists(self, week_start):
+        return await self.pool.fetchval(
+            "SELECT 1 FROM weekly_quest_rotation WHERE week_start = $1 LIMIT 1", week_start
+        ) is not None
+
+    async def save_weekly_rotation(self, week_start, rows):
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("DELETE FROM weekly_quest_rotation")
+            await conn.executemany("""
+                INSERT INTO weekly_quest_rotation (rank, quest_name, xp, week_start)
+                VALUES ($1, $2, $3, $4)
+            """, [(rank, name, xp, week_start) for rank, name, xp in rows])
+
+    async def get_weekly_rotation(self, week_start):
+        rows = await self.pool.fetch(
+            "SELECT rank, quest_name, xp FROM weekly_quest_rotation WHERE week_start = $1", week_start
+        )
+        return {row["rank"]: (row["quest_name"], row["xp"]) for row in rows}
+
+    # ----- posting, notifications, leases -----
+
+    async def legacy_post_logged(self, date):
+        return False
+
+    async def posted_guilds(self, date):
+        rows = await self.pool.fetch("SELECT guild_id FROM guild_quest_post_log WHERE date = $1", date)
+        return {row["guild_id"] for row in rows}
+
+    async def rollover_journal(self, date):
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM rollover_journal WHERE date < $1", date)
+            rows = await conn.fetch(
+                "SELECT step, message_id FROM rollover_journal WHERE date = $1 AND done = 1", date
+            )
+        return {row["step"]: row["message_id"] for row in rows}
+
+    async def begin_rollover_step(self, date, step, holder, ttl):
+        now = time.time()
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute(
+                "INSERT INTO rollover_journal (date, step) VALUES ($1, $2) ON CONFLICT DO NOTHING", date, step
+            )
+            row = await conn.fetchrow("""
+                SELECT holder, expires_at, attempts, done FROM rollover_journal
+                WHERE date = $1 AND step = $2 FOR UPDATE
+            """, date, step)
+            if row["done"] or (row["holder"] not in (None, holder) and row["expires_at"] >= now):
+                return None
+            await conn.execute("""
+                UPDATE rollover_journal SET holder = $3, expires_at = $4, attempts = attempts + 1
+                WHERE date = $1 AND step = $2
+            """, date, step, holder, now + ttl)
+        return row["attempts"]
+
+    async def finish_rollover_step(self, date, step, message_id=None):
+        await self.pool.execute("""
+            INSERT INTO rollover_journal (date, step, done, message_id) VALUES ($1, $2, 1, $3)
+            ON CONFLICT (date, step) DO UPDATE SET done = 1, message_id = EXCLUDED.message_id
+        """, date, step, message_id)
+
+    async def notified_guilds(self, date, slot):
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM notification_log WHERE date < $1", date)
+            rows = await conn.fetch(
+                "SELECT guild_id FROM notification_log WHERE date = $1 AND slot = $2", date, slot
+            )
+        return {row["guild_id"] for row in rows}
+
+    async def mark_notified(self, guild_id, date, slot):
+        await self.pool.execute("""
+            INSERT INTO notification_log (guild_id, date, slot) VALUES ($1, $2, $3)
+            ON CONFLICT DO NOTHING
+        """, guild_id, date, slot)
+
+    async def acquire_lease(self, name, holder, ttl):
+        now = time.time()
+        current = await self.pool.fetchval("""
+            INSERT INTO leases (name, holder, expires_at) VALUES ($1, $2, $3)
+            ON CONFLICT (name) DO UPDATE SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+            WHERE leases.holder = EXCLUDED.holder OR leases.expires_at < $4
+            RETURNING holder
+        """, name, holder, now + ttl, now)
+        return current == holder
+
+    async def release_lease(self, name, holder):
+        await self.pool.execute("DELETE FROM leases WHERE name = $1 AND holder = $2", name, holder)
+
+    # ----- rank selection -----
+
+    async def add_rank_selections(self, guild_id, message_id, user_ids):
+        await self.pool.executemany("""
+            INSERT INTO rank_selections (guild_id, user_id, message_id) VALUES ($1, $2, $3)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET message_id = EXCLUDED.message_id
+        """, [(guild_id, user_id, message_id) for user_id in user_ids])
+
+    async def take_rank_selection(self, guild_id, user_id, message_id):
+        async with self.pool.acquire() as conn, conn.transaction():
+            taken = await conn.fetchval("""
+                DELETE FROM rank_selections WHERE guild_id = $1 AND user_id = $2 AND message_id = $3
+                RETURNING 1
+            """, guild_id, user_id, message_id)
+            if taken is None:
+                return None
+            return await conn.fetchval("SELECT COUNT(*) FROM rank_selections WHERE message_id = $1", message_id)
+
+    async def drop_rank_selections(self, guild_id, user_ids):
+        await self.pool.execute(
+            "DELETE FROM rank_selections WHERE guild_id = $1 AND user_id = ANY($2::bigint[])",
+            guild_id, list(user_ids)
+        )
+
+    # ----- stories -----
+
+    async def add_story(self, message_id, guild_id, author_id, date):
+        await self.pool.execute("""
+            INSERT INTO story_posts (message_id, guild_id, author_id, xp_awarded, date_posted)
+            VALUES ($1, $2, $3, 0, $4)
+        """, message_id, guild_id, author_id, date)
+
+    async def active_stories(self, since):
+        rows = await self.pool.fetch("""
+            SELECT p.message_id, p.guild_id, p.author_id, p.date_posted, p.xp_awarded,
+                   (SELECT COUNT(*)::int FROM story_reactions r WHERE r.message_id = p.message_id),
+                   p.notice_id
+            FROM story_posts p WHERE p.date_posted >= $1
+        """, since)
+        return [tuple(row) for row in rows]
+
+    async def set_story_notice(self, message_id, notice_id):
+        await self.pool.execute("UPDATE story_posts SET notice_id = $1 WHERE message_id = $2", notice_id, message_id)
+
+    async def archive_stories(self, before):
+        async with self.pool.acquire() as conn, conn.transaction():
+            # FOR UPDATE waits out reactions being awarded on these stories
+            await conn.execute("SELECT 1 FROM story_posts WHERE date_posted < $1 FOR UPDATE", before)
+            await conn.execute("""
+                INSERT INTO story_archive (message_id, guild_id, author_id, xp_awarded, reactions, date_posted)
+                SELECT p.message_id, p.guild_id, p.author_id, p.xp_awarded,
+                       (SELECT COUNT(*) FROM story_reactions r WHERE r.message_id = p.message_id),
+                       p.date_posted
+                FROM story_posts p WHERE p.date_posted < $1
+                ON CONFLICT DO NOTHING
+            """, before)
+            await conn.execute("""
+                DELETE FROM story_reactions
+                WHERE message_id IN (SELECT message_id FROM story_posts WHERE date_posted < $1)
+            """, before)
+            status = await conn.execute("DELETE FROM story_posts WHERE date_posted < $1", before)
+        return int(status.split()[-1])
+
+    async def award_story_reaction(self, guild_id, message_id, reactor_id, date,
+                                   xp_per_reaction, xp_max, reaction_cap):
+        async with self.pool.acquire() as conn, conn.transaction():
+            story = await conn.fetchrow(
+                "SELECT author_id, xp_awarded FROM story_posts WHERE message_id = $1 FOR UPDATE",
+                message_id
+            )
+            if not story:
+                return None
+
+            author_id, current_xp = story["author_id"], story["xp_awarded"]
+            if author_id == reactor_id or current_xp >= xp_max:
+                return None
+
+            reactions = await conn.fetchval(
+                "SELECT COUNT(*) FROM story_reactions WHERE message_id = $1", message_id
+            )
+            if reactions >= reaction_cap:
+                return None
+
+            given_today = await conn.fetchval(
+                "SELECT COUNT(*) FROM story_reactions WHERE guild_id = $1 AND reactor_id = $2 AND date = $3",
+                guild_id, reactor_id, date
+            )
+            if given_today >= reaction_cap:
+                return None
+
+            inserted = await conn.fetchval("""
+                INSERT INTO story_reactions (message_id, guild_id, reactor_id, date)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            """, message_id, guild_id, reactor_id, date)
+            if inserted is None:
+                return None
+
+            xp_to_add = min(xp_per_reaction, xp_max - current_xp)
+            await conn.execute(
+                "UPDATE story_posts SET xp_awarded = xp_awarded + $1 WHERE message_id = $2",
+                xp_to_add, message_id
+            )
+            # the author may never have used a command, and the XP has to
+            # land somewhere the ledger entry accounts for
+            await conn.execute(
+                "INSERT INTO users (guild_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                guild_id, author_id
+            )
+            await conn.execute(
+                "UPDATE users SET xp = xp + $1 WHERE guild_id = $2 AND user_id = $3",
+                xp_to_add, guild_id, author_id
+            )
+            await self.insert_xp_log(conn, guild_id, author_id, xp_to_add, "story")
+        return author_id, xp_to_add
+
+    # ----- seasons -----
+
+    async def end_season(self, guild_id, ended_at, today, week_start):
+        async with self.pool.acquire() as conn, conn.transaction():
+            # XP writers lock or update the user row first, so holding the
+            # guild's rows keeps new ledger events out until the commit
+            await conn.execute("SELECT 1 FROM users WHERE guild_id = $1 FOR UPDATE", guild_id)
+            season = await conn.fetchval(
+                "SELECT COALESCE(MAX(season), 0) + 1 FROM seasons WHERE guild_id = $1", guild_id
+            )
+
+            status = await conn.execute("""
+                INSERT INTO season_standings (guild_id, season, user_id, xp, rank, streak, place)
+                SELECT guild_id, $1::int, user_id, xp, rank, streak, RANK() OVER (ORDER BY xp DESC)
+                FROM users WHERE guild_id = $2 AND xp > 0
+            """, season, guild_id)
+            members = int(status.split()[-1])
+            await conn.execute("""
+                INSERT INTO season_xp (guild_id, season, source, xp, events)
+                SELECT guild_id, $1::int, COALESCE(source, 'opening'), SUM(xp), COUNT(*)
+                FROM xp_log WHERE guild_id = $2
+                GROUP BY 1, 2, 3
+            """, season, guild_id)
+            await conn.execute(
+                "INSERT INTO seasons (guild_id, season, ended_at, members) VALUES ($1, $2, $3, $4)",
+                guild_id, season, ended_at, members
+            )
+
+            await conn.execute("""
+                INSERT INTO role_resets (guild_id, user_id, old_rank)
+                SELECT guild_id, user_id, rank FROM users WHERE guild_id = $1 AND rank > 1
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET old_rank = EXCLUDED.old_rank
+            """, guild_id)
+            await conn.execute("""
+                UPDATE users SET xp = 0, rank = 1, streak = 0, last_quest_date = NULL
+                WHERE guild_id = $1 AND (xp != 0 OR rank != 1 OR streak != 0 OR last_quest_date IS NOT NULL)
+            """, guild_id)
+
+            # every balance is 0 now, so is the guild's ledger without its history
+            await conn.execute("DELETE FROM xp_log WHERE guild_id = $1", guild_id)
+            await conn.execute("DELETE FROM xp_snapshot WHERE guild_id = $1", guild_id)
+
+            await conn.execute(f"""
+                INSERT INTO quest_completions (guild_id, user_id, quest_key, week_start, completions)
+                SELECT guild_id, user_id, {POSTGRES_COMPLETION_KEY},
+                       date_trunc('week', date::date)::date::text, COUNT(*)
+                FROM quest_claims
+                WHERE guild_id = $3 AND {POSTGRES_COMPACTABLE_CLAIM}
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (guild_id, user_id, quest_key, week_start)
+                DO UPDATE SET completions = quest_completions.completions + EXCLUDED.completions
+            """, week_start, today, guild_id)
+            await conn.execute(
+                f"DELETE FROM quest_claims WHERE guild_id = $3 AND {POSTGRES_COMPACTABLE_CLAIM}",
+                week_start, today, guild_id
+            )
+
+            # old stories stop earning XP
+            await conn.execute("DELETE FROM story_reactions WHERE guild_id = $1", guild_id)
+            await conn.execute("DELETE FROM story_posts WHERE guild_id = $1", guild_id)
+        return season, members
+
+    async def season_standings(self, guild_id, season, limit):
+        rows = await self.pool.fetch("""
+            SELECT user_id, xp, rank FROM season_standings
+            WHERE guild_id = $1 AND season = $2
+            ORDER BY place LIMIT $3
+        """, guild_id, season, limit)
+        return [tuple(row) for row in rows]
+
+    async def role_reset_guilds(self):
+        rows = await self.pool.fetch("SELECT DISTINCT guild_id FROM role_resets")
+        return {row[0] for row in rows}
+
+    async def pending_role_resets(self, guild_id, limit):
+        rows = await self.pool.fetch(
+            "SELECT user_id, old_rank FROM role_resets WHERE guild_id = $1 LIMIT $2",
+            guild_id, limit
+        )
+        return [tuple(row) for row in rows]
+
+    async def finish_role_resets(self, guild_id, user_ids):
+        await self.pool.execute(
+            "DELETE FROM role_resets WHERE guild_id = $1 AND user_id = ANY($2::bigint[])",
+            guild_id, list(user_ids)
+        )
+
+    # ----- bulk transfer -----
+
+    @asynccontextmanager
+    async def snapshot(self, guild_id=None):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                yield PostgresSnapshot(conn, guild_id)
+
+    async def populated_tables(self):
+        async with self.pool.acquire() as conn:
+            return [
+                table for table in EXPORT_TABLES
+                if await conn.fetchval(f"SELECT 1 FROM {table} LIMIT 1") is not None
+            ]
+
+    async def import_rows(self, table, rows):
+        columns = ", ".join(EXPORT_TABLES[table])
+        async with self.pool.acquire() as conn, conn.transaction():
+            # copied into a scratch table first, so one INSERT reports how many rows went in
+            await conn.execute(f"CREATE TEMP TABLE import_chunk (LIKE {table}) ON COMMIT DROP")
+            await conn.copy_records_to_table("import_chunk", records=rows, columns=EXPORT_TABLES[table])
+            status = await conn.execute(f"""
+                INSERT INTO {table} ({columns}) SELECT {columns} FROM import_chunk
+                ON CONFLICT DO NOTHING
+            """)
+        return int(status.split()[-1])
+
+    async def finish_import(self):
+        # imported xp_log ids bypass the sequence
+        await self.pool.execute("""
+            SELECT setval(pg_get_serial_sequence('xp_log', 'id'), COALESCE(MAX(id), 0) + 1, false)
+            FROM xp_log
+        """)
+
+class PostgresSnapshot:
+    def __init__(self, conn, guild_id=None):
+        self.conn = conn
+        self.guild_id = guild_id
+
+    async def chunks(self, table, size):
+        sql, params = f"SELECT {', '.join(EXPORT_TABLES[table])} FROM {table}", ()
+        if self.guild_id is not None:
+            sql, params = sql + " WHERE guild_id = $1", (self.guild_id,)
+        cursor = await self.conn.cursor(sql, *params)
+        while True:
+            rows = await cursor.fetch(size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+# ========================
+# BACKEND SELECTION
+# ========================
+
+def open_storage(url):
+    """
+    Build a backend from a DATABASE_URL. postgres:// and postgresql:// URLs
+    use PostgreSQL, sqlite:///path or a bare file path use SQLite.
+    """
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresStorage(url)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteStorage(url)
+
+# ========================
+# LEDGER MAINTENANCE
+# ========================
+
+async def run_ledger_command(storage, command):
+    """snapshot / check / rebuild the XP ledger from the command line"""
+    await storage.connect()
+    try:
+        start = time.perf_counter()
+        if command == "snapshot":
+            print(f"snapshot taken up to xp_log id {await storage.snapshot_ledger()}")
+        elif command == "check":
+            drift = await storage.ledger_drift()
+            for guild_id, user_id, stored_xp, ledger_xp in drift:
+                print(f"guild {guild_id} user {user_id}: users.xp {stored_xp}, ledger {ledger_xp}")
+            print(f"{len(drift)} users drifted from the ledger")
+        else:
+            print(f"{await storage.rebuild_balances()} balances rebuilt from the ledger")
+        print(f"took {time.perf_counter() - start:.2f}s")
+    finally:
+        await storage.close()
+
+if __name__ == "__main__":
+    commands = ("ledger-snapshot", "ledger-check", "ledger-rebuild")
+    if len(sys.argv) != 3 or sys.argv[1] not in commands:
+        sys.exit(f"usage: python storage.py {{{','.join(commands)}}} <DATABASE_URL>")
+
+    storage = open_storage(sys.argv[2])
+    asyncio.run(run_ledger_command(storage, sys.argv[1].removeprefix("ledger-")))
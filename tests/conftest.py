@@ -0,0 +1,61 @@
+import asyncio
+import inspect
+import itertools
+import os
+import sys
+import time
+from importlib.util import find_spec
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import open_storage
+
+# The PostgreSQL backend runs against a scratch database when this is set:
+#   TEST_POSTGRES_URL=postgresql://localhost/bot_test python -m pytest tests
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+# fresh ids for every test, so a reused scratch database never clashes
+ids = itertools.count(time.time_ns() // 1000, 10)
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def database_url(request, tmp_path):
+    if request.param == "sqlite":
+        return str(tmp_path / "bot.db")
+    if not POSTGRES_URL:
+        pytest.skip("set TEST_POSTGRES_URL to test the PostgreSQL backend")
+    if find_spec("asyncpg") is None:
+        pytest.skip("asyncpg is not installed")
+    return POSTGRES_URL
+
+@pytest.fixture
+def storage(database_url):
+    """A backend, connected for the duration of an async test"""
+    return open_storage(database_url)
+
+@pytest.fixture
+def guild():
+    """A guild id no other test uses. Ids up to guild + 9 are free too"""
+    return next(ids)
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Run `async def` tests on a fresh event loop"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+
+    kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    storage = kwargs.get("storage")
+
+    async def run():
+        if storage is not None:
+            await storage.connect()
+        try:
+            await pyfuncitem.obj(**kwargs)
+        finally:
+            if storage is not None:
+                await storage.close()
+
+    asyncio.run(run())
+    return True
@@ -0,0 +1,317 @@
+import asyncio
+
+from storage import WEEKLY_KEY_PREFIX, open_storage
+
+# The behaviour every Storage backend must share. Each test runs against
+# SQLite and, with TEST_POSTGRES_URL set, PostgreSQL (see conftest.py).
+USER = 42
+TODAY, WEEK = "2030-01-02", "2030-01-01"
+
+async def drift_in(storage, *guilds):
+    return [row for row in await storage.ledger_drift() if row[0] in guilds]
+
+# ----- users -----
+
+async def test_new_user(storage, guild):
+    assert tuple(await storage.get_user(guild, USER)) == (USER, 0, 1, 0, None)
+
+async def test_concurrent_reads_create_one_user(storage, guild):
+    rows = await asyncio.gather(*(storage.get_user(guild, USER) for _ in range(5)))
+    assert {tuple(row) for row in rows} == {(USER, 0, 1, 0, None)}
+
+async def test_guilds_are_partitioned(storage, guild):
+    await storage.get_user(guild, USER)
+    await storage.add_xp(guild, USER, 10, "admin")
+    assert (await storage.get_user(guild + 1, USER))[1] == 0
+
+async def test_add_xp_returns_the_total(storage, guild):
+    await storage.get_user(guild, USER)
+    assert await storage.add_xp(guild, USER, 10, "admin") == 10
+    assert await storage.add_xp(guild, USER, 5, "start_bonus") == 15
+
+async def test_set_rank(storage, guild):
+    await storage.get_user(guild, USER)
+    await storage.set_rank(guild, USER, 2)
+    assert (await storage.get_user(guild, USER))[2] == 2
+
+async def test_top_users(storage, guild):
+    await storage.ensure_users(guild, [USER, 43, 44])
+    await storage.add_xp(guild, USER, 65, "admin")
+    await storage.add_xp(guild, 43, 100, "admin")
+    assert [tuple(row) for row in await storage.top_users(guild, 2)] == [(43, 100), (USER, 65)]
+
+async def test_bulk_grant_creates_users(storage, guild):
+    await storage.ensure_users(guild, [43])
+    await storage.add_xp(guild, 43, 100, "admin")
+    granted = await storage.grant_xp(guild, [(43, 20), (45, 7)], "admin")
+    assert sorted(tuple(row) for row in granted) == [(43, 120, 1), (45, 7, 1)]
+
+async def test_bulk_ranks(storage, guild):
+    await storage.ensure_users(guild, [45])
+    await storage.set_ranks(guild, [(45, 2)])
+    assert (await storage.get_user(guild, 45))[2] == 2
+
+async def test_reset_user(storage, guild):
+    await storage.get_user(guild, USER)
+    await storage.add_xp(guild, USER, 30, "admin")
+    await storage.set_rank(guild, USER, 2)
+    await storage.reset_user(guild, USER)
+    assert tuple((await storage.get_user(guild, USER))[1:3]) == (0, 1)
+
+# ----- streaks -----
+
+async def test_streak_lives_through_the_next_day(storage, guild):
+    await storage.get_user(guild, USER)
+    await storage.set_streak(guild, USER, 3, TODAY)
+    assert tuple(await storage.get_streak(guild, USER)) == (TODAY, 3)
+    await storage.reset_missed_streaks(TODAY)
+    assert tuple(await storage.get_streak(guild, USER)) == (TODAY, 3)
+    await storage.reset_missed_streaks("2030-01-04")
+    assert tuple(await storage.get_streak(guild, USER)) == (TODAY, 0)
+
+# ----- claims -----
+
+async def test_claim_awards_xp_once(storage, guild):
+    await storage.get_user(guild, USER)
+    assert not await storage.has_claimed(guild, USER, "initiate_1", TODAY)
+    assert await storage.record_claim(guild, USER, "initiate_1", 5, TODAY, "quest") == 5
+    assert await storage.has_claimed(guild, USER, "initiate_1", TODAY)
+    assert await storage.record_claim(guild, USER, "initiate_1", 5, TODAY, "quest") is None
+    assert (await storage.get_user(guild, USER))[1] == 5
+
+async def test_claims_are_per_guild(storage, guild):
+    await storage.record_claim(guild, USER, "initiate_1", 5, TODAY, "quest")
+    assert await storage.record_claim(guild + 1, USER, "initiate_1", 5, TODAY, "quest") == 5
+
+async def test_claim_creates_a_missing_user(storage, guild):
+    assert await storage.record_claim(guild, 47, "initiate_1", 5, TODAY, "quest") == 5
+    assert (await storage.get_user(guild, 47))[1] == 5
+    assert await drift_in(storage, guild) == []
+
+async def test_concurrent_claims_award_once(storage, database_url, guild):
+    # a second backend on the same database has its own connections (and,
+    # for SQLite, its own thread), so the claims really race each other
+    other = open_storage(database_url)
+    await other.connect()
+    try:
+        await storage.get_user(guild, USER)
+        claims = await asyncio.gather(*(
+            backend.record_claim(guild, USER, "initiate_2", 10, TODAY, "quest")
+            for backend in [storage, other] * 5
+        ))
+    finally:
+        await other.close()
+
+    assert sum(result is not None for result in claims) == 1
+    assert (await storage.get_user(guild, USER))[1] == 10
+    assert await drift_in(storage, guild) == []
+
+async def test_compaction_keeps_current_claims(storage, guild):
+    weekly_key = f"{WEEKLY_KEY_PREFIX}initiate_{WEEK}"
+    await storage.record_claim(guild, USER, "initiate_1", 5, TODAY, "quest")
+    await storage.record_claim(guild, USER, "initiate_1", 5, "2029-12-31", "quest")
+    await storage.record_claim(guild, USER, weekly_key, 15, WEEK, "weekly")
+    await storage.record_claim(guild, USER, f"{WEEKLY_KEY_PREFIX}initiate_2029-12-24", 15, "2029-12-24", "weekly")
+
+    # a reused scratch database also holds old claims of earlier runs
+    assert await storage.compact_claims(TODAY, WEEK) >= 2
+    assert await storage.compact_claims(TODAY, WEEK) == 0
+    assert not await storage.has_claimed(guild, USER, "initiate_1", "2029-12-31")
+    assert await storage.has_claimed(guild, USER, weekly_key, WEEK)
+    assert await storage.quest_completions(guild, USER) == {"initiate_1": 2, f"{WEEKLY_KEY_PREFIX}initiate": 2}
+    current = {tuple(row) for row in await storage.current_claims(TODAY, WEEK) if row[0] == guild}
+    assert current == {(guild, USER, "initiate_1"), (guild, USER, f"{WEEKLY_KEY_PREFIX}initiate")}
+    assert (await storage.get_user(guild, USER))[1] == 40
+
+# ----- xp ledger -----
+
+async def test_ledger_accounts_for_every_change(storage, guild):
+    story = guild
+    await storage.ensure_users(guild, [USER, 43])
+    await storage.add_xp(guild, USER, 10, "admin")
+    await storage.record_claim(guild, USER, "initiate_1", 5, TODAY, "quest")
+    await storage.grant_xp(guild, [(43, 20), (45, 7)], "admin")
+    await storage.add_story(story, guild, 43, TODAY)
+    await storage.award_story_reaction(guild, story, USER, TODAY, 2, 10, 3)
+    assert await drift_in(storage, guild) == []
+
+    head = await storage.snapshot_ledger()
+    assert await storage.snapshot_ledger() == head
+    await storage.reset_user(guild, USER)
+    await storage.grant_xp(guild, [(43, -20), (45, -7)], "admin")
+    assert await drift_in(storage, guild) == []
+
+# ----- rotations -----
+
+async def test_seven_day_pool_is_replaced(storage):
+    await storage.save_seven_day_pool("initiate_2", ["a", "b"], TODAY)
+    assert await storage.get_seven_day_pool("initiate_2") == (["a", "b"], TODAY)
+    await storage.save_seven_day_pool("initiate_2", ["c"], WEEK)
+    assert await storage.get_seven_day_pool("initiate_2") == (["c"], WEEK)
+
+async def test_daily_rotation_counts_offers_and_completions(storage, guild):
+    smile = f"Smile {guild}."
+    await storage.save_daily_rotation(TODAY, [("initiate", "initiate_1", smile, 5)])
+    await storage.save_daily_rotation(TODAY, [("initiate", "initiate_1", smile, 5)])
+    assert await storage.daily_rotation_exists(TODAY)
+    assert await storage.get_daily_rotation(TODAY) == {"initiate_1": (smile, 5)}
+
+    await storage.record_claim(guild, 43, "initiate_1", 5, TODAY, "quest")
+    await storage.record_claim(guild, 43, "initiate_1", 5, TODAY, "quest")
+    assert (await storage.quest_stats())[("initiate_1", smile)] == (1, 1)
+
+async def test_pools_are_saved_with_the_rotation(storage, guild):
+    smile = f"Smile {guild}."
+    await storage.save_daily_rotation(TODAY, [("initiate", "initiate_1", smile, 5)], [("initiate_2", ["d"], TODAY)])
+    assert await storage.get_seven_day_pool("initiate_2") == (["d"], TODAY)
+    assert (await storage.quest_stats())[("initiate_1", smile)] == (1, 0)
+
+async def test_weekly_rotation(storage):
+    await storage.save_weekly_rotation(WEEK, [("initiate", "Say hi.", 15)])
+    assert await storage.weekly_rotation_exists(WEEK)
+    assert await storage.get_weekly_rotation(WEEK) == {"initiate": ("Say hi.", 15)}
+
+# ----- rollover journal, notifications, leases -----
+
+async def test_rollover_step_is_held_until_finished(storage, guild):
+    post = f"post:{guild}:1"
+    assert await storage.begin_rollover_step(TODAY, post, "a", 60) == 0
+    assert await storage.begin_rollover_step(TODAY, post, "b", 60) is None
+    assert await storage.begin_rollover_step(TODAY, post, "a", -1) == 1
+    assert await storage.begin_rollover_step(TODAY, post, "b", 60) == 2
+    await storage.finish_rollover_step(TODAY, post, 99)
+    assert await storage.begin_rollover_step(TODAY, post, "b", 60) is None
+
+async def test_rollover_journal_lists_finished_steps(storage, guild):
+    post, generate = f"post:{guild}:1", f"generate:{guild}"
+    await storage.begin_rollover_step(TODAY, f"post:{guild}:2", "a", 60)
+    await storage.finish_rollover_step(TODAY, post, 99)
+    await storage.finish_rollover_step(TODAY, generate)
+    journal = {step: message_id for step, message_id in (await storage.rollover_journal(TODAY)).items()
+               if str(guild) in step}
+    assert journal == {post: 99, generate: None}
+
+    await storage.rollover_journal("2030-01-03")
+    assert post not in await storage.rollover_journal(TODAY)
+
+async def test_notifications_are_pruned(storage, guild):
+    await storage.mark_notified(guild, TODAY, 9)
+    assert guild in await storage.notified_guilds(TODAY, 9)
+    assert guild not in await storage.notified_guilds(TODAY, 13)
+    assert await storage.notified_guilds("2030-01-03", 9) == set()
+
+async def test_lease(storage, guild):
+    lease = f"test-{guild}"
+    assert await storage.acquire_lease(lease, "a", 60)
+    assert not await storage.acquire_lease(lease, "b", 60)
+    assert await storage.acquire_lease(lease, "a", 60)
+    await storage.release_lease(lease, "a")
+    assert await storage.acquire_lease(lease, "b", 60)
+    await storage.release_lease(lease, "b")
+
+# ----- rank selection -----
+
+async def test_rank_selection_is_taken_once(storage, guild):
+    message = guild
+    await storage.add_rank_selections(guild, message, [USER, 43])
+    assert await storage.take_rank_selection(guild, USER, message) == 1
+    assert await storage.take_rank_selection(guild, USER, message) is None
+    assert await storage.take_rank_selection(guild, 43, message + 1) is None
+    assert await storage.take_rank_selection(guild, 43, message) == 0
+
+async def test_dropped_rank_selections(storage, guild):
+    message = guild
+    await storage.add_rank_selections(guild, message, [USER, 43])
+    await storage.add_rank_selections(guild + 1, message, [USER])
+    await storage.drop_rank_selections(guild, [USER])
+    assert await storage.take_rank_selection(guild, USER, message) is None
+    assert await storage.take_rank_selection(guild + 1, USER, message) == 1
+
+# ----- stories -----
+
+async def test_story_reactions(storage, guild):
+    story = guild
+    await storage.get_user(guild, 43)
+    await storage.add_story(story, guild, 43, TODAY)
+    assert await storage.award_story_reaction(guild, story, 43, TODAY, 2, 10, 3) is None
+    assert await storage.award_story_reaction(guild, story, USER, TODAY, 2, 10, 3) == (43, 2)
+    assert await storage.award_story_reaction(guild, story, USER, TODAY, 2, 10, 3) is None
+    assert (await storage.get_user(guild, 43))[1] == 2
+
+async def test_story_reactions_are_capped(storage, guild):
+    story = guild
+    await storage.add_story(story, guild, 43, TODAY)
+    awarded = [await storage.award_story_reaction(guild, story, reactor, TODAY, 4, 10, 3) for reactor in range(50, 55)]
+    assert awarded == [(43, 4), (43, 4), (43, 2), None, None]
+
+async def test_reaction_for_a_new_author(storage, guild):
+    story = guild
+    await storage.add_story(story, guild, 46, TODAY)
+    assert await storage.award_story_reaction(guild, story, USER, TODAY, 2, 10, 3) == (46, 2)
+    assert (await storage.get_user(guild, 46))[1] == 2
+    assert await drift_in(storage, guild) == []
+
+async def test_active_stories(storage, guild):
+    story = guild
+    await storage.add_story(story, guild, 43, TODAY)
+    await storage.award_story_reaction(guild, story, USER, TODAY, 2, 10, 3)
+    await storage.set_story_notice(story, story + 1)
+    active = [tuple(row) for row in await storage.active_stories(TODAY) if row[0] == story]
+    assert active == [(story, guild, 43, TODAY, 2, 1, story + 1)]
+
+async def test_archived_stories_are_closed(storage, guild):
+    story = guild
+    await storage.add_story(story, guild, 43, "2029-12-01")
+    await storage.add_story(story + 1, guild, 43, TODAY)
+    assert await storage.archive_stories("2029-12-25") >= 1
+    assert await storage.award_story_reaction(guild, story, 44, TODAY, 2, 10, 3) is None
+    assert story + 1 in [row[0] for row in await storage.active_stories(TODAY)]
+
+# ----- seasons -----
+
+async def test_end_season(storage, guild):
+    story = guild
+    await storage.ensure_users(guild, [USER, 43, 44])
+    await storage.add_xp(guild, 43, 104, "admin")
+    await storage.record_claim(guild, USER, "initiate_1", 5, TODAY, "quest")
+    await storage.record_claim(guild + 1, USER, "initiate_1", 5, TODAY, "quest")
+    await storage.add_story(story, guild, 43, TODAY)
+
+    assert await storage.end_season(guild, "2030-01-02T05:00:00+00:00", TODAY, WEEK) == (1, 2)
+    assert await storage.season_standings(guild, 1, 5) == [(43, 104, 1), (USER, 5, 1)]
+    assert tuple((await storage.get_user(guild, 43))[1:4]) == (0, 1, 0)
+    assert (await storage.get_user(guild + 1, USER))[1] == 5
+    assert await storage.has_claimed(guild, USER, "initiate_1", TODAY)
+    assert await storage.award_story_reaction(guild, story, 44, TODAY, 2, 10, 3) is None
+    assert await storage.pending_role_resets(guild, 10) == []
+    assert await drift_in(storage, guild, guild + 1) == []
+
+async def test_end_season_queues_role_resets(storage, guild):
+    await storage.get_user(guild, USER)
+    await storage.set_rank(guild, USER, 3)
+    await storage.add_xp(guild, USER, 700, "admin")
+    assert await storage.end_season(guild, "2030-01-02T05:00:00+00:00", TODAY, WEEK) == (1, 1)
+    assert await storage.pending_role_resets(guild, 10) == [(USER, 3)]
+    assert guild in await storage.role_reset_guilds()
+    await storage.finish_role_resets(guild, [USER])
+    assert await storage.pending_role_resets(guild, 10) == []
+
+# ----- bulk transfer -----
+
+async def test_guild_snapshot(storage, guild):
+    for guild_id in (guild, guild + 1):
+        await storage.get_user(guild_id, USER)
+        await storage.add_xp(guild_id, USER, 10, "admin")
+
+    async with storage.snapshot(guild) as snapshot:
+        users = [row async for chunk in snapshot.chunks("users", 1) for row in chunk]
+        await storage.add_xp(guild, USER, 5, "admin")
+        log = [row async for chunk in snapshot.chunks("xp_log", 1) for row in chunk]
+    assert [(row[0], row[2]) for row in users] == [(guild, 10)]
+    assert [(row[1], row[3]) for row in log] == [(guild, 10)]
+
+async def test_import_counts_inserted_rows(storage, guild):
+    row = [guild, USER, 10, 1, 0, None]
+    assert await storage.import_rows("users", [row, [guild, USER + 1, 5, 1, 0, None]]) == 2
+    assert await storage.import_rows("users", [row]) == 0
+    assert "users" in await storage.populated_tables()
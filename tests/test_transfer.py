@@ -0,0 +1,29 @@
+import pytest
+
+from storage import open_storage
+from transfer import export_state, import_state
+
+USER = 42
+
+async def test_round_trip(storage, guild, tmp_path):
+    await storage.get_user(guild, USER)
+    await storage.add_xp(guild, USER, 30, "admin")
+    path = str(tmp_path / "export.jsonl.gz")
+    exported = await export_state(storage, path)
+
+    target = open_storage(str(tmp_path / "target.db"))
+    await target.connect()
+    try:
+        assert await import_state(target, path) == {table: count for table, count in exported.items() if count}
+        assert (await target.get_user(guild, USER))[1] == 30
+    finally:
+        await target.close()
+
+async def test_import_needs_an_empty_database(storage, guild, tmp_path):
+    await storage.get_user(guild, USER)
+    await storage.add_xp(guild, USER, 30, "admin")
+    path = str(tmp_path / "export.jsonl.gz")
+    await export_state(storage, path)
+
+    with pytest.raises(ValueError, match="users"):
+        await import_state(storage, path)
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import gzip
+import json
+
+from storage import EXPORT_TABLES, open_storage
+
+# ========================
+# EXPORT FORMAT
+# ========================
+
+# An export is newline-delimited JSON (gzipped if the path ends in .gz).
+# The first line is a header, then tables follow one after another:
+#   rows layout:    {"table": ..., "columns": [...]} then one JSON array per row
+#   columns layout: {"table": ..., "columns": [...], "data": [[col 1], [col 2], ...]}
+#                   per chunk of rows
+EXPORT_FORMAT = "guinea-pig-export"
+EXPORT_VERSION = 1
+EXPORT_LAYOUTS = ("rows", "columns")
+CHUNK_SIZE = 5000
+
+def open_export(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def write_chunk(out, table, columns, rows, layout):
+    if layout == "columns":
+        data = [list(column) for column in zip(*rows)]
+        out.write(json.dumps({"table": table, "columns": columns, "data": data}) + "\n")
+    else:
+        out.write("".join(json.dumps(list(row)) + "\n" for row in rows))
+
+def read_chunks(src, chunk_size):
+    """Yield (table, columns, rows) with at most `chunk_size` rows each"""
+    table, columns, rows = None, None, []
+
+    for line in src:
+        record = json.loads(line)
+
+        if isinstance(record, list):
+            rows.append(record)
+            if len(rows) >= chunk_size:
+                yield table, columns, rows
+                rows = []
+            continue
+
+        if rows:
+            yield table, columns, rows
+            rows = []
+
+        table, columns = record["table"], record["columns"]
+        if "data" in record:
+            yield table, columns, [list(row) for row in zip(*record["data"])]
+
+    if rows:
+        yield table, columns, rows
+
+def reorder(rows, columns, target_columns):
+    """Map rows from the file's column order to ours, missing columns become None"""
+    if columns == target_columns:
+        return rows
+    index = [columns.index(c) if c in columns else None for c in target_columns]
+    return [[row[i] if i is not None else None for i in index] for row in rows]
+
+# ========================
+# EXPORT / IMPORT
+# ========================
+
+async def export_state(storage, path, layout="rows", chunk_size=CHUNK_SIZE):
+    """
+    Stream a consistent snapshot of every table to `path`. Only one chunk is
+    held in memory, and encoding/compression run off the event loop.
+    Returns {table: rows written}.
+    """
+    if layout not in EXPORT_LAYOUTS:
+        raise ValueError(f"layout must be one of {EXPORT_LAYOUTS}")
+
+    loop = asyncio.get_running_loop()
+    counts = {}
+
+    with open_export(path, "w") as out:
+        header = {"format": EXPORT_FORMAT, "version": EXPORT_VERSION, "layout": layout}
+        out.write(json.dumps(header) + "\n")
+
+        async with storage.snapshot() as snapshot:
+            for table, columns in EXPORT_TABLES.items():
+                counts[table] = 0
+                if layout == "rows":
+                    out.write(json.dumps({"table": table, "columns": columns}) + "\n")
+
+                async for rows in snapshot.chunks(table, chunk_size):
+                    await loop.run_in_executor(None, write_chunk, out, table, columns, rows, layout)
+                    counts[table] += len(rows)
+
+    return counts
+
+async def import_state(storage, path, chunk_size=CHUNK_SIZE):
+    """
+    Stream an export into `storage`, one transaction per chunk. The target
+    must be empty: rows can't be merged with existing ones (xp_log ids
+    would collide and rotations have no key to dedupe on). Rows repeated
+    within the export are skipped. Returns {table: rows inserted}.
+    """
+    loop = asyncio.get_running_loop()
+    counts = {}
+
+    populated = await storage.populated_tables()
+    if populated:
+        raise ValueError(f"can only import into an empty database, this one has rows in {', '.join(populated)}")
+
+    with open_export(path, "r") as src:
+        header = json.loads(src.readline())
+        if header.get("format") != EXPORT_FORMAT or header.get("version") != EXPORT_VERSION:
+            raise ValueError(f"{path} is not a version {EXPORT_VERSION} export")
+
+        chunks = read_chunks(src, chunk_size)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+
+            table, columns, rows = chunk
+            if table not in EXPORT_TABLES:
+                continue  # table from a newer version
+
+            inserted = await storage.import_rows(table, reorder(rows, columns, EXPORT_TABLES[table]))
+            counts[table] = counts.get(table, 0) + inserted
+
+    await storage.finish_import()
+    return counts
+
+# ========================
+# COMMAND LINE
+# ========================
+
+async def main(args):
+    storage = open_storage(args.database_url)
+    await storage.connect()
+    try:
+        if args.command == "export":
+            counts = await export_state(storage, args.path, args.layout, args.chunk_size)
+        else:
+            counts = await import_state(storage, args.path, args.chunk_size)
+    finally:
+        await storage.close()
+
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move the game state between databases.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("database_url", help="SQLite file path or postgresql:// URL")
+    parser.add_argument("path", help="export file, gzipped if it ends in .gz")
+    parser.add_argument("--layout", choices=EXPORT_LAYOUTS, default="rows")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    asyncio.run(main(parser.parse_args()))